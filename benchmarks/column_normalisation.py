@@ -0,0 +1,260 @@
+# command-line argument parser
+import argparse
+
+# miscellaneous imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# pyspark
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, concat, length, lit, regexp_replace, substring, when
+
+# el_to_parquet is deployed as a standalone script, not as a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from el_to_parquet import HTML_TAG_PATTERN, normalize_columns, snake_case_name
+
+
+def create_local_spark_session(cores):
+    """Creates a local mode PySpark Session
+
+    Args:
+        cores (str): the number of local cores, '*' uses all available cores
+
+    Returns:
+        pyspark.sql.SparkSession: the created PySpark Session
+    """
+
+    return SparkSession.builder\
+        .master('local[{}]'.format(cores))\
+        .appName('manifold_column_normalisation_benchmark')\
+        .getOrCreate()
+
+
+def generate_listings(spark, rows, extra_columns):
+    """Generates a synthetic PySpark RDD shaped after the loaded sources, with missing values and HTML content
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session
+        rows (int): the number of rows to generate
+        extra_columns (int): the number of additional broker attributes, simulating a wider source
+
+    Returns:
+        pyspark.rdd.RDD: the generated PySpark RDD
+    """
+    identifier = col('id')
+
+    columns = [
+        lit('Century21').alias('Broker'),
+        identifier.cast('string').alias('ContractNumber'),
+        lit('Portugal').alias('Country'),
+        when(identifier % 10 == 0, lit(None)).otherwise(concat(lit('County '), (identifier % 308).cast('string'))).alias('County'),
+        when(identifier % 7 == 0, lit(None)).otherwise(concat(lit('Parish '), (identifier % 3092).cast('string'))).alias('Parish'),
+        concat(lit('<b>Listing</b> '), identifier.cast('string')).alias('Title'),
+        concat(lit('<p>' + 'Spacious apartment with a view. ' * 20 + '</p>'), identifier.cast('string')).alias('Description'),
+        when(identifier % 13 == 0, lit(None)).otherwise((identifier % 1000) * 1000.0).alias('PriceCurrencyFormated'),
+        lit('Apartamento').alias('PropertyType'),
+        (identifier % 4).cast('double').alias('Bathrooms'),
+        (identifier % 6).cast('double').alias('Bedrooms'),
+        when(identifier % 11 == 0, lit(None)).otherwise((identifier % 300).cast('double')).alias('AreaNet'),
+        lit(38.7).alias('Latitude'),
+        lit(-9.1).alias('Longitude'),
+    ]
+
+    columns.extend([(identifier % 100).cast('string').alias('ExtraAttribute{}'.format(index))
+                    for index in range(extra_columns)])
+
+    return spark.range(rows).select(columns)
+
+
+# the previous per-column normalisation chain, replaced in el_to_parquet by normalize_columns and kept as the baseline
+def clean_data(data):
+    """The previous per-column cleaning step, cleans the provided PySpark RDD by:
+           * replacing empty content
+           * removing HTML tags 
+           * standardizing column names
+
+    Args:
+        data (pyspark.rdd.RDD): the PySpark RDD containing the data
+
+    Returns:
+        pyspark.rdd.RDD: the cleaned PySpark RDD
+    """
+    # numeric attributes should have missing values replaced with -1
+    numeric_attributes = ['AreaNet', 'Bathrooms', 'Bedrooms',
+                          'PriceCurrencyFormated', 'Latitude', 'Longitude']
+    # textual attributes should have missing values replaced with "Unknown"
+    textual_attributes = ['Broker', 'Country', 'County',
+                          'Description', 'Parish', 'PropertyType', 'Title']
+
+    # replace missing numeric attributes with default values
+    data = data.fillna(-1, subset=numeric_attributes)
+
+    # replace missing textual attributes with default values
+    data = data.fillna("Unknown", subset=textual_attributes)
+
+    # remove html tags from the Description and Title attributes
+    data = data.withColumn('Description', regexp_replace("Description", HTML_TAG_PATTERN, "")). \
+        withColumn('Title', regexp_replace(
+            "Title", HTML_TAG_PATTERN, ""))
+
+    # rename the price column to match the database's
+    data = data.withColumnRenamed("PriceCurrencyFormated", "Price")
+
+    return data
+
+
+def limit_length(data, column_name, length_threshold):
+    """Truncates a column to a maximum length, effectivelly removing any content above the specified threshold.
+
+    Args:
+        data (pyspark.rdd.RDD): the target Pyspark RDD
+        column_name (str): the column to limit
+        length_threshold (int): the maximum column length, above which, data is deleted
+
+    Returns:
+        pyspark.rdd.RDD: the modified RDD
+    """
+    column_obj = col(column_name)
+
+    data = data.withColumn(column_name,
+                           when(length(column_obj) > length_threshold, substring(
+                               column_obj, 1, length_threshold)).otherwise(column_obj)
+                           )
+
+    return data
+
+
+def to_snake_case(data):
+    """Converts all column names in a given Spark RDD to snake case
+
+    Args:
+        data (pyspark.rdd.RDD): the target Pyspark RDD
+
+    Returns:
+        pyspark.rdd.RDD: the modified Pyspark RDD
+    """
+    # rename all columns to Snake Case using Uppercase as the delimiter
+    for column in data.columns:
+        new_column_name = snake_case_name(column)
+
+        # faster than using toDF(*columns)
+        data = data.withColumnRenamed(column, new_column_name)
+
+    return data
+
+
+def chained_normalisation(data):
+    """Applies the previous per-column normalisation chain
+
+    Args:
+        data (pyspark.rdd.RDD): the target PySpark RDD
+
+    Returns:
+        pyspark.rdd.RDD: the normalized PySpark RDD
+    """
+    data = clean_data(data)
+    data = limit_length(data, 'Description', 250)
+    data = limit_length(data, 'Title', 250)
+
+    return to_snake_case(data)
+
+
+def measure(spark, data, normalisation, output_path):
+    """Measures the plan analysis time and the job wall-clock time of a normalisation strategy
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session
+        data (pyspark.rdd.RDD): the source PySpark RDD
+        normalisation (callable): the normalisation strategy
+        output_path (str): the parquet output path
+
+    Returns:
+        dict: the measured timings, in seconds
+    """
+
+    # the DataFrame API analyzes every projection eagerly, building the plan includes the analysis cost
+    start = time.perf_counter()
+    normalized = normalisation(data)
+    analysis_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    normalized._jdf.queryExecution().executedPlan()
+    planning_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    normalized.write.parquet(output_path, mode='overwrite')
+    job_seconds = time.perf_counter() - start
+
+    return {
+        'analysis_seconds': analysis_seconds,
+        'planning_seconds': planning_seconds,
+        'job_seconds': job_seconds,
+        'columns': len(normalized.columns),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='column_normalisation',
+                                     description='Compares the chained column normalisation against the single projection in local mode'
+                                     )
+
+    parser.add_argument('-r', '--rows', type=int, default=100000,
+                        help='The number of synthetic rows')
+    parser.add_argument('-e', '--extra_columns', type=int, default=50,
+                        help='The number of additional broker attributes')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='The number of runs per strategy, the first run warms up the JVM')
+    parser.add_argument('-c', '--cores', type=str, default='*',
+                        help='The number of local Spark cores')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='The JSON report path, printed to stdout if not provided')
+
+    args = parser.parse_args()
+
+    spark = create_local_spark_session(args.cores)
+    data = generate_listings(spark, args.rows, args.extra_columns).cache()
+    data.count()
+
+    strategies = {
+        'chained': chained_normalisation,
+        'single_projection': normalize_columns,
+    }
+
+    output_root = tempfile.mkdtemp(prefix='manifold_benchmark_')
+    report = {
+        'rows': args.rows,
+        'extra_columns': args.extra_columns,
+        'results': {},
+    }
+
+    try:
+        for name, normalisation in strategies.items():
+            runs = [measure(spark, data, normalisation, os.path.join(output_root, name))
+                    for _ in range(args.repeat)]
+
+            # discard the warm up run whenever possible
+            runs = runs[1:] if len(runs) > 1 else runs
+
+            report['results'][name] = {
+                metric: min(run[metric] for run in runs) for metric in runs[0]
+            }
+    finally:
+        shutil.rmtree(output_root, ignore_errors=True)
+        spark.stop()
+
+    report_json = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# command-line argument parser
+import argparse
+
+# miscellaneous imports
+import json
+import os
+import resource
+import sys
+import time
+
+# the spiders are loaded by Scrapy from the crawler project folder, not as a package
+CRAWLER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crawler', 'python')
+
+sys.path.insert(0, CRAWLER_PATH)
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'assets.settings')
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+
+def parse_spider_arguments(arguments):
+    """Parses the spider arguments, as provided to scrapy crawl -a (e.g. district=Lisboa)
+
+    Args:
+        arguments (list): the key=value spider arguments
+
+    Returns:
+        dict: the spider arguments
+    """
+    spider_arguments = {}
+
+    for argument in arguments or []:
+        key, separator, value = argument.partition('=')
+
+        if not separator:
+            raise ValueError('crawl_replay:: invalid spider argument {}, expected key=value'.format(argument))
+
+        spider_arguments[key] = value
+
+    return spider_arguments
+
+
+def get_max_rss_mb():
+    """Retrieves the process' memory high-water mark
+
+    Returns:
+        float: the maximum resident set size, in MB
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # reported in bytes on macOS, in KB elsewhere
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def get_callback_profiles(stats):
+    """Groups the CallbackProfilerSpiderMiddleware stats per callback
+
+    Args:
+        stats (dict): the crawl stats
+
+    Returns:
+        dict: the calls, CPU seconds (total and per call), items and requests per callback
+    """
+    callbacks = {}
+
+    for key, value in stats.items():
+        if not key.startswith('profile/'):
+            continue
+
+        _, callback_name, metric = key.split('/', 2)
+        callbacks.setdefault(callback_name, {})[metric] = value
+
+    for profile in callbacks.values():
+        profile['cpu_seconds_per_call'] = profile.get('cpu_seconds', 0.0) / profile['calls'] if profile.get('calls') else None
+
+    return callbacks
+
+
+def get_concurrency_decisions(stats):
+    """Groups the AdaptiveConcurrency stats per domain (download slot)
+
+    Args:
+        stats (dict): the crawl stats
+
+    Returns:
+        dict: the decisions and last observed concurrency, delay, throughput, error rate and latencies per domain
+    """
+    domains = {}
+
+    for key, value in stats.items():
+        if not key.startswith('adaptive_concurrency/'):
+            continue
+
+        _, slot_key, metric = key.split('/', 2)
+        domains.setdefault(slot_key, {})[metric] = value
+
+    return domains
+
+
+def find_regressions(report, baseline, tolerance):
+    """Compares a replay report against a baseline report
+
+    Args:
+        report (dict): the current report
+        baseline (dict): the baseline report, as generated by a previous run
+        tolerance (float): the accepted relative degradation (e.g. 0.1 for 10%)
+
+    Returns:
+        list: the regressions found, empty if none
+    """
+    regressions = []
+
+    if report['items'] != baseline['items']:
+        regressions.append('items: {} scraped, {} in the baseline'.format(report['items'], baseline['items']))
+
+    if baseline['items_per_second'] and report['items_per_second'] < baseline['items_per_second'] * (1 - tolerance):
+        regressions.append('items_per_second: {:.2f}, {:.2f} in the baseline'.format(
+            report['items_per_second'], baseline['items_per_second']))
+
+    for callback_name, baseline_profile in baseline['callbacks'].items():
+        profile = report['callbacks'].get(callback_name, {})
+        baseline_cpu = baseline_profile.get('cpu_seconds_per_call')
+        current_cpu = profile.get('cpu_seconds_per_call')
+
+        if baseline_cpu and current_cpu and current_cpu > baseline_cpu * (1 + tolerance):
+            regressions.append('{} cpu_seconds_per_call: {:.6f}, {:.6f} in the baseline'.format(
+                callback_name, current_cpu, baseline_cpu))
+
+    if baseline['max_rss_mb'] and report['max_rss_mb'] > baseline['max_rss_mb'] * (1 + tolerance):
+        regressions.append('max_rss_mb: {:.1f}, {:.1f} in the baseline'.format(report['max_rss_mb'], baseline['max_rss_mb']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='crawl_replay',
+                                     description='Records a live crawl, or replays it offline reporting the spider throughput, CPU time per callback and memory high-water mark'
+                                     )
+
+    parser.add_argument('-s', '--spider', type=str, required=True,
+                        help='The spider name (e.g. pt_century21, pt_era)')
+    parser.add_argument('-a', '--argument', type=str, action='append', default=None,
+                        help='A spider argument, as key=value (e.g. district=Lisboa)')
+    parser.add_argument('-st', '--store', type=str, default='replay',
+                        help='The recorded responses folder')
+    parser.add_argument('-r', '--record', action='store_true',
+                        help='Crawls the live website, recording every response to the store')
+    parser.add_argument('-c', '--concurrency', type=int, default=256,
+                        help='The concurrent requests while replaying')
+    parser.add_argument('-ac', '--adaptive_concurrency', action='store_true',
+                        help='Enables the AdaptiveConcurrency extension, reporting its decisions per domain')
+    parser.add_argument('-b', '--baseline', type=str, default=None,
+                        help='A previous JSON report, failing (exit code 1) on regressions against it')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='The accepted relative degradation against the baseline')
+    parser.add_argument('-l', '--log_level', type=str, default='WARNING',
+                        help='The Scrapy log level')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='The JSON report path, printed to stdout if not provided')
+
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    settings.set('REPLAY_MODE', 'record' if args.record else 'replay')
+    settings.set('REPLAY_DIR', os.path.abspath(args.store))
+    settings.set('CALLBACK_PROFILER_ENABLED', True)
+    settings.set('TELNETCONSOLE_ENABLED', False)
+    settings.set('LOG_LEVEL', args.log_level)
+    settings.set('ADAPTIVE_CONCURRENCY_ENABLED', args.adaptive_concurrency)
+
+    # the replayed responses never reach the downloader, only the scheduling limits remain
+    if not args.record:
+        settings.set('CONCURRENT_REQUESTS', args.concurrency)
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', args.concurrency)
+        settings.set('DOWNLOAD_DELAY', 0)
+        settings.set('AUTOTHROTTLE_ENABLED', False)
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(args.spider)
+    process.crawl(crawler, **parse_spider_arguments(args.argument))
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    process.start()
+
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_seconds = time.process_time() - cpu_start
+
+    stats = crawler.stats.get_stats()
+    items = stats.get('item_scraped_count', 0)
+
+    report = {
+        'spider': args.spider,
+        'mode': 'record' if args.record else 'replay',
+        'items': items,
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': cpu_seconds,
+        'items_per_second': items / wall_seconds if wall_seconds else None,
+        'max_rss_mb': get_max_rss_mb(),
+        'callbacks': get_callback_profiles(stats),
+        'adaptive_concurrency': get_concurrency_decisions(stats),
+        'replay': {
+            'hits': stats.get('replay/hit', 0),
+            'misses': stats.get('replay/miss', 0),
+            'recorded': stats.get('replay/recorded', 0),
+        },
+    }
+
+    regressions = []
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(report, json.load(baseline_file), args.tolerance)
+
+        report['regressions'] = regressions
+
+    report_json = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report_json)
+    else:
+        print(report_json)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# command-line argument parser
+import argparse
+
+# miscellaneous imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from datetime import date
+from urllib.request import urlopen
+
+# pyspark
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession
+
+# el_to_parquet is deployed as a standalone script, not as a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from el_to_parquet import SOURCE_MANIFEST, load_sources, normalize_columns, create_dimensional_partitions
+from generate_listings import generate_listings
+
+
+# the stage metrics collected per pipeline step from the Spark monitoring API
+STAGE_METRICS = ['executorRunTime', 'inputBytes', 'outputBytes', 'shuffleReadBytes', 'shuffleWriteBytes',
+                 'memoryBytesSpilled', 'diskBytesSpilled']
+
+
+def create_local_spark_session(cores, shuffle_partitions):
+    """Creates a local mode PySpark Session with the monitoring API enabled
+
+    Args:
+        cores (str): the number of local cores, '*' uses all available cores
+        shuffle_partitions (int): the number of shuffle partitions
+
+    Returns:
+        pyspark.sql.SparkSession: the created PySpark Session
+    """
+
+    return SparkSession.builder\
+        .master('local[{}]'.format(cores))\
+        .appName('manifold_el_to_parquet_benchmark')\
+        .config('spark.ui.enabled', 'true')\
+        .config('spark.sql.shuffle.partitions', shuffle_partitions)\
+        .getOrCreate()
+
+
+def get_api(spark, endpoint):
+    """Queries the Spark monitoring API of the running application
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session
+        endpoint (str): the endpoint relative to the application, e.g. jobs
+
+    Returns:
+        object: the decoded JSON response
+    """
+    spark_context = spark.sparkContext
+    url = '{}/api/v1/applications/{}/{}'.format(spark_context.uiWebUrl, spark_context.applicationId, endpoint)
+
+    with urlopen(url) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def collect_stage_metrics(spark, job_groups):
+    """Aggregates the stage metrics of the jobs run by each job group prefix
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session
+        job_groups (list): the job group prefixes, e.g. write_ aggregates every output
+
+    Returns:
+        dict: the aggregated stage metrics per job group prefix
+    """
+    # the monitoring API is updated asynchronously, allow the listener to process the last events
+    time.sleep(2)
+
+    jobs = get_api(spark, 'jobs')
+    stages = {}
+
+    for stage in get_api(spark, 'stages?status=complete'):
+        stages[(stage['stageId'], stage['attemptId'])] = stage
+
+    metrics = {}
+
+    for job_group in job_groups:
+        group_metrics = dict.fromkeys(STAGE_METRICS, 0)
+        group_metrics['jobs'] = 0
+        group_metrics['stages'] = 0
+
+        for job in jobs:
+            if not (job.get('jobGroup') or '').startswith(job_group):
+                continue
+
+            group_metrics['jobs'] += 1
+
+            for (stage_id, _), stage in stages.items():
+                if stage_id in job['stageIds']:
+                    group_metrics['stages'] += 1
+
+                    for metric in STAGE_METRICS:
+                        group_metrics[metric] += stage.get(metric, 0)
+
+        metrics[job_group] = group_metrics
+
+    return metrics
+
+
+def get_output_sizes(output_path):
+    """Retrieves the number of Parquet files and bytes of each dataset written to a local path
+
+    Args:
+        output_path (str): the local parquet destination path
+
+    Returns:
+        dict: the number of files and bytes per dataset
+    """
+    sizes = {}
+
+    for dataset in sorted(os.listdir(output_path)):
+        # the datasets are the *.parquet folders, skipping the COPY manifests (manifests/) written alongside them
+        if not dataset.endswith('.parquet'):
+            continue
+
+        file_count = 0
+        byte_count = 0
+
+        for root, _, files in os.walk(os.path.join(output_path, dataset)):
+            for file_name in files:
+                if file_name.endswith('.parquet'):
+                    file_count += 1
+                    byte_count += os.path.getsize(os.path.join(root, file_name))
+
+        sizes[dataset] = {'files': file_count, 'bytes': byte_count}
+
+    return sizes
+
+
+def run_pipeline(spark, source_path, work_path, execution_date, output_options):
+    """Runs load_sources, normalize_columns and create_dimensional_partitions, timing each step
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session
+        source_path (str): the local folder holding the sources
+        work_path (str): the local folder where the quarantine and parquet outputs are written
+        execution_date (datetime.date): the execution date
+        output_options (dict): the to_parquet file sizing and compression options
+
+    Returns:
+        dict: the wall-clock time per step, in seconds, and the number of rows loaded
+    """
+    timings = {}
+    parquet_path = os.path.join(work_path, 'tmp') + '/'
+    quarantine_path = os.path.join(work_path, 'quarantine') + '/'
+
+    spark.sparkContext.setJobGroup('load_sources', 'Load the sources')
+    start = time.perf_counter()
+    base_data, raw_data = load_sources(spark, source_path, quarantine_path, {}, SOURCE_MANIFEST)
+    timings['load_sources'] = time.perf_counter() - start
+
+    spark.sparkContext.setJobGroup('normalize_columns', 'Normalize the sources')
+    start = time.perf_counter()
+    base_data = normalize_columns(base_data)
+    base_data.persist(StorageLevel.MEMORY_AND_DISK)
+    row_count = base_data.count()
+    timings['normalize_columns'] = time.perf_counter() - start
+
+    for data in raw_data:
+        data.unpersist()
+
+    # create_dimensional_partitions assigns a write_<dataset> job group per output
+    start = time.perf_counter()
+    create_dimensional_partitions(base_data, parquet_path, execution_date, output_options=output_options)
+    timings['create_dimensional_partitions'] = time.perf_counter() - start
+
+    base_data.unpersist()
+
+    return {'rows': row_count, 'seconds': timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='el_to_parquet_pipeline',
+                                     description='Benchmarks the el_to_parquet pipeline in local mode against synthetic sources'
+                                     )
+
+    parser.add_argument('-r', '--rows', type=int, default=10000,
+                        help='The number of synthetic listings to generate, e.g. 10k to 10M')
+    parser.add_argument('-s', '--source', type=str, default=None,
+                        help='A folder holding previously generated sources, skips the generation')
+    parser.add_argument('-c', '--cores', type=str, default='*',
+                        help='The number of local Spark cores')
+    parser.add_argument('-sp', '--shuffle_partitions', type=int, default=16,
+                        help='The number of shuffle partitions')
+    parser.add_argument('-of', '--output_files', type=int, default=None,
+                        help='The number of parquet files per dataset')
+    parser.add_argument('-oc', '--output_compression', type=str, default='snappy',
+                        help='The parquet compression codec')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='Keep the generated sources and outputs')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='The JSON report path, printed to stdout if not provided')
+
+    args = parser.parse_args()
+
+    spark = create_local_spark_session(args.cores, args.shuffle_partitions)
+    work_path = tempfile.mkdtemp(prefix='manifold_benchmark_')
+
+    report = {
+        'rows': args.rows,
+        'cores': args.cores,
+        'shuffle_partitions': args.shuffle_partitions,
+    }
+
+    try:
+        source_path = args.source
+
+        if source_path is None:
+            source_path = os.path.join(work_path, 'source') + '/'
+
+            spark.sparkContext.setJobGroup('generate', 'Generate the synthetic sources')
+            start = time.perf_counter()
+            report['generated'] = generate_listings(spark, args.rows, source_path)
+            report['generation_seconds'] = time.perf_counter() - start
+        elif not source_path.endswith('/'):
+            source_path = source_path + '/'
+
+        report.update(run_pipeline(spark, source_path, work_path, date.today(), {
+            'file_count': args.output_files,
+            'compression': args.output_compression,
+        }))
+
+        report['stages'] = collect_stage_metrics(spark, ['load_sources', 'normalize_columns', 'write_'])
+        report['outputs'] = get_output_sizes(os.path.join(work_path, 'tmp'))
+    finally:
+        spark.stop()
+
+        if args.keep:
+            print('Benchmark files kept in {}'.format(work_path))
+        else:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    report_json = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
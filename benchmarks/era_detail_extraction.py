@@ -0,0 +1,172 @@
+# command-line argument parser
+import argparse
+
+# miscellaneous imports
+import glob
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+from scrapy.http import HtmlResponse, Request
+
+# the spiders are loaded by Scrapy from the crawler project folder, not as a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crawler', 'python'))
+
+from assets.spiders.pt_era import PTEraSpider
+
+
+# the previous per-field lookups, one BeautifulSoup tree walk each, kept as the baseline
+BASELINE_LOOKUPS = [
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_ref'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_finalidade'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_tipo_imovel'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_preco_venda'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_distrito'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_concelho'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_freguesia'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_distrito'},
+    {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_area_bruta'},
+    {'name': 'meta', 'property': 'og:url'},
+    {'name': 'meta', 'property': 'og:title'},
+    {'name': 'meta', 'property': 'og:image'},
+]
+
+
+def load_pages(pages_path):
+    """Loads the saved ERA detail pages as Scrapy responses
+
+    Args:
+        pages_path (str): the folder holding the saved .html detail pages
+
+    Returns:
+        list: the loaded scrapy.http.HtmlResponse
+    """
+    responses = []
+
+    for page_path in sorted(glob.glob(os.path.join(pages_path, '*.html'))):
+        with open(page_path, 'rb') as page_file:
+            body = page_file.read()
+
+        url = 'https://www.era.pt/imovel/' + os.path.splitext(os.path.basename(page_path))[0]
+        responses.append(HtmlResponse(url=url, body=body, encoding='utf-8', request=Request(url)))
+
+    return responses
+
+
+def baseline_extraction(response):
+    """Extracts a detail page as previously done, building a full html.parser tree and walking it per field
+
+    Args:
+        response (scrapy.http.HtmlResponse): the detail page
+
+    Returns:
+        int: the number of fields found
+    """
+    html = BeautifulSoup(response.body.decode('utf-8'), 'html.parser')
+
+    found = sum(1 for lookup in BASELINE_LOOKUPS if html.find(**lookup) is not None)
+
+    header_content = html.select('.bloco-caracteristicas')
+
+    if header_content:
+        for icon_section in header_content[0].find_all('li'):
+            icon_section.find(lambda tag: tag.name == 'span' and tag.has_attr('title'))
+            icon_section.find('span', ['num'])
+
+    html.find('img', ['img_mapa', 'onclick'])
+
+    return found
+
+
+def plan_extraction(spider, response):
+    """Extracts a detail page through the spider's compiled extraction plan
+
+    Args:
+        spider (PTEraSpider): the spider
+        response (scrapy.http.HtmlResponse): the detail page
+
+    Returns:
+        int: the number of fields found
+    """
+    # responses cache their parsed document, a copy measures the parse as well
+    response = response.replace(body=response.body)
+
+    return sum(len(listing) for listing in spider._parse_detail(response) if listing is not None)
+
+
+def measure(extraction, responses, repeat):
+    """Measures the extraction throughput, in pages per CPU second (a single core)
+
+    Args:
+        extraction (callable): the extraction strategy, taking a response
+        responses (list): the detail pages
+        repeat (int): the number of passes over the pages
+
+    Returns:
+        dict: the pages per CPU second and the wall-clock seconds of the best pass
+    """
+    best_cpu_seconds = None
+    best_wall_seconds = None
+
+    for _ in range(repeat):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        for response in responses:
+            extraction(response)
+
+        cpu_seconds = time.process_time() - cpu_start
+        wall_seconds = time.perf_counter() - wall_start
+
+        if best_cpu_seconds is None or cpu_seconds < best_cpu_seconds:
+            best_cpu_seconds = cpu_seconds
+            best_wall_seconds = wall_seconds
+
+    return {
+        'pages_per_core_second': len(responses) / best_cpu_seconds if best_cpu_seconds else None,
+        'wall_seconds': best_wall_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='era_detail_extraction',
+                                     description='Measures the ERA detail page extraction throughput over saved pages'
+                                     )
+
+    parser.add_argument('-p', '--pages', type=str, required=True,
+                        help='The folder holding the saved ERA detail pages (.html)')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='The number of passes over the pages')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='The JSON report path, printed to stdout if not provided')
+
+    args = parser.parse_args()
+
+    responses = load_pages(args.pages)
+
+    if not responses:
+        raise ValueError('era_detail_extraction:: no .html pages found in {}'.format(args.pages))
+
+    spider = PTEraSpider()
+
+    report = {
+        'pages': len(responses),
+        'results': {
+            'baseline': measure(baseline_extraction, responses, args.repeat),
+            'extraction_plan': measure(lambda response: plan_extraction(spider, response), responses, args.repeat),
+        },
+    }
+
+    report_json = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
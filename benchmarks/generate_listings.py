@@ -0,0 +1,172 @@
+# command-line argument parser
+import argparse
+
+# pyspark
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import array, col, concat, format_number, lit, rand, struct, substring, to_json, translate, when
+
+
+# the synthetic sources, written as <prefix>.json folders to match the SOURCE_MANIFEST file patterns
+# the field names and value shapes follow each crawler's output: every attribute is text (e.g. "250.000 €", "80,5", "120 m²"),
+# unused fields are included to exercise the reader's pruning
+BROKERS = {
+    # Go crawler (Century21 API naming, crawler/go/common/listing.go), without Broker and Country attributes
+    'pt_century21': {
+        'ContractNumber': lambda identifier: concat(lit('C21-'), identifier.cast('string')),
+        'Title': lambda identifier: concat(lit('<b>Apartamento T'), (identifier % 6).cast('string'), lit('</b>')),
+        'Description': lambda identifier: concat(lit('<p>' + 'Apartamento com vista de mar. ' * 15 + '</p>'), identifier.cast('string')),
+        'Summary': lambda identifier: lit(''),
+        'Sold': lambda identifier: lit('false'),
+        'CrawledAt': lambda identifier: lit('2021-03-01T10:00:00Z'),
+        'PriceCurrencyFormated': lambda identifier: format_currency(((identifier * 7919) % 1000 + 50) * 1000),
+        'PropertyType': lambda identifier: when(identifier % 3 == 0, lit('Moradia')).otherwise(lit('Apartamento')),
+        'Latitude': lambda identifier: (37.0 + (identifier % 5000) / 1000.0).cast('string'),
+        'Longitude': lambda identifier: (-9.5 + (identifier % 3000) / 1000.0).cast('string'),
+        'URLSEOv2': lambda identifier: concat(lit('comprar/apartamento/'), identifier.cast('string')),
+        'Photo': lambda identifier: concat(lit('https://www.century21.pt/photos/'), identifier.cast('string'), lit('.jpg')),
+        'FullLocation': lambda identifier: lit('Portugal, Lisboa, Lisboa, Estrela, Lisboa'),
+        'County': lambda identifier: concat(lit('County '), (identifier % 308).cast('string')),
+        'Parish': lambda identifier: concat(lit('Parish '), (identifier % 3092).cast('string')),
+        'Bedrooms': lambda identifier: (identifier % 6).cast('string'),
+        'Bathrooms': lambda identifier: (identifier % 4 + 1).cast('string'),
+        'AreaGross': lambda identifier: (identifier % 400 + 40).cast('string'),
+        # Go writes the missing attributes as empty strings
+        'AreaNet': lambda identifier: when(identifier % 11 == 0, lit('')).otherwise(format_decimal(identifier % 300 + 30.5)),
+        'EnergyCertificate': lambda identifier: lit('B'),
+        'ParkingSpaces': lambda identifier: identifier % 3,
+        'Ammenities': lambda identifier: array(lit('Varanda'), lit('Elevador')),
+    },
+    # Scrapy crawler (ListingItem naming)
+    'pt_era': {
+        'broker': lambda identifier: lit('ERA Imobiliária'),
+        'id': lambda identifier: concat(lit('ERA-'), identifier.cast('string')),
+        'country': lambda identifier: lit('Portugal'),
+        'county': lambda identifier: concat(lit('County '), (identifier % 308).cast('string')),
+        'parish': lambda identifier: when(identifier % 7 == 0, lit(None)).otherwise(concat(lit('Parish '), (identifier % 3092).cast('string'))),
+        'name': lambda identifier: concat(lit('Moradia T'), (identifier % 6).cast('string')),
+        'description': lambda identifier: concat(lit('<div>' + 'Moradia com jardim e piscina. ' * 12 + '</div>'), identifier.cast('string')),
+        'asking_price': lambda identifier: format_currency(((identifier * 104729) % 2000 + 80) * 1000),
+        'property_type': lambda identifier: lit('Moradia'),
+        'bathrooms': lambda identifier: (identifier % 3 + 1).cast('string'),
+        'bedrooms': lambda identifier: (identifier % 5 + 1).cast('string'),
+        'net_area': lambda identifier: concat((identifier % 500 + 50).cast('string'), lit(' m²')),
+        'latitude': lambda identifier: (38.0 + (identifier % 4000) / 1000.0).cast('string'),
+        'longitude': lambda identifier: (-8.9 + (identifier % 2000) / 1000.0).cast('string'),
+        'summary': lambda identifier: concat(lit('Moradia para venda '), identifier.cast('string')),
+        'avatar_url': lambda identifier: concat(lit('https://www.era.pt/imagens/'), identifier.cast('string'), lit('.jpg')),
+        'listing_url': lambda identifier: concat(lit('https://www.era.pt/imovel/'), identifier.cast('string')),
+        'energy_certificate': lambda identifier: lit('B'),
+    },
+}
+
+# the sources written as a single (indented) JSON array per file, as the Go crawler does (json.MarshalIndent)
+# a truncated record would invalidate its whole file, their invalid records instead hold an unparsable latitude
+JSON_ARRAY_SOURCES = {'pt_century21': 'Latitude'}
+
+
+def format_currency(column):
+    """Formats an amount as the brokers' pt-PT prices, e.g. 250.000 €"""
+    return concat(translate(format_number(column, 0), ',', '.'), lit(' €'))
+
+
+def format_decimal(column):
+    """Formats a number with a decimal comma, e.g. 80,5"""
+    return translate(format_number(column, 1), ',.', '.,')
+
+
+def to_json_array(values):
+    """Joins a partition's JSON records into a single indented JSON array"""
+    yield '[\n ' + ',\n '.join(values) + '\n]'
+
+
+def generate_listings(spark, rows, output_path, era_ratio=0.3, corrupt_ratio=0.001, files=None, seed=42):
+    """Generates synthetic Century21 (JSON array) and ERA (JSON lines) shaped sources in output_path
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session
+        rows (int): the total number of listings
+        output_path (str): the destination folder, one <prefix>.json folder is created per broker
+        era_ratio (float, optional): the ratio of ERA listings. Defaults to 0.3
+        corrupt_ratio (float, optional): the ratio of invalid records, truncated or holding an unparsable value. Defaults to 0.001
+        files (int, optional): the number of files per broker, defaults to Spark's default parallelism
+        seed (int, optional): the random seed of the invalid records. Defaults to 42
+
+    Returns:
+        dict: the number of rows generated per broker
+    """
+    era_rows = int(rows * era_ratio)
+    broker_rows = {
+        'pt_century21': rows - era_rows,
+        'pt_era': era_rows,
+    }
+
+    for prefix, row_count in broker_rows.items():
+        identifier = col('id')
+        fields = BROKERS[prefix]
+        invalid_field = JSON_ARRAY_SOURCES.get(prefix)
+
+        columns = []
+
+        for name, expression in fields.items():
+            column = expression(identifier)
+
+            # invalidate a sample of the JSON array records, these should be quarantined by the pipeline
+            if name == invalid_field:
+                column = when(rand(seed) < corrupt_ratio, lit('n/a')).otherwise(column)
+
+            columns.append(column.alias(name))
+
+        records = spark.range(row_count, numPartitions=files or spark.sparkContext.defaultParallelism)\
+            .select(to_json(struct(columns)).alias('value'))
+
+        # truncate a sample of the JSON lines records, these should be quarantined by the pipeline
+        if invalid_field is None:
+            records = records.withColumn('value', when(rand(seed) < corrupt_ratio, substring(col('value'), 1, 20))
+                                         .otherwise(col('value')))
+        else:
+            records = spark.createDataFrame(records.rdd.map(lambda record: record.value).mapPartitions(to_json_array)
+                                            .map(lambda value: (value, )), 'value string')
+
+        records.write.text(output_path + prefix + '.json', mode='overwrite')
+
+    return broker_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='generate_listings',
+                                     description='Generates synthetic Century21 and ERA shaped JSON sources'
+                                     )
+
+    parser.add_argument('-r', '--rows', type=int, default=10000,
+                        help='The total number of listings, e.g. 10k to 10M')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='The destination folder')
+    parser.add_argument('-er', '--era_ratio', type=float, default=0.3,
+                        help='The ratio of ERA listings')
+    parser.add_argument('-cr', '--corrupt_ratio', type=float, default=0.001,
+                        help='The ratio of invalid JSON records')
+    parser.add_argument('-f', '--files', type=int, default=None,
+                        help='The number of files per broker')
+    parser.add_argument('-c', '--cores', type=str, default='*',
+                        help='The number of local Spark cores')
+
+    args = parser.parse_args()
+
+    spark = SparkSession.builder\
+        .master('local[{}]'.format(args.cores))\
+        .appName('manifold_generate_listings')\
+        .getOrCreate()
+
+    output_path = args.output if args.output.endswith('/') else args.output + '/'
+
+    try:
+        broker_rows = generate_listings(spark, args.rows, output_path, args.era_ratio, args.corrupt_ratio, args.files)
+    finally:
+        spark.stop()
+
+    for prefix, row_count in broker_rows.items():
+        print('Generated {} {} listings.'.format(row_count, prefix))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Define here the models for your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import math
+import time
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+
+
+@dataclass
+class DomainWindow:
+    # the download slot's current limits, applied to the slot once it exists
+    concurrency: int
+    delay: float
+    # the responses observed since the last decision
+    latencies: List[float] = field(default_factory=list)
+    responses: int = 0
+    throttled: int = 0
+    server_errors: int = 0
+    started_at: float = field(default_factory=time.time)
+    # replayed responses never reach a download slot, the window then stands in for it
+    simulated: bool = False
+
+
+class AdaptiveConcurrency:
+    # adjusts each domain's (download slot's) concurrency and delay every ADAPTIVE_CONCURRENCY_WINDOW responses, towards
+    # ADAPTIVE_CONCURRENCY_TARGET_THROUGHPUT responses per second without exceeding the latency and error rate ceilings:
+    #   - throttled (429) or failing (5xx) above ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE: halves the concurrency, doubles the delay
+    #   - latency percentile above ADAPTIVE_CONCURRENCY_MAX_LATENCY: one less concurrent request
+    #   - below the target throughput: removes the delay first, then raises the concurrency (Little's law estimate)
+    #   - otherwise holds
+    # every decision is exposed through the adaptive_concurrency/<slot>/* stats
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+
+        # both would set the slots' delay
+        if settings.getbool('AUTOTHROTTLE_ENABLED'):
+            raise NotConfigured('AdaptiveConcurrency::__init__ cannot run alongside AutoThrottle')
+
+        self._crawler = crawler
+        self._stats = crawler.stats
+
+        self._target_throughput: float = settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_THROUGHPUT')
+        self._min_concurrency: int = settings.getint('ADAPTIVE_CONCURRENCY_MIN_CONCURRENCY')
+        self._max_concurrency: int = settings.getint('ADAPTIVE_CONCURRENCY_MAX_CONCURRENCY')
+        self._start_concurrency: int = settings.getint('ADAPTIVE_CONCURRENCY_START_CONCURRENCY')
+        self._max_delay: float = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_DELAY')
+        self._window_size: int = settings.getint('ADAPTIVE_CONCURRENCY_WINDOW')
+        self._latency_percentile: float = settings.getfloat('ADAPTIVE_CONCURRENCY_LATENCY_PERCENTILE')
+        self._max_latency: float = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_LATENCY')
+        self._max_error_rate: float = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE')
+        self._debug: bool = settings.getbool('ADAPTIVE_CONCURRENCY_DEBUG')
+
+        if self._target_throughput <= 0 or self._min_concurrency < 1 or self._max_concurrency < self._min_concurrency or self._window_size < 1:
+            raise AttributeError('AdaptiveConcurrency::__init__ invalid settings')
+
+        self._start_concurrency = min(max(self._start_concurrency, self._min_concurrency), self._max_concurrency)
+
+        self._windows: Dict[str, DomainWindow] = {}
+
+        crawler.signals.connect(self._response_received, signal=signals.response_received)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    @staticmethod
+    def _percentile(values: List[float], percentile: float) -> Optional[float]:
+        # nearest-rank percentile
+        if not values:
+            return None
+
+        ordered_values: List[float] = sorted(values)
+        rank: int = max(1, math.ceil(percentile * len(ordered_values)))
+
+        return ordered_values[rank - 1]
+
+    def _response_received(self, response, request, spider):
+        slot_key: Optional[str] = request.meta.get('download_slot')
+        simulated: bool = slot_key is None
+
+        # the replayed responses (assets.middlewares.ReplayDownloaderMiddleware) never reach a download slot, their decisions are
+        # applied to a simulated slot keyed by domain, driven by the recorded latencies and statuses
+        if simulated:
+            slot_key = urlparse_cached(request).hostname or ''
+
+        window: Optional[DomainWindow] = self._windows.get(slot_key)
+
+        if window is None:
+            window = DomainWindow(concurrency=self._start_concurrency, delay=0.0, simulated=simulated)
+            self._windows[slot_key] = window
+            self._apply(slot_key, window)
+
+        latency: Optional[float] = request.meta.get('download_latency')
+
+        if latency is not None:
+            window.latencies.append(latency)
+
+        window.responses += 1
+
+        if response.status == 429:
+            window.throttled += 1
+        elif response.status >= 500:
+            window.server_errors += 1
+
+        if window.responses >= self._window_size:
+            self._decide(slot_key, window, spider)
+
+    def _decide(self, slot_key: str, window: DomainWindow, spider) -> None:
+        error_rate: float = (window.throttled + window.server_errors) / window.responses
+        median_latency: Optional[float] = self._percentile(window.latencies, 0.5)
+        latency: Optional[float] = self._percentile(window.latencies, self._latency_percentile)
+
+        if window.simulated and median_latency:
+            # replayed responses arrive as fast as they are read, the simulated slot sustains concurrency / (latency + delay)
+            throughput: float = window.concurrency / (median_latency + window.delay)
+        else:
+            throughput = window.responses / max(time.time() - window.started_at, 1e-6)
+
+        if error_rate > self._max_error_rate:
+            decision: str = 'backoff'
+            window.concurrency = max(self._min_concurrency, window.concurrency // 2)
+            window.delay = min(self._max_delay, max(window.delay * 2, 0.25))
+        elif latency is not None and latency > self._max_latency:
+            decision = 'decrease'
+            window.concurrency = max(self._min_concurrency, window.concurrency - 1)
+        elif throughput < self._target_throughput:
+            decision = 'increase'
+
+            if window.delay > 0:
+                window.delay = window.delay / 2 if window.delay / 2 >= 0.05 else 0.0
+            else:
+                # Little's law, the concurrency sustaining the target throughput at the observed latency
+                required_concurrency: int = math.ceil(self._target_throughput * median_latency) if median_latency else 0
+                window.concurrency = min(self._max_concurrency, max(window.concurrency + 1, required_concurrency))
+        else:
+            decision = 'hold'
+
+        stats_prefix: str = 'adaptive_concurrency/' + slot_key
+
+        self._stats.inc_value(stats_prefix + '/decisions')
+        self._stats.inc_value(stats_prefix + '/decisions/' + decision)
+        self._stats.set_value(stats_prefix + '/last_decision', decision)
+        self._stats.set_value(stats_prefix + '/throughput', throughput)
+        self._stats.set_value(stats_prefix + '/error_rate', error_rate)
+        self._stats.set_value(stats_prefix + '/latency_p50', median_latency)
+        self._stats.set_value(stats_prefix + '/latency_p{:g}'.format(self._latency_percentile * 100), latency)
+
+        if self._debug:
+            spider.logger.info('AdaptiveConcurrency %s: %s to concurrency %s and delay %.2fs (%.2f responses/s, %.1f%% errors, p50 latency %s)',
+                               slot_key, decision, window.concurrency, window.delay, throughput, error_rate * 100, median_latency)
+
+        self._apply(slot_key, window)
+
+        window.latencies = []
+        window.responses = 0
+        window.throttled = 0
+        window.server_errors = 0
+        window.started_at = time.time()
+
+    def _apply(self, slot_key: str, window: DomainWindow) -> None:
+        stats_prefix: str = 'adaptive_concurrency/' + slot_key
+
+        self._stats.set_value(stats_prefix + '/concurrency', window.concurrency)
+        self._stats.set_value(stats_prefix + '/delay', window.delay)
+
+        if window.simulated:
+            return
+
+        slot = self._crawler.engine.downloader.slots.get(slot_key)
+
+        if slot is not None:
+            slot.concurrency = window.concurrency
+            slot.delay = window.delay
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class CachedListing:
+    # the ContractNumber, or the listing URL when missing
+    key: str
+    listing_url: str
+    # the fingerprint of the search API's listing summary
+    fingerprint: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # the parsed ListingItem, as a dictionary
+    item: Dict[str, Any]
+    # the epoch of the last detail page fetch or revalidation
+    updated_at: float
+
+
+class ListingCache:
+    # persists the parsed listings between crawls in a local SQLite database, allowing unchanged listings to skip their detail page
+
+    _create_statement: str = '''
+        create table if not exists listings
+        (
+            key                 text primary key,
+            listing_url         text not null,
+            fingerprint         text not null,
+            etag                text,
+            last_modified       text,
+            item                text not null,
+            updated_at          real not null
+        );
+    '''
+
+    _select_statement: str = '''
+        select key, listing_url, fingerprint, etag, last_modified, item, updated_at from listings where key = ?;
+    '''
+
+    _upsert_statement: str = '''
+        insert or replace into listings (key, listing_url, fingerprint, etag, last_modified, item, updated_at) values (?, ?, ?, ?, ?, ?, ?);
+    '''
+
+    def __init__(self, path: str, max_age_days: int = 28, commit_interval: int = 500):
+        if path is None or len(path) == 0 or max_age_days < 0 or commit_interval < 1:
+            raise AttributeError('ListingCache::__init__ invalid arguments')
+
+        self.__max_age_seconds: float = max_age_days * 24 * 60 * 60
+        self.__commit_interval: int = commit_interval
+        self.__pending_writes: int = 0
+
+        self.__connection: sqlite3.Connection = sqlite3.connect(path)
+
+        # the crawl is the single writer, WAL avoids an fsync per write
+        self.__connection.execute('pragma journal_mode = wal;')
+        self.__connection.execute('pragma synchronous = normal;')
+        self.__connection.execute(self._create_statement)
+        self.__connection.commit()
+
+    @staticmethod
+    def get_key(contract_number: Optional[str], listing_url: str) -> str:
+        return str(contract_number) if contract_number else listing_url
+
+    @staticmethod
+    def get_fingerprint(summary: Dict[str, Any]) -> str:
+        # the key order of the API's JSON is not guaranteed, the summary is serialized sorted
+        serialized_summary: str = json.dumps(summary, sort_keys=True, default=str)
+
+        return hashlib.sha1(serialized_summary.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedListing]:
+        record = self.__connection.execute(self._select_statement, (key, )).fetchone()
+
+        if record is None:
+            return None
+
+        return CachedListing(key=record[0], listing_url=record[1], fingerprint=record[2], etag=record[3],
+                             last_modified=record[4], item=json.loads(record[5]), updated_at=record[6])
+
+    def is_fresh(self, cached_listing: CachedListing, fingerprint: str) -> bool:
+        '''
+        Whether the cached item can be reused as is, the listing summary being unchanged and the detail page recently fetched.
+        Past max_age_days the detail page is revalidated, catching changes absent from the summary (e.g. the ammenities)
+        '''
+        return cached_listing.fingerprint == fingerprint and time.time() - cached_listing.updated_at < self.__max_age_seconds
+
+    def put(self, key: str, listing_url: str, fingerprint: str, item: Dict[str, Any], etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> None:
+        self.__connection.execute(self._upsert_statement, (key, listing_url, fingerprint, etag, last_modified,
+                                                           json.dumps(dict(item), default=str), time.time()))
+
+        self.__pending_writes += 1
+
+        if self.__pending_writes >= self.__commit_interval:
+            self.commit()
+
+    def commit(self) -> None:
+        self.__connection.commit()
+        self.__pending_writes = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.__connection.close()
@@ -3,7 +3,17 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import scrapy
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+from scrapy.settings import Settings
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +111,147 @@ class AssetsDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class ReplayCacheStorage(FilesystemCacheStorage):
+    # Scrapy's HTTP cache storage (status, headers and body), also keeping each response's download latency
+    # replayed responses never reach the downloader, their recorded latency stands in for it (e.g. assets.extensions.AdaptiveConcurrency)
+
+    def store_response(self, spider, request, response):
+        super().store_response(spider, request, response)
+
+        latency: Optional[float] = request.meta.get('download_latency')
+
+        if latency is not None:
+            with self._open(Path(self._get_request_path(spider, request)) / 'download_latency', 'wb') as latency_file:
+                latency_file.write(repr(latency).encode('ascii'))
+
+    def retrieve_latency(self, spider, request) -> Optional[float]:
+        latency_path: Path = Path(self._get_request_path(spider, request)) / 'download_latency'
+
+        # stores recorded before the latencies were kept
+        if not latency_path.exists():
+            return None
+
+        with self._open(latency_path, 'rb') as latency_file:
+            return float(latency_file.read())
+
+
+class ReplayDownloaderMiddleware:
+    # records every downloaded response to a local store ('record'), or serves them back without any network access ('replay'),
+    # allowing full crawls to run offline and at maximum speed (see benchmarks/crawl_replay.py)
+    modes = ['record', 'replay']
+
+    def __init__(self, mode: str, storage: ReplayCacheStorage, stats):
+        self._mode = mode
+        self._storage = storage
+        self._stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mode: str = crawler.settings.get('REPLAY_MODE')
+
+        if not mode:
+            raise NotConfigured
+
+        if mode not in cls.modes:
+            raise ValueError('ReplayDownloaderMiddleware::from_crawler unknown REPLAY_MODE {}, expected one of {}'.format(mode, cls.modes))
+
+        # the responses are stored as Scrapy's HTTP cache, keyed by the request fingerprint and never expiring
+        storage_settings: Settings = Settings({
+            'HTTPCACHE_DIR': crawler.settings.get('REPLAY_DIR'),
+            'HTTPCACHE_EXPIRATION_SECS': 0,
+            'HTTPCACHE_GZIP': crawler.settings.getbool('REPLAY_GZIP'),
+        })
+
+        s = cls(mode, ReplayCacheStorage(storage_settings), crawler.stats)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if self._mode != 'replay':
+            return None
+
+        response = self._storage.retrieve_response(spider, request)
+
+        # requests missing from the store are dropped rather than sent, a replay never reaches the network
+        if response is None:
+            self._stats.inc_value('replay/miss')
+            raise IgnoreRequest('ReplayDownloaderMiddleware::process_request {} missing from the replay store'.format(request.url))
+
+        self._stats.inc_value('replay/hit')
+        response.flags.append('replayed')
+
+        # the recorded status is part of the stored response, the recorded latency is restored as the downloader would have set it
+        latency: Optional[float] = self._storage.retrieve_latency(spider, request)
+
+        if latency is not None:
+            request.meta['download_latency'] = latency
+
+        return response
+
+    def process_response(self, request, response, spider):
+        if self._mode == 'record' and 'replayed' not in response.flags:
+            self._storage.store_response(spider, request, response)
+            self._stats.inc_value('replay/recorded')
+
+        return response
+
+    def spider_opened(self, spider):
+        self._storage.open_spider(spider)
+        spider.logger.info('ReplayDownloaderMiddleware running in %s mode' % self._mode)
+
+    def spider_closed(self, spider):
+        self._storage.close_spider(spider)
+
+
+class CallbackProfilerSpiderMiddleware:
+    # measures the CPU time spent within each spider callback (e.g. parse, _parse_detail), exposed as the
+    # profile/<callback>/{calls,cpu_seconds,items,requests} stats
+    # note: must sit closest to the spider (highest order), timing the callback's output rather than other middlewares
+
+    def __init__(self, stats):
+        self._stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CALLBACK_PROFILER_ENABLED'):
+            raise NotConfigured
+
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        request = getattr(response, 'request', None)
+        callback_name: str = getattr(request.callback if request is not None else None, '__name__', 'parse')
+
+        stats_prefix: str = 'profile/' + callback_name
+        cpu_seconds: float = 0.0
+        counts: Dict[str, int] = {'items': 0, 'requests': 0}
+
+        # the callbacks are generators, their work happens as each output is pulled
+        iterator: Iterable[Any] = iter(result)
+
+        try:
+            while True:
+                start_time: float = time.process_time()
+
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    cpu_seconds += time.process_time() - start_time
+
+                if isinstance(output, scrapy.Request):
+                    counts['requests'] += 1
+                elif output is not None and is_item(output):
+                    counts['items'] += 1
+
+                yield output
+        finally:
+            # recorded even if the callback fails, the failing call's time being part of the profile
+            self._stats.inc_value(stats_prefix + '/calls')
+            self._stats.inc_value(stats_prefix + '/cpu_seconds', cpu_seconds)
+            self._stats.inc_value(stats_prefix + '/items', counts['items'])
+            self._stats.inc_value(stats_prefix + '/requests', counts['requests'])
@@ -44,21 +44,27 @@ TELNETCONSOLE_ENABLED = True
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    'assets.middlewares.AssetsSpiderMiddleware': 543,
-#}
+    # closest to the spider, timing the callbacks alone (enabled by CALLBACK_PROFILER_ENABLED)
+    'assets.middlewares.CallbackProfilerSpiderMiddleware': 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
+DOWNLOADER_MIDDLEWARES = {
 #    'assets.middlewares.AssetsDownloaderMiddleware': 543,
-#}
+    # the HTTP cache's position, storing and replaying the raw (still compressed) responses (enabled by REPLAY_MODE)
+    'assets.middlewares.ReplayDownloaderMiddleware': 900,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+    # enabled by ADAPTIVE_CONCURRENCY_ENABLED
+    'assets.extensions.AdaptiveConcurrency': 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -79,6 +85,21 @@ TELNETCONSOLE_ENABLED = True
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
+# Enable and configure the adaptive per-domain concurrency (disabled by default, exclusive with AutoThrottle)
+# Each domain's concurrency and delay are tuned every ADAPTIVE_CONCURRENCY_WINDOW responses towards the target
+# throughput (responses per second), backing off on latency or 429/5xx rates above the ceilings
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_CONCURRENCY_TARGET_THROUGHPUT = 20.0
+ADAPTIVE_CONCURRENCY_START_CONCURRENCY = 8
+ADAPTIVE_CONCURRENCY_MIN_CONCURRENCY = 1
+ADAPTIVE_CONCURRENCY_MAX_CONCURRENCY = 64
+ADAPTIVE_CONCURRENCY_MAX_DELAY = 30.0
+ADAPTIVE_CONCURRENCY_WINDOW = 50
+ADAPTIVE_CONCURRENCY_LATENCY_PERCENTILE = 0.9
+ADAPTIVE_CONCURRENCY_MAX_LATENCY = 5.0
+ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.02
+ADAPTIVE_CONCURRENCY_DEBUG = False
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
@@ -87,6 +108,27 @@ TELNETCONSOLE_ENABLED = True
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
+# Record and replay the crawled responses, allowing offline crawls and benchmarks (see benchmarks/crawl_replay.py)
+# None (disabled), 'record' (live crawl, storing every response) or 'replay' (offline, served from the store)
+REPLAY_MODE = None
+REPLAY_DIR = 'replay'
+REPLAY_GZIP = True
+
+# Reuse the previous crawls' listings whose search API summary is unchanged, skipping their detail page
+# past LISTING_CACHE_MAX_AGE_DAYS the detail page is revalidated through its ETag / Last-Modified
+LISTING_CACHE_ENABLED = False
+LISTING_CACHE_PATH = 'listing_cache.sqlite'
+LISTING_CACHE_MAX_AGE_DAYS = 28
+
+# The Century21 search API's page size ceiling (items_per_page spider argument), as the API documents no limit
+# each shard's first page, revealing its page count, is retried CENTURY21_FIRST_PAGE_RETRIES times before the shard is
+# recorded as failed (century21/failed_shards stats), flagging the crawl as incomplete
+CENTURY21_MAX_ITEMS_PER_PAGE = 100
+CENTURY21_FIRST_PAGE_RETRIES = 2
+
+# Expose each callback's CPU time as profile/<callback>/* stats
+CALLBACK_PROFILER_ENABLED = False
+
 
 
 # Log
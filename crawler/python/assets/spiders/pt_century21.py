@@ -2,12 +2,14 @@ import json
 import re
 
 from datetime import datetime
+from urllib.parse import quote_plus
 from typing import Any, Dict, List, Tuple, Union, Optional
 
 import scrapy
 
 from bs4 import BeautifulSoup, SoupStrainer
 from assets.items import ListingItem
+from assets.listing_cache import CachedListing, ListingCache
 
 
 class PTCentury21Spider(scrapy.Spider):
@@ -30,12 +32,27 @@ class PTCentury21Spider(scrapy.Spider):
     # Configuration
     __start_page: int = 1
     __items_per_page: int = 12
-    __district: str = None
+    # the largest page size requested from the search API (items_per_page argument), see CENTURY21_MAX_ITEMS_PER_PAGE
+    __max_items_per_page: int = 100
+    # the retries of a shard's first page, without which the shard is not crawled, see CENTURY21_FIRST_PAGE_RETRIES
+    __first_page_retries: int = 2
+    # the search pages in flight per shard once TotalPages is known (page_window argument), 0 requesting them all at once
+    __page_window: int = 0
+    # the searched districts (district argument), a single country wide search by default
+    __districts: List[Optional[str]] = [None]
+    # the shards searched by the 'all' district argument
+    __all_districts: List[str] = [
+        'Aveiro', 'Beja', 'Braga', 'Bragança', 'Castelo Branco', 'Coimbra', 'Évora', 'Faro', 'Guarda', 'Leiria', 'Lisboa',
+        'Portalegre', 'Porto', 'Santarém', 'Setúbal', 'Viana do Castelo', 'Vila Real', 'Viseu', 'Açores', 'Madeira',
+    ]
     __headers = {
         'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36',
         'host': 'www.century21.pt',
     }
     
+    # the previous crawls' parsed listings (enabled by LISTING_CACHE_ENABLED)
+    __listing_cache: Optional[ListingCache] = None
+    
     # maps the API's JSON structure to the ListingItem's
     __map_json: Dict[str, str] = {
         'ContractNumber': 'id',
@@ -55,23 +72,75 @@ class PTCentury21Spider(scrapy.Spider):
     def __init__(self, *args, **kwargs):
         super(PTCentury21Spider, self).__init__(*args, **kwargs)
         
+        # a single district, a comma-separated list of districts or 'all', each district being searched (sharded) separately
         district: str = getattr(self,'district', None)
         
         if district:
-            self.__district = district.strip()
+            if district.strip().lower() == 'all':
+                self.__districts = list(self.__all_districts)
+            else:
+                self.__districts = [district_name.strip() for district_name in district.split(',') if district_name.strip()]
+                
+        items_per_page: str = getattr(self, 'items_per_page', None)
+        
+        if items_per_page:
+            self.__items_per_page = max(int(items_per_page), 1)
+            
+        page_window: str = getattr(self, 'page_window', None)
+        
+        if page_window:
+            self.__page_window = max(int(page_window), 0)
+            
+        # the pagination state per shard (district): its TotalPages, next page to request and pages in flight
+        self.__search_shards: Dict[str, Dict[str, Optional[int]]] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(PTCentury21Spider, cls).from_crawler(crawler, *args, **kwargs)
+        
+        spider.__max_items_per_page = crawler.settings.getint('CENTURY21_MAX_ITEMS_PER_PAGE', spider.__max_items_per_page)
+        spider.__items_per_page = min(spider.__items_per_page, spider.__max_items_per_page)
+        spider.__first_page_retries = crawler.settings.getint('CENTURY21_FIRST_PAGE_RETRIES', spider.__first_page_retries)
+        
+        if crawler.settings.getbool('LISTING_CACHE_ENABLED'):
+            spider.__listing_cache = ListingCache(
+                path=crawler.settings.get('LISTING_CACHE_PATH'),
+                max_age_days=crawler.settings.getint('LISTING_CACHE_MAX_AGE_DAYS'),
+            )
+            
+        return spider
+    
+    def closed(self, reason: str):
+        if self.__listing_cache:
+            self.__listing_cache.close()
 
     def start_requests(self):
-        yield scrapy.Request(
-            url=self._generate_url(page_number= self.__start_page),
-            callback=self.parse,
-            headers=self.__headers,
-            dont_filter=False,
-        )
+        for district in self.__districts:
+            self.__search_shards[district or ''] = {
+                'total_pages': None,
+                'next_page': self.__start_page + 1,
+                'in_flight': 0,
+            }
+            
+            yield self.__generate_search_request(page_number= self.__start_page, district= district)
 
     def parse(self, response: scrapy.http.TextResponse):
         data_json: Dict = json.loads(response.body.decode("utf-8"))
         listings_json: Dict[str, Any] = {}
         
+        district: Optional[str] = response.meta.get('search_district')
+        shard: Optional[Dict[str, Optional[int]]] = self.__search_shards.get(district or '')
+        
+        # the first page reveals the number of pages, the remaining ones being requested at once (or in windows)
+        # rather than each after the previous one was parsed
+        if shard is not None:
+            if shard['total_pages'] is None:
+                shard['total_pages'] = data_json.get('TotalPages') or 0
+            else:
+                shard['in_flight'] -= 1
+                
+            yield from self.__schedule_search_pages(district= district)
+        
         try:
             listings_json = data_json.get('Properties')
         except:
@@ -94,33 +163,107 @@ class PTCentury21Spider(scrapy.Spider):
 
                 # scrape the listing's page for additional details
                 if listing:
+                    headers: Dict[str, str] = {
+                        'user-agent': self.__headers.get('user-agent'),
+                        'origin': self.__website,
+                    }
+                    
+                    meta: Dict[str, Any] = {
+                        'listing': listing,
+                        'location': listing_json.get('FullLocation')
+                    }
+                    
+                    if self.__listing_cache:
+                        fingerprint: str = ListingCache.get_fingerprint(listing_json)
+                        cached_listing: Optional[CachedListing] = self.__listing_cache.get(
+                            ListingCache.get_key(listing.get('id'), listing['listing_url']))
+                        
+                        # the summary is unchanged, the previous crawl's item is reused without requesting the detail page
+                        if cached_listing and self.__listing_cache.is_fresh(cached_listing, fingerprint):
+                            self.crawler.stats.inc_value('listing_cache/hit')
+                            
+                            # fields since removed from ListingItem are dropped
+                            yield ListingItem({key: value for key, value in cached_listing.item.items() if key in ListingItem.fields})
+                            
+                            continue
+                        
+                        meta['fingerprint'] = fingerprint
+                        
+                        # the detail page is revalidated, an unmodified page (304) reusing the cached details
+                        if cached_listing:
+                            meta['cached_listing'] = cached_listing
+                            meta['handle_httpstatus_list'] = [304]
+                            
+                            if cached_listing.etag:
+                                headers['if-none-match'] = cached_listing.etag
+                                
+                            if cached_listing.last_modified:
+                                headers['if-modified-since'] = cached_listing.last_modified
+                    
                     yield scrapy.Request(
                         url = listing['listing_url'],
                         callback = self._parse_detail,
                         dont_filter = False,
-                        headers = 
-                        {
-                            'user-agent': self.__headers.get('user-agent'),
-                            'origin': self.__website,
-                        },
-                        meta = {
-                            'listing': listing,
-                            'location': listing_json.get('FullLocation')
-                        }
+                        headers = headers,
+                        meta = meta
                     )
-                    
-            # get the total number of pages
-            num_pages: int = data_json.get('TotalPages')
-            # get the current page number
-            current_page: int = data_json.get('CurrentPage')
-
-            if num_pages and current_page < num_pages:
-                yield scrapy.Request(
-                    url=self._generate_url(page_number= current_page + 1),
-                    callback=self.parse,
-                    headers=self.__headers,
-                    dont_filter=False,
-                )
+    
+    def _search_page_failed(self, failure):
+        district: Optional[str] = failure.request.meta.get('search_district')
+        shard: Optional[Dict[str, Optional[int]]] = self.__search_shards.get(district or '')
+        
+        self.logger.warning('PTCentury21Spider::_search_page_failed could not retrieve %s: %s', failure.request.url, repr(failure.value))
+        
+        if shard is None:
+            return
+        
+        # without its first page the shard's page count is unknown, none of its listings would be crawled
+        if shard['total_pages'] is None:
+            retries: int = failure.request.meta.get('search_retries', 0)
+            
+            if retries < self.__first_page_retries:
+                self.crawler.stats.inc_value('century21/first_page_retries')
+                
+                yield failure.request.replace(dont_filter=True, meta={**failure.request.meta, 'search_retries': retries + 1})
+                
+                return
+            
+            self.logger.error('PTCentury21Spider::_search_page_failed giving up on the %s shard, the crawl is incomplete', district or 'country wide')
+            
+            self.crawler.stats.inc_value('century21/failed_shards')
+            self.crawler.stats.set_value('century21/failed_shards/' + (district or 'all'), failure.request.url)
+            
+            return
+        
+        self.crawler.stats.inc_value('century21/failed_pages')
+        
+        # a failed page frees its window slot, the shard's remaining pages still being requested
+        shard['in_flight'] -= 1
+        
+        yield from self.__schedule_search_pages(district= district)
+            
+    def __schedule_search_pages(self, district: Optional[str]):
+        shard: Dict[str, Optional[int]] = self.__search_shards[district or '']
+        
+        while shard['next_page'] <= shard['total_pages'] and (self.__page_window == 0 or shard['in_flight'] < self.__page_window):
+            yield self.__generate_search_request(page_number= shard['next_page'], district= district)
+            
+            shard['next_page'] += 1
+            shard['in_flight'] += 1
+            
+    def __generate_search_request(self, page_number: int, district: Optional[str]) -> scrapy.Request:
+        return scrapy.Request(
+            url=self._generate_url(page_number= page_number, district= district),
+            callback=self.parse,
+            errback=self._search_page_failed,
+            headers=self.__headers,
+            dont_filter=False,
+            # discovery first, the search pages being scheduled ahead of the detail pages
+            priority=10,
+            meta={
+                'search_district': district,
+            },
+        )
             
     def _parse_detail(self, response: scrapy.http.TextResponse): 
         listing: ListingItem = response.meta.get('listing')
@@ -139,16 +282,47 @@ class PTCentury21Spider(scrapy.Spider):
             response.body.decode("utf-8"), "html.parser")
         '''
         
-        # parse the search page using SoupStrainer to limit the parsed data and lxml
-        strainer = SoupStrainer(name = ['div', 'ul', 'li'])
-        listing_html = BeautifulSoup(response.body, 'lxml', parse_only=strainer)
+        cached_listing: Optional[CachedListing] = response.meta.get('cached_listing')
         
-        if listing_html:
-            self._extract_details(listing_html= listing_html, listing= listing)
+        if response.status == 304 and cached_listing:
+            self.crawler.stats.inc_value('listing_cache/revalidated')
+            
+            # the summary fields are the API's current ones, the remaining (detail) fields are the cached ones
+            for key, value in cached_listing.item.items():
+                if key not in listing and key in ListingItem.fields:
+                    listing[key] = value
+                    
             self._extract_administrative_data(location= location, listing= listing)
+        else:
+            if self.__listing_cache:
+                self.crawler.stats.inc_value('listing_cache/miss')
+            
+            # parse the search page using SoupStrainer to limit the parsed data and lxml
+            strainer = SoupStrainer(name = ['div', 'ul', 'li'])
+            listing_html = BeautifulSoup(response.body, 'lxml', parse_only=strainer)
+            
+            if listing_html:
+                self._extract_details(listing_html= listing_html, listing= listing)
+                self._extract_administrative_data(location= location, listing= listing)
+        
+        if self.__listing_cache and listing:
+            self.__listing_cache.put(
+                key=ListingCache.get_key(listing.get('id'), listing['listing_url']),
+                listing_url=listing['listing_url'],
+                fingerprint=response.meta.get('fingerprint'),
+                item=listing,
+                # a 304 may omit the validators, the cached ones remaining valid
+                etag=self.__get_header(response, 'ETag') or (cached_listing.etag if cached_listing else None),
+                last_modified=self.__get_header(response, 'Last-Modified') or (cached_listing.last_modified if cached_listing else None),
+            )
             
         yield listing
         
+    def __get_header(self, response: scrapy.http.Response, header_name: str) -> Optional[str]:
+        header_value: Optional[bytes] = response.headers.get(header_name)
+        
+        return header_value.decode('latin-1') if header_value else None
+        
         
     def _extract_administrative_data(self, location: str, listing: ListingItem) -> None:
         if not location or not listing:
@@ -231,7 +405,7 @@ class PTCentury21Spider(scrapy.Spider):
                 elif detail_div.find(name= 'ul', class_= ammenity_detail_ul_class):
                     listing['ammenities'] = [amenity_li.string for amenity_li in detail_div.findAll('li')]
     
-    def _generate_url(self, page_number: int) -> Union[str, None]:
+    def _generate_url(self, page_number: int, district: Optional[str] = None) -> Union[str, None]:
 
         params: str = "?ord=date-desc"\
             "&page={page_number}"\
@@ -262,7 +436,7 @@ class PTCentury21Spider(scrapy.Spider):
             "&et=".format(
                 page_number=page_number,
                 items_number=self.__items_per_page,
-                district_query = 'portugal%2B' + self.__district if self.__district else ''
+                district_query = 'portugal%2B' + quote_plus(district) if district else ''
             )
 
         url: str = (self.__website +
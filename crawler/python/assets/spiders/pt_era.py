@@ -7,6 +7,8 @@ from typing import Callable, Dict, List, Tuple, Union, Optional
 import scrapy
 
 from bs4 import BeautifulSoup
+from lxml import etree
+
 from assets.items import ListingItem
 
 
@@ -34,26 +36,37 @@ class PTEraSpider(scrapy.Spider):
         'referer': __website,
     }
 
-    # maps the ListingItem variable to the corresponding HTML extraction configuration
-    # Note: the same could be achieved with lambda functions, which are faster given they don't require unpacking
-    # however, the performance impact is small, and readability increases drastically, and allows for dynamic configs
-    __data_map: Dict[str, Callable[..., str]] = {
-        'id': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_ref'},
-        'listing_type': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_finalidade'},
-        'property_type': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_tipo_imovel'},
-        'asking_price': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_preco_venda'},
-        'district': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_distrito'},
-        'county': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_concelho'},
-        'parish': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_freguesia'},
-        'city': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_distrito'},
-        'gross_area': {'name': 'span', 'id': 'ctl00_ContentPlaceHolder1_lbl_imovel_show_area_bruta'},
-
-        'listing_url': {'name': 'meta', 'property': 'og:url'},
-        'summary': {'name': 'meta', 'property': 'og:title'},
-        'avatar_url': {'name': 'meta', 'property': 'og:image'},
-
+    # the extraction plan, maps the ListingItem variable to the (tag, attribute, attribute value, value source) holding its data
+    # the value source is either the element's text or one of its attributes
+    # Note: the plan is compiled once per spider class (see _compile_extraction_plan) into a single XPath pass
+    __extraction_plan: Dict[str, Tuple[str, str, str, str]] = {
+        'id': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_ref', 'text'),
+        'listing_type': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_finalidade', 'text'),
+        'property_type': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_tipo_imovel', 'text'),
+        'asking_price': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_preco_venda', 'text'),
+        'district': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_distrito', 'text'),
+        'county': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_concelho', 'text'),
+        'parish': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_freguesia', 'text'),
+        'city': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_distrito', 'text'),
+        'gross_area': ('span', 'id', 'ctl00_ContentPlaceHolder1_lbl_imovel_show_area_bruta', 'text'),
+
+        'listing_url': ('meta', 'property', 'og:url', 'content'),
+        'summary': ('meta', 'property', 'og:title', 'content'),
+        'avatar_url': ('meta', 'property', 'og:image', 'content'),
     }
 
+    # the compiled extraction plan, see _compile_extraction_plan
+    __compiled_plan: Optional[Tuple[etree.XPath, List[str], Dict[Tuple[str, str, str], List[Tuple[str, str]]]]] = None
+
+    # the indicators' (bedrooms, bathrooms, etc) container and the map's (coordinates) image
+    __indicators_class: str = 'bloco-caracteristicas'
+    __indicator_category_xpath: etree.XPath = etree.XPath('.//span[@title]/@title')
+    __indicator_value_xpath: etree.XPath = etree.XPath(
+        ".//span[contains(concat(' ', normalize-space(@class), ' '), ' num ')]//text()")
+    __indicator_items_xpath: etree.XPath = etree.XPath('.//li')
+
+    __coordinates_pattern = re.compile(r'query=([+-]?\d*\.?\d+),([+-]?\d*\.?\d+)')
+
     __header_map: Dict[str, str] = {
         "Bedrooms": "bedrooms",
         "Bathroom": "bathrooms",
@@ -155,11 +168,10 @@ class PTEraSpider(scrapy.Spider):
         return url
 
     def _parse_detail(self, response: scrapy.http.TextResponse):
+        # the response's lxml document, parsed once (in C) and shared with any other selector
+        listing_html = response.selector.root
 
-        listing_html = BeautifulSoup(
-            response.body.decode("utf-8"), "html.parser")
-
-        if listing_html:
+        if listing_html is not None:
             listing = ListingItem()
 
             listing['broker'] = self.__broker_name
@@ -169,81 +181,110 @@ class PTEraSpider(scrapy.Spider):
                 Data Extraction Section
             '''
 
-            # associate each ListingItem variable to the corresponding extracted data, if any
-            self.__map_features(listing, listing_html, PTEraSpider.__data_map)
+            # a single pass over the document retrieves the planned variables, the indicators and the coordinates
+            self.__run_extraction_plan(listing, listing_html)
 
-            # retrieve the base indicators present in the body's "header"
-            self.__parse_indicators(listing, listing_html)
+            yield listing
 
-            # extract coordinates
-            latitude, longitude = self.__extract_coordinates(listing_html)
+        yield None
 
-            if latitude and longitude:
-                listing['latitude'] = latitude
-                listing['longitude'] = longitude
+    @classmethod
+    def _compile_extraction_plan(cls) -> Tuple[etree.XPath, List[str], Dict[Tuple[str, str, str], List[Tuple[str, str]]]]:
+        """Compiles the extraction plan into a single XPath expression matching every relevant element in one document pass,
+           and a lookup from each (tag, attribute, attribute value) to the ListingItem variables it holds
 
-            yield listing
+        Returns
+        -------
+        Tuple[etree.XPath, List[str], Dict[Tuple[str, str, str], List[Tuple[str, str]]]]
+            the compiled XPath, the planned attributes and the (tag, attribute, attribute value) lookup of (variable, value source)
+        """
+        if cls.__compiled_plan is not None:
+            return cls.__compiled_plan
 
-        yield None
+        lookup: Dict[Tuple[str, str, str], List[Tuple[str, str]]] = {}
+        attributes: List[str] = []
+        predicates: List[str] = []
+
+        for variable, (tag, attribute, attribute_value, source) in cls.__extraction_plan.items():
+            lookup.setdefault((tag, attribute, attribute_value), []).append((variable, source))
+
+            if attribute not in attributes:
+                attributes.append(attribute)
+
+            predicate: str = "(self::{tag} and @{attribute})".format(tag=tag, attribute=attribute)
+
+            if predicate not in predicates:
+                predicates.append(predicate)
+
+        # the indicators' container and the map's image are matched by the same pass
+        predicates.append("contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(cls.__indicators_class))
+        predicates.append("(self::img and @onclick)")
+
+        cls.__compiled_plan = (etree.XPath('//*[' + ' or '.join(predicates) + ']'), attributes, lookup)
 
-    def __map_features(self, item: ListingItem, html_content: str, map: Dict[str, Callable[..., None]]) -> None:
-        for variable, content in map.items():
-            try:
-                result: str = html_content.find(content)
-
-                if result:
-                    item[variable] = result.string
-            except Exception as e:
-                print('Failed to retrieve variable {variable} with map {content} , {e}'.format(
-                    variable, content, e))
-
-    def __parse_indicators(self, item: ListingItem, html: str) -> None:
-        header_content = html.select('.bloco-caracteristicas')
-
-        if header_content:
-            icon_sections: List[str] = header_content[0].find_all('li')
-
-            for icon_section in icon_sections:
-                category: str = icon_section.find(
-                    lambda tag: tag.name == 'span' and tag.has_attr('title'))
-                value: str = icon_section.find('span', ['num'])
-
-                # hardcoded, unfortunately this is an edge-case
-                # if the num isn't found, then the field corresponds to an energy certificate
-                if value is None:
-                    value = category['title'].replace(
-                        'Energ. Cert.:', '').strip()
-                    category = 'Energy_Certificate'
-                elif category and value:
-                    category = category['title']
-                    value = value.string
-
-                if category and value:
-                    # associate each ListingItem variable to the corresponding extracted data, if any
-                    try:
-                        listing_variable = PTEraSpider.__header_map.get(
-                            category)
-
-                        if listing_variable:
-                            item[listing_variable] = value
-                    except Exception as e:
-                        print('Failed to retrieve variable {variable} with map {content} , {e}'.format(
-                            category, value, e))
-
-    def __extract_coordinates(self, html: str) -> Optional[Tuple[float, float]]:
-        regex_pattern: str = 'query=[+-]?([0-9]*[.])?[0-9]+,[+-]?([0-9]*[.])?[0-9]+'
-
-        link = html.find('img', ['img_mapa', 'onclick'])
-
-        if link:
-            try:
-                google_query: str = link['onclick']
-
-                coordinates: Tuple[float, float] = re.findall(
-                    regex_pattern, google_query)
+        return cls.__compiled_plan
+
+    def __run_extraction_plan(self, item: ListingItem, html: etree._Element) -> None:
+        plan_xpath, attributes, lookup = self._compile_extraction_plan()
+
+        indicators_parsed: bool = False
+        coordinates_parsed: bool = False
+
+        for element in plan_xpath(html):
+            # matched by class, the container holding the indicators (only the first one is considered)
+            if not indicators_parsed and self.__indicators_class in (element.get('class') or '').split():
+                self.__parse_indicators(item, element)
+                indicators_parsed = True
+                continue
+
+            if element.tag == 'img' and not coordinates_parsed:
+                coordinates: Optional[Tuple[str, str]] = self.__extract_coordinates(element.get('onclick'))
 
                 if coordinates:
-                    return coordinates[0]
+                    item['latitude'], item['longitude'] = coordinates
+                    coordinates_parsed = True
+
+                continue
+
+            # the planned variables, an element can hold multiple variables (e.g. district and city)
+            for attribute in attributes:
+                for variable, source in lookup.get((element.tag, attribute, element.get(attribute)), []):
+                    value: Optional[str] = element.text_content() if source == 'text' else element.get(source)
+
+                    if value:
+                        item[variable] = value.strip()
+
+    def __parse_indicators(self, item: ListingItem, container: etree._Element) -> None:
+        for icon_section in self.__indicator_items_xpath(container):
+            categories: List[str] = self.__indicator_category_xpath(icon_section)
+            values: List[str] = [value.strip() for value in self.__indicator_value_xpath(icon_section) if value.strip()]
+
+            if not categories:
+                continue
+
+            category: str = categories[0]
+
+            # hardcoded, unfortunately this is an edge-case
+            # if the num isn't found, then the field corresponds to an energy certificate
+            if not values:
+                value: str = category.replace('Energ. Cert.:', '').strip()
+                category = 'Energy_Certificate'
+            else:
+                value = values[0]
+
+            # associate each ListingItem variable to the corresponding extracted data, if any
+            listing_variable: Optional[str] = PTEraSpider.__header_map.get(category)
+
+            if listing_variable and value:
+                item[listing_variable] = value
+
+    def __extract_coordinates(self, google_query: Optional[str]) -> Optional[Tuple[str, str]]:
+        if not google_query:
+            return None
+
+        coordinates = self.__coordinates_pattern.search(google_query)
+
+        if coordinates:
+            return coordinates.group(1), coordinates.group(2)
 
-            except Exception as e:
-                return None, None
+        return None
@@ -26,6 +26,7 @@ from airflow.providers.amazon.aws.sensors.emr_job_flow import EmrJobFlowSensor
 # custom operators
 from operators.s3toredshift_operator import S3ToRedshiftOperator
 from operators.dimension_operator import DimensionOperator
+from operators.fact_operator import FactOperator
 
 # helpers
 from helpers import sql_queries_staging, sql_queries_presentation
@@ -65,6 +66,12 @@ DEFAULT_ARGS = {
 # the instance type to be spawned
 instance_type: str = 'm5.xlarge'
 
+# full or delta (only new, changed and deleted assets), drives both the Spark extraction and the dimension close-out
+extraction_mode: str = Variable.get('manifold_extraction_mode', default_var='full')
+
+# the dimension row hash algorithm, drives both the Spark hashing and the Redshift hash column types
+hash_algorithm: str = Variable.get('manifold_hash_algorithm', default_var='sha256')
+
 
 SPARK_STEPS = [
     {
@@ -89,6 +96,11 @@ SPARK_STEPS = [
                 '{{ var.value.s3_path }}',
                 '--s3_path_template',
                 '{{ var.value.s3_path_template }}',
+                '--mode',
+                extraction_mode,
+                # sha256, binary or xxhash64, must match the hash column types
+                '--hash_algorithm',
+                hash_algorithm,
             ],
         },
     }
@@ -190,8 +202,20 @@ with DAG(
     create_staging_definitions: Dict[str,
                                      str] = sql_queries_staging.create_query_destinition
 
+    # COPY into staging.<table>__load and swap it with the live table, which stays readable during the load
+    staging_swap_tables: bool = Variable.get('manifold_staging_swap_tables', default_var='false').lower() == 'true'
+
     # create the staging tables if they do not exist, else truncate
     for object_name, query in create_staging_definitions.items():
+        query = sql_queries_staging.format_hash_type(query, hash_algorithm)
+
+        # in swap mode the live tables must stay readable until the swap, they are only created if missing and may hence hold
+        # an older definition, else the recreated tables record their definition's fingerprint (see DimensionOperator)
+        if staging_swap_tables:
+            query = sql_queries_staging.format_create_if_missing(query)
+        else:
+            query = sql_queries_staging.format_fingerprint_comment(query)
+
         staging_task: PostgresOperator = PostgresOperator(
             task_id=object_name,
             dag=dag,
@@ -226,25 +250,53 @@ with DAG(
     redshift_role_name = Variable.get("manifold_redshift_role_name")
     redshift_region_name = Variable.get("manifold_redshift_region_name")
 
-    # populate the staging layer via Redshift's COPY
-    for object_name, config in sql_queries_staging.copy_query_definition.items():
-        destination_name: str = config.destination_name
-        source_name: str = config.source_name
+    # COPY from the manifests written by the Spark step rather than listing the dataset prefixes
+    staging_use_manifest: bool = Variable.get('manifold_staging_use_manifest', default_var='true').lower() == 'true'
+
+    # load every staging table in a single transaction, else one task per table
+    staging_batch_load: bool = Variable.get('manifold_staging_batch_load', default_var='false').lower() == 'true'
 
+    if staging_batch_load:
         operator: S3ToRedshiftOperator = S3ToRedshiftOperator(
-            task_id=object_name,
+            task_id='staging_batch_load',
             dag=dag,
             redshift_conn_id='redshift_conn',
             redshift_credentials_id='redshift_credentials',
             s3_path='{{ var.value.s3_path }}',
             s3_bucket_template='{{ var.value.s3_path_template }}',
-            destination_name=destination_name,
-            source_name=source_name,
+            destination_name=None,
+            source_name=None,
+            copy_configs=list(sql_queries_staging.copy_query_definition.values()),
+            use_manifest=staging_use_manifest,
+            swap_tables=staging_swap_tables,
             role_name=redshift_role_name,
             region_name=redshift_region_name
         )
 
         staging_tasks.append(operator)
+    else:
+        # populate the staging layer via Redshift's COPY
+        for object_name, config in sql_queries_staging.copy_query_definition.items():
+            destination_name: str = config.destination_name
+            source_name: str = config.source_name
+
+            operator: S3ToRedshiftOperator = S3ToRedshiftOperator(
+                task_id=object_name,
+                dag=dag,
+                redshift_conn_id='redshift_conn',
+                redshift_credentials_id='redshift_credentials',
+                s3_path='{{ var.value.s3_path }}',
+                s3_bucket_template='{{ var.value.s3_path_template }}',
+                destination_name=destination_name,
+                source_name=source_name,
+                manifest_name=config.manifest_name,
+                use_manifest=staging_use_manifest,
+                swap_tables=staging_swap_tables,
+                role_name=redshift_role_name,
+                region_name=redshift_region_name
+            )
+
+            staging_tasks.append(operator)
 
     staging_table_populate_dummy = DummyOperator(task_id='staging_table_populate_dummy',
                                                  dag=dag
@@ -269,17 +321,36 @@ with DAG(
     dimension_definitions: Dict[str, Dict[str, str]
                                 ] = sql_queries_presentation.dimension_definitions
 
-    fact_definitions: Dict[str,
-                           str] = sql_queries_presentation.fact_definitions
+    fact_definitions: Dict[str, Dict[str, str]
+                           ] = sql_queries_presentation.fact_definitions
+
+    # the staging definitions as rendered for the hash algorithm, matched against the deployed tables' fingerprints
+    staging_table_definitions = sql_queries_staging.get_staging_table_definitions(hash_algorithm)
 
+    presentation_dim_creation_tasks: List[PostgresOperator] = []
     presentation_dim_tasks: List[DimensionOperator] = []
-    presentation_fact_tasks: List[PostgresOperator] = []
+    presentation_fact_creation_tasks: List[PostgresOperator] = []
+    presentation_fact_tasks: List[FactOperator] = []
 
     # add the presentation layer's dimension tasks
     for object_name, config in dimension_definitions.items():
         target_table: str = config.get('target_table')
         base_table: str = config.get('base_table')
         match_columns: List[str] = config.get('match_columns')
+        close_missing: bool = config.get('close_missing', False)
+
+        # staging only holds the new and changed records in delta mode, the deleted ones are listed in the tombstone table, unless
+        # the extraction fell back to full mode (see staging.extraction_mode)
+        tombstone_table: str = config.get('tombstone_table') if extraction_mode == 'delta' else None
+
+        # created if missing, with its table layout (encodings, distribution and sort keys) and hash column type
+        dimension_creation: PostgresOperator = PostgresOperator(
+            task_id=object_name + '_create',
+            dag=dag,
+            postgres_conn_id='redshift_conn',
+            sql=sql_queries_staging.format_hash_type(
+                sql_queries_presentation.format_table_layout(config.get('create_query'), target_table), hash_algorithm)
+        )
 
         presentation_task: DimensionOperator = DimensionOperator(
             task_id=object_name,
@@ -287,9 +358,19 @@ with DAG(
             postgres_conn_id='redshift_conn',
             target_table=target_table,
             base_table=base_table,
-            match_columns=match_columns
+            match_columns=match_columns,
+            # the staging columns derived from sql_queries_staging, sparing the information_schema lookup
+            base_definition=staging_table_definitions.get(('staging', base_table)),
+            close_missing=close_missing,
+            tombstone_table=tombstone_table,
+            extraction_mode_table='extraction_mode',
+            # the SCD2 versions are stamped from the stock date of the staged snapshot, not the merge date
+            effective_date='{{ ds }}'
         )
 
+        dimension_creation >> presentation_task
+
+        presentation_dim_creation_tasks.append(dimension_creation)
         presentation_dim_tasks.append(presentation_task)
 
     presentation_dimension_dummy = DummyOperator(task_id='presentation_dimension_dummy',
@@ -297,16 +378,88 @@ with DAG(
                                                  )
 
     # add the presentation layer's fact tasks
-    for object_name, query in fact_definitions.items():
-        presentation_task: PostgresOperator = PostgresOperator(
+    for object_name, config in fact_definitions.items():
+        fact_creation: PostgresOperator = PostgresOperator(
+            task_id=object_name + '_create',
+            dag=dag,
+            postgres_conn_id='redshift_conn',
+            sql=sql_queries_presentation.format_table_layout(config.get('create_query'), config.get('target_table'))
+        )
+
+        presentation_task: FactOperator = FactOperator(
             task_id=object_name,
             dag=dag,
             postgres_conn_id='redshift_conn',
-            sql=query
+            target_table=config.get('target_table'),
+            insert_query=config.get('insert_query'),
+            date_id_query=config.get('date_id_query'),
+            # the number of date_id slices replaced per transaction
+            batch_size=int(Variable.get('manifold_fact_batch_size', default_var='4'))
         )
 
+        fact_creation >> presentation_task
+
+        presentation_fact_creation_tasks.append(fact_creation)
         presentation_fact_tasks.append(presentation_task)
 
+    presentation_fact_dummy = DummyOperator(task_id='presentation_fact_dummy',
+                                            dag=dag
+                                            )
+
+    # add the change facts, created if missing and derived from the loaded fact_stock slices
+    presentation_derived_fact_creation_tasks: List[PostgresOperator] = []
+    presentation_derived_fact_tasks: List[FactOperator] = []
+
+    for object_name, config in sql_queries_presentation.derived_fact_definitions.items():
+        derived_fact_creation: PostgresOperator = PostgresOperator(
+            task_id=object_name + '_create',
+            dag=dag,
+            postgres_conn_id='redshift_conn',
+            sql=sql_queries_presentation.format_table_layout(config.get('create_query'), config.get('target_table'))
+        )
+
+        presentation_task: FactOperator = FactOperator(
+            task_id=object_name,
+            dag=dag,
+            postgres_conn_id='redshift_conn',
+            target_table=config.get('target_table'),
+            insert_query=config.get('insert_query'),
+            date_id_query=config.get('date_id_query'),
+            batch_size=int(Variable.get('manifold_fact_batch_size', default_var='4'))
+        )
+
+        derived_fact_creation >> presentation_task
+
+        presentation_derived_fact_creation_tasks.append(derived_fact_creation)
+        presentation_derived_fact_tasks.append(presentation_task)
+
+    # add the market summary rollups, created if missing and refreshed for the loaded fact_stock slices
+    presentation_summary_creation_tasks: List[PostgresOperator] = []
+    presentation_summary_tasks: List[FactOperator] = []
+
+    for object_name, config in sql_queries_presentation.summary_definitions.items():
+        summary_creation: PostgresOperator = PostgresOperator(
+            task_id=object_name + '_create',
+            dag=dag,
+            postgres_conn_id='redshift_conn',
+            sql=sql_queries_presentation.format_table_layout(config.get('create_query'), config.get('target_table'))
+        )
+
+        presentation_task: FactOperator = FactOperator(
+            task_id=object_name,
+            dag=dag,
+            postgres_conn_id='redshift_conn',
+            target_table=config.get('target_table'),
+            insert_query=config.get('insert_query'),
+            date_id_query=config.get('date_id_query'),
+            batch_size=int(Variable.get('manifold_fact_batch_size', default_var='4'))
+        )
+
+        summary_creation >> presentation_task
+
+        presentation_summary_creation_tasks.append(summary_creation)
+        presentation_summary_tasks.append(presentation_task)
+
     # 2) create the staging Parquet files should the scrapers complete
     scrapers_dummy >> manifold_emr_creator >> manifold_emr_job_sensor
 
@@ -317,8 +470,16 @@ with DAG(
     staging_table_create_dummy >> staging_tasks >> staging_table_populate_dummy
 
     # 5) populate the presentation Redshift layer's dimensions with SCD2
-    staging_table_populate_dummy >> presentation_schema_creation >> presentation_dim_tasks >> presentation_dimension_dummy
+    staging_table_populate_dummy >> presentation_schema_creation >> presentation_dim_creation_tasks
+    presentation_dim_tasks >> presentation_dimension_dummy
 
     # 6) populate the presentation Redshift layer's facts
-    presentation_dimension_dummy >> presentation_fact_tasks
+    presentation_dimension_dummy >> presentation_fact_creation_tasks
+    presentation_fact_tasks >> presentation_fact_dummy
+
+    # 7) derive the change facts from the loaded stock
+    presentation_fact_dummy >> presentation_derived_fact_creation_tasks
+
+    # 8) refresh the market summary rollups of the loaded stock
+    presentation_fact_dummy >> presentation_summary_creation_tasks
     
@@ -1,55 +1,75 @@
-from typing import Dict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class TableLayout:
+    # KEY distributes on dist_key, ALL copies small tables to every node
+    dist_style: str
+    dist_key: Optional[str] = None
+    # compound sort key, also the Postgres stand-in's index columns
+    sort_keys: List[str] = field(default_factory=list)
+    # the column compression encodings, columns not listed keep Redshift's default
+    encodings: Dict[str, str] = field(default_factory=dict)
+    # SCD2 tables only ever join their active records, the Postgres stand-in indexes those only
+    active_only: bool = False
 
 
 create_presentation_schema: str = '''
     create schema if not exists presentation;
 '''
 
+# the dimension definitions hold {hash_type} placeholders, injected via helpers.sql_queries_staging.format_hash_type
+# and {encode} and {table_layout} placeholders, injected via format_table_layout
+# the surrogate keys are named id, as referenced by the fact tables and matched by operators.dimension_operator.DimensionOperator
 create_presentation_dim_asset: str = '''
-    create table presentation.dim_asset
+    create table if not exists presentation.dim_asset
     (
-        asset_id		      bigint identity(0, 1) primary key, 
-        contract_number       varchar not null,
-        country               varchar,
-        county                varchar,
-        parish                varchar,
-        title                 varchar(max),
-        description           varchar(max),
-        price                 float  not null,
-        property_type         varchar,
-        bathrooms             float,
-        bedrooms              float,
-        area_net              float,
-        latitude              float,
-        longitude             float,
-        hash                  varchar not null,
-        record_start_date 	  datetime default getdate(),
-        record_end_date		  datetime default null
+        id		              bigint identity(0, 1) {encode} primary key,
+        contract_number       varchar {encode} not null,
+        country               varchar {encode},
+        county                varchar {encode},
+        parish                varchar {encode},
+        title                 varchar(max) {encode},
+        description           varchar(max) {encode},
+        price                 float {encode} not null,
+        property_type         varchar {encode},
+        bathrooms             float {encode},
+        bedrooms              float {encode},
+        area_net              float {encode},
+        latitude              float {encode},
+        longitude             float {encode},
+        hash                  {hash_type} {encode} not null,
+        record_start_date 	  datetime default getdate() {encode},
+        record_end_date		  datetime default null {encode}
     )
+    {table_layout}
 '''
 
 create_presentation_dim_broker: str = '''
     create table if not exists presentation.dim_broker
     (
-        broker_id bigint        identity(0, 1) primary key,
-        broker                  varchar,
-        hash                    varchar not null,
-        record_start_date 		datetime default getdate(),
-        record_end_date			datetime default null
+        id                      bigint identity(0, 1) {encode} primary key,
+        broker                  varchar {encode},
+        hash                    {hash_type} {encode} not null,
+        record_start_date 		datetime default getdate() {encode},
+        record_end_date			datetime default null {encode}
     )
+    {table_layout}
 '''
 
 create_presentation_dim_geography: str = '''
     create table if not exists presentation.dim_geography
     (
-        geography_id            bigint identity(0, 1) primary key,
-        country                 varchar,
-        county                  varchar,
-        parish                  varchar,
-        hash                    varchar not null,
-        record_start_date 		datetime default getdate(),
-        record_end_date			datetime default null
+        id                      bigint identity(0, 1) {encode} primary key,
+        country                 varchar {encode},
+        county                  varchar {encode},
+        parish                  varchar {encode},
+        hash                    {hash_type} {encode} not null,
+        record_start_date 		datetime default getdate() {encode},
+        record_end_date			datetime default null {encode}
     )
+    {table_layout}
 '''
 
 create_presentation_dim_date_view: str = '''
@@ -89,19 +109,273 @@ create_presentation_dim_date_view: str = '''
 '''
 
 create_presentation_fact_stock: str = '''
-    CREATE TABLE presentation.fact_stock 
+    create table if not exists presentation.fact_stock
+    (
+        id 			  		bigint identity(0, 1) {encode},
+        broker_id        	bigint {encode} references presentation.dim_broker (id),
+        asset_id 			bigint {encode} references presentation.dim_asset (id),
+        geography_id        bigint {encode} references presentation.dim_geography (id),
+        price          		float {encode},
+        quantity      		int {encode},
+        date_id     		bigint {encode}
+    )
+    {table_layout}
+'''
+
+
+create_presentation_fact_new_stock: str = '''
+    create table if not exists presentation.fact_new_stock
+    (
+        broker_id        	bigint {encode},
+        asset_id 			bigint {encode},
+        geography_id        bigint {encode},
+        price          		float {encode},
+        quantity      		int {encode},
+        date_id     		bigint {encode}
+    )
+    {table_layout}
+'''
+
+create_presentation_fact_deleted_stock: str = '''
+    create table if not exists presentation.fact_deleted_stock
+    (
+        broker_id        	bigint {encode},
+        asset_id 			bigint {encode},
+        geography_id        bigint {encode},
+        price          		float {encode},
+        quantity      		int {encode},
+        date_id     		bigint {encode}
+    )
+    {table_layout}
+'''
+
+create_presentation_fact_price_oscillations: str = '''
+    create table if not exists presentation.fact_price_oscillations
     (
-        id 			  		bigint identity(0, 1),
-        broker_id        	bigint references presentation.dim_broker (id),
-        asset_id 			bigint references presentation.dim_asset (id),
-        geography_id        bigint references presentation.dim_geography (id),
-        price          		float,
-        quantity      		int,
-        date_id     		bigint
+        broker_id        	bigint {encode},
+        asset_id 			bigint {encode},
+        geography_id        bigint {encode},
+        previous_price      float {encode},
+        price          		float {encode},
+        price_variation     float {encode},
+        date_id     		bigint {encode}
     )
+    {table_layout}
+'''
+
+
+# the Redshift table layouts: dimensions distribute on their business keys (small ones are copied to every node)
+# and sort on (business keys, record_end_date) so that the SCD2 merges and fact lookups of the active records are range restricted
+# sort key columns stay raw, zone maps are ineffective on compressed sort keys
+table_layouts: Dict[str, TableLayout] = {
+    'dim_asset': TableLayout(
+        dist_style='key',
+        dist_key='contract_number',
+        sort_keys=['contract_number', 'record_end_date'],
+        encodings={'contract_number': 'raw', 'record_end_date': 'raw', 'country': 'bytedict', 'county': 'bytedict',
+                   'parish': 'zstd', 'title': 'zstd', 'description': 'zstd', 'property_type': 'bytedict', 'price': 'zstd',
+                   'bathrooms': 'zstd', 'bedrooms': 'zstd', 'area_net': 'zstd', 'latitude': 'zstd', 'longitude': 'zstd',
+                   'hash': 'zstd', 'record_start_date': 'az64', 'id': 'az64'},
+        active_only=True
+    ),
+    'dim_broker': TableLayout(
+        dist_style='all',
+        sort_keys=['broker', 'record_end_date'],
+        encodings={'broker': 'raw', 'record_end_date': 'raw', 'hash': 'zstd', 'record_start_date': 'az64', 'id': 'az64'},
+        active_only=True
+    ),
+    'dim_geography': TableLayout(
+        dist_style='all',
+        sort_keys=['country', 'county', 'parish', 'record_end_date'],
+        encodings={'country': 'raw', 'county': 'raw', 'parish': 'raw', 'record_end_date': 'raw', 'hash': 'zstd',
+                   'record_start_date': 'az64', 'id': 'az64'},
+        active_only=True
+    ),
+    'fact_stock': TableLayout(
+        dist_style='key',
+        dist_key='asset_id',
+        sort_keys=['date_id', 'asset_id'],
+        encodings={'date_id': 'raw', 'asset_id': 'raw', 'id': 'az64', 'broker_id': 'az64', 'geography_id': 'az64',
+                   'price': 'zstd', 'quantity': 'az64'}
+    ),
+    'fact_new_stock': TableLayout(
+        dist_style='key',
+        dist_key='asset_id',
+        sort_keys=['date_id', 'asset_id'],
+        encodings={'date_id': 'raw', 'asset_id': 'raw', 'broker_id': 'az64', 'geography_id': 'az64', 'price': 'zstd',
+                   'quantity': 'az64'}
+    ),
+    'fact_deleted_stock': TableLayout(
+        dist_style='key',
+        dist_key='asset_id',
+        sort_keys=['date_id', 'asset_id'],
+        encodings={'date_id': 'raw', 'asset_id': 'raw', 'broker_id': 'az64', 'geography_id': 'az64', 'price': 'zstd',
+                   'quantity': 'az64'}
+    ),
+    'fact_price_oscillations': TableLayout(
+        dist_style='key',
+        dist_key='asset_id',
+        sort_keys=['date_id', 'asset_id'],
+        encodings={'date_id': 'raw', 'asset_id': 'raw', 'broker_id': 'az64', 'geography_id': 'az64', 'previous_price': 'zstd',
+                   'price': 'zstd', 'price_variation': 'zstd'}
+    ),
+}
+
+
+def format_table_layout(query: str, table_name: str) -> str:
+    """Injects the table layout (column encodings, distribution and sort keys) in a Redshift table definition
+
+    Parameters
+    ----------
+    query : str
+        the table definition, holding {encode} and {table_layout} placeholders
+    table_name : str
+        the table name, as keyed in table_layouts
+
+    Returns
+    -------
+    str
+        the table definition with its layout, or without any if none is configured
+    """
+    layout: Optional[TableLayout] = table_layouts.get(table_name)
+    lines: List[str] = []
+
+    # the {encode} placeholders are resolved per line, using the line's column name
+    for line in query.split('\n'):
+        if '{encode}' in line:
+            column: str = line.split()[0]
+            encoding: Optional[str] = layout.encodings.get(column) if layout else None
+
+            line = line.replace('{encode}', 'encode ' + encoding if encoding else '')
+
+        lines.append(line)
+
+    table_layout: str = ''
+
+    if layout is not None:
+        table_layout = 'diststyle ' + layout.dist_style
+
+        if layout.dist_key is not None:
+            table_layout += ' distkey(' + layout.dist_key + ')'
+
+        if layout.sort_keys:
+            table_layout += ' compound sortkey(' + ', '.join(layout.sort_keys) + ')'
+
+    # replace rather than format, table definitions may hold other braces
+    return '\n'.join(lines).replace('{table_layout}', table_layout)
+
+
+def generate_layout_migration(table_name: str, schema_name: str = 'presentation') -> List[str]:
+    """Generates the statements applying a table layout to an existing Redshift table, created before its layout or with a previous one
+
+    Parameters
+    ----------
+    table_name : str
+        the table name, as keyed in table_layouts
+    schema_name : str, optional
+        the table's schema, by default 'presentation'
+
+    Returns
+    -------
+    List[str]
+        the distribution, sort key and column encoding statements, empty if no layout is configured
+    """
+    layout: Optional[TableLayout] = table_layouts.get(table_name)
+
+    if layout is None:
+        return []
+
+    table: str = schema_name + '.' + table_name
+    statements: List[str] = []
+
+    if layout.dist_key is not None:
+        statements.append(f'alter table {table} alter diststyle key distkey {layout.dist_key};')
+    else:
+        statements.append(f'alter table {table} alter diststyle {layout.dist_style};')
+
+    if layout.sort_keys:
+        statements.append(f"alter table {table} alter compound sortkey ({', '.join(layout.sort_keys)});")
+
+    # the sort key columns' encoding cannot be altered, Redshift already keeps them raw
+    for column, encoding in layout.encodings.items():
+        if column not in layout.sort_keys:
+            statements.append(f'alter table {table} alter column {column} encode {encoding};')
+
+    return statements
+
+
+def generate_active_indexes(table_name: str, schema_name: str = 'presentation') -> List[str]:
+    """Generates the Postgres stand-in equivalent of a table layout: an index on the sort keys, restricted to the active records of SCD2 tables
+
+    Parameters
+    ----------
+    table_name : str
+        the table name, as keyed in table_layouts
+    schema_name : str, optional
+        the table's schema, by default 'presentation'
+
+    Returns
+    -------
+    List[str]
+        the index creation statements, empty if no layout is configured
+    """
+    layout: Optional[TableLayout] = table_layouts.get(table_name)
+
+    if layout is None or not layout.sort_keys:
+        return []
+
+    if layout.active_only:
+        # the predicate already restricts the index to the active records, record_end_date is redundant
+        index_columns: List[str] = [column for column in layout.sort_keys if column != 'record_end_date']
+
+        return [f"create index if not exists {table_name}_active_idx on {schema_name}.{table_name} ({', '.join(index_columns)}) "
+                f"where record_end_date = '99991231';"]
+
+    return [f"create index if not exists {table_name}_sort_idx on {schema_name}.{table_name} ({', '.join(layout.sort_keys)});"]
+
+
+# the staged stock dates, each loaded as a date_id slice by operators.fact_operator.FactOperator
+staged_fact_stock_date_ids: str = '''
+    select distinct
+        to_char(stock_date::date, 'YYYYMMDD')::INTEGER date_id
+    from
+        staging.fact_stock
+    order by
+        date_id;
 '''
 
+# the slices of the change facts derived from the staged stock dates: the staged dates, and the next loaded date of each
+# the next date's changes are diffed against the staged date, stale once the staged date is backfilled (or reloaded)
+derived_fact_date_ids: str = '''
+    with staged_dates as
+    (
+        select distinct
+            to_char(stock_date::date, 'YYYYMMDD')::INTEGER date_id
+        from
+            staging.fact_stock
+    )
+    select
+        date_id
+    from
+        staged_dates
+    union
+    select
+        min(loaded_dates.date_id) date_id
+    from
+        staged_dates
+    inner join
+        (select distinct date_id from presentation.fact_stock) loaded_dates
+    on
+        loaded_dates.date_id > staged_dates.date_id
+    group by
+        staged_dates.date_id
+    order by
+        date_id;
+'''
 
+# the fact_stock loading of the {date_ids} slices, previously removed by the FactOperator so that re-runs do not duplicate them
+# each dimension resolves the version valid at the stock date (the DimensionOperator stamping the versions from the execution date,
+# the stock date of the staged snapshot), or the active version when the stock date precedes the first version (e.g. backfills)
 populate_presentation_fact_stock: str = '''
     insert into presentation.fact_stock
         (
@@ -113,50 +387,386 @@ populate_presentation_fact_stock: str = '''
         ,quantity
         )
     select
-        dim_broker.id broker_id
-        ,dim_asset.id asset_id
-        ,dim_geography.id geography_id
+        coalesce(valid_broker.id, active_broker.id) broker_id
+        ,coalesce(valid_asset.id, active_asset.id) asset_id
+        ,coalesce(valid_geography.id, active_geography.id) geography_id
         ,to_char(fact_stock.stock_date::date, 'YYYYMMDD')::INTEGER date_id
         ,fact_stock.price
         ,fact_stock.quantity
     from
         staging.fact_stock
     left join
-        presentation.dim_asset
+        presentation.dim_asset valid_asset
     on
-        fact_stock.contract_number =  dim_asset.contract_number
+        fact_stock.contract_number = valid_asset.contract_number
+        and
+        fact_stock.stock_date::date between valid_asset.record_start_date::date and valid_asset.record_end_date::date
     left join
-        presentation.dim_broker
+        presentation.dim_asset active_asset
     on
-        fact_stock.broker = dim_broker.broker
+        fact_stock.contract_number = active_asset.contract_number
+        and
+        active_asset.record_end_date = '99991231'
     left join
-        presentation.dim_geography
+        presentation.dim_broker valid_broker
+    on
+        fact_stock.broker = valid_broker.broker
+        and
+        fact_stock.stock_date::date between valid_broker.record_start_date::date and valid_broker.record_end_date::date
+    left join
+        presentation.dim_broker active_broker
+    on
+        fact_stock.broker = active_broker.broker
+        and
+        active_broker.record_end_date = '99991231'
+    left join
+        presentation.dim_geography valid_geography
+    on
+        fact_stock.country = valid_geography.country
+        and
+        fact_stock.county = valid_geography.county
+        and
+        fact_stock.parish = valid_geography.parish
+        and
+        fact_stock.stock_date::date between valid_geography.record_start_date::date and valid_geography.record_end_date::date
+    left join
+        presentation.dim_geography active_geography
     on
-        fact_stock.country = dim_geography.country
+        fact_stock.country = active_geography.country
+        and
+        fact_stock.county = active_geography.county
         and
-        fact_stock.county = dim_geography.county
+        fact_stock.parish = active_geography.parish
         and
-        fact_stock.parish = dim_geography.parish
+        active_geography.record_end_date = '99991231'
+    where
+        to_char(fact_stock.stock_date::date, 'YYYYMMDD')::INTEGER in ({date_ids});
 '''
 
+# the stock of the {date_ids} slices and of their previous loaded date, keyed by the asset's business key
+# the derived change facts diff each date against its previous date only, rather than self-joining the whole fact_stock history
+# note: the surrogate asset_id changes with every SCD2 version, contract_number identifies the asset across dates
+_stock_dates_subquery: str = '''
+        (
+            select
+                date_id,
+                lag(date_id) over (order by date_id) previous_date_id
+            from
+                (select distinct date_id from presentation.fact_stock) loaded_dates
+        )'''
+
+populate_presentation_fact_new_stock: str = '''
+    insert into presentation.fact_new_stock
+        (
+        broker_id
+        ,asset_id
+        ,geography_id
+        ,price
+        ,quantity
+        ,date_id
+        )
+    select
+        current_stock.broker_id
+        ,current_stock.asset_id
+        ,current_stock.geography_id
+        ,current_stock.price
+        ,current_stock.quantity
+        ,current_stock.date_id
+    from
+        presentation.fact_stock current_stock
+    inner join
+        presentation.dim_asset current_asset
+    on
+        current_stock.asset_id = current_asset.id
+    inner join
+        {stock_dates} stock_dates
+    on
+        current_stock.date_id = stock_dates.date_id
+    left join
+    (
+        select
+            previous_stock.date_id
+            ,previous_asset.contract_number
+        from
+            presentation.fact_stock previous_stock
+        inner join
+            presentation.dim_asset previous_asset
+        on
+            previous_stock.asset_id = previous_asset.id
+        where
+            -- restrict the scan to the previous dates of the loaded slices
+            previous_stock.date_id in
+            (
+                select
+                    previous_date_id
+                from
+                    {stock_dates} previous_dates
+                where
+                    previous_dates.date_id in ({{date_ids}})
+            )
+    ) previous_stock
+    on
+        previous_stock.date_id = stock_dates.previous_date_id
+        and
+        previous_stock.contract_number = current_asset.contract_number
+    where
+        current_stock.date_id in ({{date_ids}})
+        and
+        -- the first loaded date has no previous stock, every asset is new
+        previous_stock.contract_number is null;
+'''.format(stock_dates=_stock_dates_subquery)
+
+populate_presentation_fact_deleted_stock: str = '''
+    insert into presentation.fact_deleted_stock
+        (
+        broker_id
+        ,asset_id
+        ,geography_id
+        ,price
+        ,quantity
+        ,date_id
+        )
+    select
+        previous_stock.broker_id
+        ,previous_stock.asset_id
+        ,previous_stock.geography_id
+        ,previous_stock.price
+        ,previous_stock.quantity
+        ,stock_dates.date_id
+    from
+        {stock_dates} stock_dates
+    inner join
+        presentation.fact_stock previous_stock
+    on
+        previous_stock.date_id = stock_dates.previous_date_id
+    inner join
+        presentation.dim_asset previous_asset
+    on
+        previous_stock.asset_id = previous_asset.id
+    left join
+    (
+        select
+            current_stock.date_id
+            ,current_asset.contract_number
+        from
+            presentation.fact_stock current_stock
+        inner join
+            presentation.dim_asset current_asset
+        on
+            current_stock.asset_id = current_asset.id
+        where
+            current_stock.date_id in ({{date_ids}})
+    ) current_stock
+    on
+        current_stock.date_id = stock_dates.date_id
+        and
+        current_stock.contract_number = previous_asset.contract_number
+    where
+        stock_dates.date_id in ({{date_ids}})
+        and
+        current_stock.contract_number is null;
+'''.format(stock_dates=_stock_dates_subquery)
+
+populate_presentation_fact_price_oscillations: str = '''
+    insert into presentation.fact_price_oscillations
+        (
+        broker_id
+        ,asset_id
+        ,geography_id
+        ,previous_price
+        ,price
+        ,price_variation
+        ,date_id
+        )
+    select
+        current_stock.broker_id
+        ,current_stock.asset_id
+        ,current_stock.geography_id
+        ,previous_stock.price previous_price
+        ,current_stock.price
+        ,current_stock.price - previous_stock.price price_variation
+        ,current_stock.date_id
+    from
+        presentation.fact_stock current_stock
+    inner join
+        presentation.dim_asset current_asset
+    on
+        current_stock.asset_id = current_asset.id
+    inner join
+        {stock_dates} stock_dates
+    on
+        current_stock.date_id = stock_dates.date_id
+    inner join
+    (
+        select
+            previous_stock.date_id
+            ,previous_stock.price
+            ,previous_asset.contract_number
+        from
+            presentation.fact_stock previous_stock
+        inner join
+            presentation.dim_asset previous_asset
+        on
+            previous_stock.asset_id = previous_asset.id
+        where
+            -- restrict the scan to the previous dates of the loaded slices
+            previous_stock.date_id in
+            (
+                select
+                    previous_date_id
+                from
+                    {stock_dates} previous_dates
+                where
+                    previous_dates.date_id in ({{date_ids}})
+            )
+    ) previous_stock
+    on
+        previous_stock.date_id = stock_dates.previous_date_id
+        and
+        previous_stock.contract_number = current_asset.contract_number
+    where
+        current_stock.date_id in ({{date_ids}})
+        and
+        current_stock.price != previous_stock.price;
+'''.format(stock_dates=_stock_dates_subquery)
+
 dimension_definitions: Dict[str, Dict[str, str]] = {
     'presentation_dim_broker': {
         'target_table': 'dim_broker',
+        'create_query': create_presentation_dim_broker,
         'base_table': 'dim_broker',
         'match_columns': ['broker']
     },
     'presentation_dim_asset': {
         'target_table': 'dim_asset',
+        'create_query': create_presentation_dim_asset,
         'base_table': 'dim_asset',
-        'match_columns': ['contract_number']
+        'match_columns': ['contract_number'],
+        # close the listings removed from the brokers, in delta mode via the tombstones
+        'close_missing': True,
+        'tombstone_table': 'dim_asset_tombstone'
     },
     'presentation_dim_geography': {
         'target_table': 'dim_geography',
+        'create_query': create_presentation_dim_geography,
         'base_table': 'dim_geography',
         'match_columns': ['country','county', 'parish']
     },
 }
 
-fact_definitions: Dict[str,str] = {
-    'presentation_fact_stock': populate_presentation_fact_stock,
-}
\ No newline at end of file
+fact_definitions: Dict[str, Dict[str, str]] = {
+    'presentation_fact_stock': {
+        'target_table': 'fact_stock',
+        'create_query': create_presentation_fact_stock,
+        'insert_query': populate_presentation_fact_stock,
+        'date_id_query': staged_fact_stock_date_ids
+    },
+}
+
+# the change facts derived from fact_stock, loaded once the fact_stock slices are
+derived_fact_definitions: Dict[str, Dict[str, str]] = {
+    'presentation_fact_new_stock': {
+        'target_table': 'fact_new_stock',
+        'create_query': create_presentation_fact_new_stock,
+        'insert_query': populate_presentation_fact_new_stock,
+        'date_id_query': derived_fact_date_ids
+    },
+    'presentation_fact_deleted_stock': {
+        'target_table': 'fact_deleted_stock',
+        'create_query': create_presentation_fact_deleted_stock,
+        'insert_query': populate_presentation_fact_deleted_stock,
+        'date_id_query': derived_fact_date_ids
+    },
+    'presentation_fact_price_oscillations': {
+        'target_table': 'fact_price_oscillations',
+        'create_query': create_presentation_fact_price_oscillations,
+        'insert_query': populate_presentation_fact_price_oscillations,
+        'date_id_query': derived_fact_date_ids
+    },
+}
+
+
+# the market summary rollups per geography level, refreshed for the loaded date_id slices only
+# each level keeps the geography columns up to its own, dashboards no longer aggregate fact_stock
+summary_geography_levels: Dict[str, List[str]] = {
+    'country': ['country'],
+    'county': ['country', 'county'],
+    'parish': ['country', 'county', 'parish'],
+}
+
+create_presentation_summary_market: str = '''
+    create table if not exists presentation.summary_market_{level}
+    (
+        date_id     		bigint {{encode}},
+{geography_definitions}
+        property_type       varchar {{encode}},
+        stock_count         int {{encode}},
+        average_price       float {{encode}},
+        median_price        float {{encode}},
+        price_per_m2        float {{encode}}
+    )
+    {{table_layout}}
+'''
+
+# note: Redshift requires every sort based aggregate (median, percentile_cont) of a query to share the same ordering,
+# the price per m2 is hence the aggregated price over the aggregated net area rather than a median
+populate_presentation_summary_market: str = '''
+    insert into presentation.summary_market_{level}
+        (
+        date_id
+        ,{geography_columns}
+        ,property_type
+        ,stock_count
+        ,average_price
+        ,median_price
+        ,price_per_m2
+        )
+    select
+        fact_stock.date_id
+        ,{selected_geography_columns}
+        ,dim_asset.property_type
+        ,sum(fact_stock.quantity) stock_count
+        ,avg(fact_stock.price) average_price
+        ,percentile_cont(0.5) within group (order by fact_stock.price) median_price
+        ,sum(case when dim_asset.area_net > 0 then fact_stock.price end) / nullif(sum(case when dim_asset.area_net > 0 then dim_asset.area_net end), 0) price_per_m2
+    from
+        presentation.fact_stock
+    inner join
+        presentation.dim_asset
+    on
+        fact_stock.asset_id = dim_asset.id
+    left join
+        presentation.dim_geography
+    on
+        fact_stock.geography_id = dim_geography.id
+    where
+        fact_stock.date_id in ({{date_ids}})
+    group by
+        fact_stock.date_id
+        ,{selected_geography_columns}
+        ,dim_asset.property_type;
+'''
+
+summary_definitions: Dict[str, Dict[str, str]] = {
+    'presentation_summary_market_' + level: {
+        'target_table': 'summary_market_' + level,
+        'create_query': create_presentation_summary_market.format(
+            level=level,
+            geography_definitions='\n'.join('        ' + column + ' varchar {encode},' for column in columns)),
+        'insert_query': populate_presentation_summary_market.format(
+            level=level,
+            geography_columns='\n        ,'.join(columns),
+            selected_geography_columns='\n        ,'.join('dim_geography.' + column for column in columns)),
+        'date_id_query': staged_fact_stock_date_ids
+    } for level, columns in summary_geography_levels.items()
+}
+
+# the rollups are small and only read, they are copied to every node and sorted on their date
+table_layouts.update({
+    'summary_market_' + level: TableLayout(
+        dist_style='all',
+        sort_keys=['date_id'] + columns,
+        encodings=dict({'date_id': 'raw', 'property_type': 'bytedict', 'stock_count': 'az64', 'average_price': 'zstd',
+                        'median_price': 'zstd', 'price_per_m2': 'zstd'}, **{column: 'raw' for column in columns})
+    ) for level, columns in summary_geography_levels.items()
+})
@@ -1,11 +1,79 @@
+import hashlib
+import re
+
 from dataclasses import dataclass
-from typing import Any, List, Dict, Generator, Tuple
+from typing import Any, List, Dict, Generator, Optional, Tuple
 
 
 @dataclass
 class CopyConfig:
     destination_name: str
     source_name: str
+    # the COPY manifest written by scripts/el_to_parquet.py, listing the exact Parquet files
+    manifest_name: Optional[str] = None
+
+
+@dataclass
+class TableDefinition:
+    schema_name: str
+    table_name: str
+    # the column names, in their table order
+    columns: List[str]
+    # identifies the DDL the columns were derived from, changes whenever the definition does
+    fingerprint: str
+
+# the hash column type per scripts/el_to_parquet.py --hash_algorithm, the staging and presentation types must match
+hash_column_types: Dict[str, str] = {
+    'sha256': 'char(64)',
+    'binary': 'varbyte(32)',
+    'xxhash64': 'bigint',
+}
+
+
+def format_hash_type(query: str, hash_algorithm: str = 'sha256') -> str:
+    """Injects the hash column type matching the row hash algorithm in a table definition
+
+    Parameters
+    ----------
+    query : str
+        the table definition, holding {hash_type} placeholders
+    hash_algorithm : str, optional
+        the row hash algorithm used by scripts/el_to_parquet.py, by default 'sha256'
+
+    Returns
+    -------
+    str
+        the table definition with the hash column type
+
+    Raises
+    ------
+    ValueError
+        unknown hash algorithm
+    """
+    if hash_algorithm not in hash_column_types:
+        raise ValueError(f'format_hash_type:: unknown hash algorithm {hash_algorithm}')
+
+    # replace rather than format, table definitions may hold other braces
+    return query.replace('{hash_type}', hash_column_types[hash_algorithm])
+
+
+def format_create_if_missing(query: str) -> str:
+    """Turns a staging table definition into a create if missing, dropping its DROP TABLE statement
+
+    Parameters
+    ----------
+    query : str
+        the table definition, preceded by its DROP TABLE IF EXISTS statement
+
+    Returns
+    -------
+    str
+        the table definition, leaving an existing table (and its data) untouched
+    """
+    query = re.sub(r'drop\s+table\s+if\s+exists\s+[\w.]+\s*;', '', query, flags=re.IGNORECASE)
+
+    return re.sub(r'create\s+table\s+(?!if\s+not\s+exists)', 'CREATE TABLE IF NOT EXISTS ', query, count=1, flags=re.IGNORECASE)
+
 
 create_staging_schema: str = '''
     create schema if not exists staging;
@@ -17,7 +85,7 @@ broker_staging_create = '''
   CREATE TABLE staging.dim_broker 
   (
       broker         varchar,
-      hash           varchar
+      hash           {hash_type}
   )
 '''
 
@@ -39,10 +107,31 @@ asset_staging_create = '''
         area_net                 float,
         latitude                float,
         longitude               float,
-        hash                    varchar
+        hash                    {hash_type}
     )
 '''
 
+asset_tombstone_staging_create = '''
+  DROP TABLE IF EXISTS staging.dim_asset_tombstone;
+  
+  CREATE TABLE staging.dim_asset_tombstone
+  (
+        contract_number         varchar,
+        deletion_date           varchar
+  )
+'''
+
+# the extraction mode actually applied by scripts/el_to_parquet.py, a delta falls back to full without a previous period
+extraction_mode_staging_create = '''
+  DROP TABLE IF EXISTS staging.extraction_mode;
+  
+  CREATE TABLE staging.extraction_mode
+  (
+        mode                    varchar,
+        execution_date          varchar
+  )
+'''
+
 stock_staging_create = '''
   DROP TABLE IF EXISTS staging.fact_stock;
   
@@ -66,23 +155,147 @@ geography_staging_create = '''
         country varchar,
         county varchar,
         parish varchar,
-        hash varchar
+        hash {hash_type}
   )
 
 '''
 
 # holds the Redshift presentation COPY statements
 copy_query_definition: Dict[str, CopyConfig] = {
-    'staging_dim_asset': CopyConfig(destination_name='staging.dim_asset', source_name='{bucket_name}asset_staging.parquet'),
-    'staging_dim_geography': CopyConfig(destination_name='staging.dim_geography', source_name='{bucket_name}geography.parquet'),
-    'staging_dim_broker': CopyConfig(destination_name='staging.dim_broker', source_name='{bucket_name}broker_staging.parquet'),
-    'staging_fact_stock': CopyConfig(destination_name='staging.dim_broker', source_name='{bucket_name}asset_stock.parquet'),
+    'staging_dim_asset': CopyConfig(destination_name='staging.dim_asset', source_name='{bucket_name}asset_staging.parquet',
+                                    manifest_name='{bucket_name}manifests/asset_staging.parquet.manifest'),
+    'staging_dim_asset_tombstone': CopyConfig(destination_name='staging.dim_asset_tombstone', source_name='{bucket_name}asset_tombstone.parquet',
+                                              manifest_name='{bucket_name}manifests/asset_tombstone.parquet.manifest'),
+    'staging_dim_geography': CopyConfig(destination_name='staging.dim_geography', source_name='{bucket_name}geography.parquet',
+                                        manifest_name='{bucket_name}manifests/geography.parquet.manifest'),
+    'staging_dim_broker': CopyConfig(destination_name='staging.dim_broker', source_name='{bucket_name}broker_staging.parquet',
+                                     manifest_name='{bucket_name}manifests/broker_staging.parquet.manifest'),
+    'staging_fact_stock': CopyConfig(destination_name='staging.fact_stock', source_name='{bucket_name}asset_stock.parquet',
+                                     manifest_name='{bucket_name}manifests/asset_stock.parquet.manifest'),
+    'staging_extraction_mode': CopyConfig(destination_name='staging.extraction_mode', source_name='{bucket_name}extraction_mode.parquet',
+                                          manifest_name='{bucket_name}manifests/extraction_mode.parquet.manifest'),
 }
 
-# holds the Redshift presentation table creation definition
+# holds the Redshift presentation table creation definition, the hash type is injected via format_hash_type
 create_query_destinition: Dict[str, str] = {
     'staging_broker': broker_staging_create,
     'staging_asset': asset_staging_create,
+    'staging_asset_tombstone': asset_tombstone_staging_create,
     'staging_geography': geography_staging_create,
-    'staging_stock': stock_staging_create
+    'staging_stock': stock_staging_create,
+    'staging_extraction_mode': extraction_mode_staging_create
 }
+
+
+def get_ddl_fingerprint(query: str) -> str:
+    """Generates a fingerprint of a table definition, insensitive to whitespace and case
+
+    Parameters
+    ----------
+    query : str
+        the table definition
+
+    Returns
+    -------
+    str
+        the definition's fingerprint
+    """
+    normalized_query: str = ' '.join(query.lower().split())
+
+    return hashlib.sha256(normalized_query.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_table_definition(query: str) -> TableDefinition:
+    """Derives the schema, table and column names from a CREATE TABLE definition, sparing the information_schema lookups
+
+    Parameters
+    ----------
+    query : str
+        the table definition, optionally preceded by other statements (e.g. DROP TABLE)
+
+    Returns
+    -------
+    TableDefinition
+        the parsed table definition
+
+    Raises
+    ------
+    ValueError
+        the query does not hold a CREATE TABLE definition
+    """
+    create_match = re.search(r'create\s+table\s+(?:if\s+not\s+exists\s+)?(\w+)\.(\w+)\s*\((.*)\)',
+                             query, re.IGNORECASE | re.DOTALL)
+
+    if create_match is None:
+        raise ValueError('parse_table_definition:: no CREATE TABLE definition found')
+
+    schema_name, table_name, body = create_match.groups()
+
+    # split the column definitions on the top level commas, types may hold commas (e.g. decimal(10, 2))
+    definitions: List[str] = []
+    depth: int = 0
+    current: str = ''
+
+    for character in body:
+        if character == ',' and depth == 0:
+            definitions.append(current)
+            current = ''
+            continue
+
+        depth += {'(': 1, ')': -1}.get(character, 0)
+        current += character
+
+    definitions.append(current)
+
+    constraint_keywords: List[str] = ['constraint', 'primary', 'foreign', 'unique', 'check', 'distkey', 'sortkey']
+
+    columns: List[str] = [definition.split()[0].lower() for definition in definitions
+                          if definition.split() and definition.split()[0].lower() not in constraint_keywords]
+
+    # the column definitions only, the fingerprint is kept whether the table is dropped first or created if missing
+    return TableDefinition(schema_name=schema_name.lower(), table_name=table_name.lower(), columns=columns,
+                           fingerprint=get_ddl_fingerprint(body))
+
+
+# records the fingerprint of the definition a table was created with, compared by operators.dimension_operator.DimensionOperator
+ddl_fingerprint_comment: str = '''
+    comment on table {schema_name}.{table_name} is 'ddl:{fingerprint}';
+'''
+
+
+def format_fingerprint_comment(query: str) -> str:
+    """Appends the recording of the definition's fingerprint to a table definition, which must (re)create the table
+
+    Parameters
+    ----------
+    query : str
+        the rendered table definition (e.g. via format_hash_type), dropping the table first
+
+    Returns
+    -------
+    str
+        the table definition, followed by the fingerprint's table comment
+    """
+    definition: TableDefinition = parse_table_definition(query)
+
+    return query.rstrip() + ';\n' + ddl_fingerprint_comment.format(schema_name=definition.schema_name, table_name=definition.table_name,
+                                                                   fingerprint=definition.fingerprint)
+
+
+def get_staging_table_definitions(hash_algorithm: str = 'sha256') -> Dict[Tuple[str, str], TableDefinition]:
+    """Derives the staging table definitions, keyed by (schema, table), from their DDL as rendered for the hash algorithm
+
+    Parameters
+    ----------
+    hash_algorithm : str, optional
+        the row hash algorithm used by scripts/el_to_parquet.py, by default 'sha256'
+
+    Returns
+    -------
+    Dict[Tuple[str, str], TableDefinition]
+        the staging table definitions
+    """
+    definitions: List[TableDefinition] = [parse_table_definition(format_hash_type(query, hash_algorithm))
+                                          for query in create_query_destinition.values()]
+
+    return {(definition.schema_name, definition.table_name): definition for definition in definitions}
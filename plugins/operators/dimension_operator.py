@@ -1,11 +1,15 @@
+import time
+
 from re import match
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 
+from helpers.sql_queries_staging import TableDefinition
+
 
 class DimensionOperator(BaseOperator):
 
@@ -14,7 +18,7 @@ class DimensionOperator(BaseOperator):
         update 
             presentation.{target_update}
         set
-            record_end_date = current_date - 1
+            record_end_date = {record_end_date}
         from
         (
             select
@@ -44,7 +48,7 @@ class DimensionOperator(BaseOperator):
             presentation.{target_update} ({insert_columns})
         select
             {base_columns},
-            current_date record_start_date,
+            {record_start_date} record_start_date,
             '99991231' record_end_date
         from
             staging.{target_base} base
@@ -52,10 +56,13 @@ class DimensionOperator(BaseOperator):
             presentation.{target_update} target
         on
             {match_predicate}
+            and
+            -- compare against the active record only, the closed (historical) ones holding previous hashes
+            target.record_end_date = '99991231'
         where
             -- select only cases with modifications or no record
             (
-            -- no previous record
+            -- no active record, either new or closed by the update above
             target.id is null
             or
             -- altered record
@@ -63,8 +70,164 @@ class DimensionOperator(BaseOperator):
             );
     '''
 
+    # SCD close-out of the active records whose business key vanished from staging (anti-join)
+    _close_missing_statement: str = '''
+        update
+            presentation.{target_update}
+        set
+            record_end_date = {record_end_date}
+        from
+        (
+            select
+            target.id
+            from
+            presentation.{target_update} target
+            left join
+            staging.{target_base} base
+            on
+            {match_predicate}
+            where
+            target.record_end_date = '99991231'
+            and
+            -- no staging record
+            base.{match_column} is null
+        ) missing_records_
+        where
+            {target_update}.id = missing_records_.id;
+    '''
+
+    # SCD close-out of the active records listed in a tombstone table, staging only holds the changes in delta mode
+    _close_tombstone_statement: str = '''
+        update
+            presentation.{target_update}
+        set
+            record_end_date = {record_end_date}
+        from
+            staging.{tombstone_table} tombstone
+        where
+            {tombstone_predicate}
+            and
+            {target_update}.record_end_date = '99991231';
+    '''
+
+    # change set engine, part 1: classify every staging and active presentation record once (new, changed, unchanged, deleted)
+    # unchanged records are dropped, the change set only holds the records to act upon
+    # the deleted records are only classified via a full outer join when needed (close_missing without tombstones)
+    _change_set_statement: str = '''
+        drop table if exists {change_set};
+
+        create temp table {change_set} as
+        select
+            *
+        from
+        (
+            select
+                {base_columns},
+                target.id change_target_id,
+                case
+                    when target.id is null then 'new'
+                    when base.hash is null then 'deleted'
+                    when target.hash != base.hash then 'changed'
+                    else 'unchanged'
+                end change_type
+            from
+                staging.{target_base} base
+            {join_type} join
+            (
+                -- compare against the active records only, closed records are history
+                select
+                    *
+                from
+                    presentation.{target_update}
+                where
+                    record_end_date = '99991231'
+            ) target
+            on
+            {match_predicate}
+        ) classified_records_
+        where
+            change_type != 'unchanged';
+    '''
+
+    _change_set_count_statement: str = '''
+        select
+            change_type,
+            count(1)
+        from
+            {change_set}
+        group by
+            change_type;
+    '''
+
+    # change set engine, part 2: close the active versions of the changed (and, with close_missing, deleted) records
+    _change_set_update_statement: str = '''
+        update
+            presentation.{target_update}
+        set
+            record_end_date = {record_end_date}
+        from
+            {change_set}
+        where
+            {target_update}.id = {change_set}.change_target_id
+            and
+            {change_set}.change_type = '{change_type}';
+    '''
+
+    # change set engine, part 3: insert the new record versions
+    _change_set_insert_statement: str = '''
+        insert into
+            presentation.{target_update} ({insert_columns})
+        select
+            {change_columns},
+            {record_start_date} record_start_date,
+            '99991231' record_end_date
+        from
+            {change_set}
+        where
+            change_type in ('new', 'changed');
+    '''
+
+    # the definition fingerprint recorded on a table by helpers.sql_queries_staging.format_fingerprint_comment
+    _fingerprint_statement: str = '''
+        select
+            description.description
+        from
+            pg_catalog.pg_description description
+        inner join
+            pg_catalog.pg_class class
+        on
+            description.objoid = class.oid
+        inner join
+            pg_catalog.pg_namespace namespace
+        on
+            class.relnamespace = namespace.oid
+        where
+            namespace.nspname = '{schema}'
+            and
+            class.relname = '{table}'
+            and
+            description.objsubid = 0;
+    '''
+
+    # the extraction mode actually applied by scripts/el_to_parquet.py, staged alongside its outputs
+    _extraction_mode_statement: str = '''
+        select
+            mode
+        from
+            staging.{extraction_mode_table};
+    '''
+
+    # the available merge engines, upsert being the original UPDATE and INSERT pair
+    merge_engines: List[str] = ['change_set', 'upsert']
+
+    # the effective date is rendered from the execution date, the date the staged snapshot (and its fact_stock stock_date) refers to
+    template_fields: Tuple[str, ...] = ('_effective_date', )
+
     @apply_defaults
-    def __init__(self, postgres_conn_id: str, target_table: str, base_table: str, match_columns: List[str], database_name: str = 'dev', *args, **kwargs):
+    def __init__(self, postgres_conn_id: str, target_table: str, base_table: str, match_columns: List[str], database_name: str = 'dev',
+                 merge_engine: str = 'change_set', base_definition: Optional[TableDefinition] = None, close_missing: bool = False,
+                 tombstone_table: Optional[str] = None, extraction_mode_table: Optional[str] = None, effective_date: Optional[str] = '{{ ds }}',
+                 *args, **kwargs):
 
         if postgres_conn_id is None or target_table is None or base_table is None or match_columns is None:
             raise ValueError('DimensionOperator::__init__ missing arguments')
@@ -73,6 +236,10 @@ class DimensionOperator(BaseOperator):
             raise AttributeError(
                 'DimensionOperator::__init__ invalid arguments')
 
+        if merge_engine not in self.merge_engines:
+            raise ValueError(
+                f'DimensionOperator::__init__ unknown merge engine {merge_engine}')
+
         super(DimensionOperator, self).__init__(*args, **kwargs)
 
         self._postgres_conn_id = postgres_conn_id
@@ -80,15 +247,30 @@ class DimensionOperator(BaseOperator):
         self._base_table = base_table
         self._match_columns = match_columns
         self._database_name = database_name
+        self._merge_engine = merge_engine
+        self._base_definition = base_definition
+        self._close_missing = close_missing
+        self._tombstone_table = tombstone_table
+        self._extraction_mode_table = extraction_mode_table
+        self._applied_tombstone_table = tombstone_table
+        self._effective_date = effective_date
 
     def execute(self, context):
         self._hook = PostgresHook(postgres_conn_id=self._postgres_conn_id,
                                   schema=self._database_name)
 
+        # the tombstones only hold the deleted records when the extraction ran in delta mode
+        self._applied_tombstone_table = self._get_tombstone_table(self._hook)
+
+        if self._merge_engine == 'change_set':
+            self._execute_change_set(self._hook)
+
+            return
+
         query: str = self._generate_upsert_query(
-            self._hook, self._target_table, self._base_table, self._match_columns)
+            self._hook, self._target_table, self._base_table, self._match_columns, self._effective_date)
 
-        self.log.info('DimensionOperator::execute running query %', query)
+        self.log.info('DimensionOperator::execute running query %s', query)
 
         self._hook.run(query, autocommit=True, parameters=None)
 
@@ -97,6 +279,234 @@ class DimensionOperator(BaseOperator):
 
         self.log.info('DimensionOperator::execute finished running query')
 
+        if self._close_missing:
+            self._execute_close_missing(self._hook)
+
+    def _get_tombstone_table(self, hook: PostgresHook) -> Optional[str]:
+        """Asserts whether the tombstone table applies, the extraction falls back to full mode (staging holding every record,
+        and no tombstones) when the previous period is missing, in which case the missing records are closed via staging
+
+        Parameters
+        ----------
+        hook : PostgresHook
+            The Apache Airflow PostgresHook holding the connection details
+
+        Returns
+        -------
+        Optional[str]
+            The tombstone table, None if the extraction did not run in delta mode
+        """
+        if self._tombstone_table is None or self._extraction_mode_table is None:
+            return self._tombstone_table
+
+        extraction_mode = hook.get_first(self._extraction_mode_statement.format(extraction_mode_table=self._extraction_mode_table))
+
+        if extraction_mode is not None and extraction_mode[0] == 'delta':
+            return self._tombstone_table
+
+        self.log.info('DimensionOperator::execute the extraction ran in %s mode, closing the missing records via %s instead of %s',
+                      extraction_mode[0] if extraction_mode else 'an unknown', self._base_table, self._tombstone_table)
+
+        return None
+
+    def _execute_close_missing(self, hook: PostgresHook) -> None:
+        """Closes the active records whose business key is absent from staging, or listed in the tombstone table
+
+        Parameters
+        ----------
+        hook : PostgresHook
+            The Apache Airflow PostgresHook holding the connection details
+        """
+        query: str = self.generate_close_missing_query(
+            self._target_table, self._base_table, self._match_columns, self._applied_tombstone_table, self._effective_date)
+
+        connection = hook.get_conn()
+
+        try:
+            cursor = connection.cursor()
+            start_time: float = time.time()
+
+            self.log.info('DimensionOperator::execute running close_missing query %s', query)
+
+            cursor.execute(query)
+
+            self.log.info('DimensionOperator::execute closed %s missing records in %.2f seconds',
+                          cursor.rowcount, time.time() - start_time)
+
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def _execute_change_set(self, hook: PostgresHook) -> None:
+        """Runs the change set merge engine, computing the change set once and driving both the close-out and the insert from it
+           within a single transaction
+
+        Parameters
+        ----------
+        hook : PostgresHook
+            The Apache Airflow PostgresHook holding the connection details
+        """
+        clean_columns: List[str] = self._get_insertion_columns(
+            hook, 'staging', self._base_table)
+
+        queries: Dict[str, str] = self.generate_change_set_queries(
+            self._target_table, self._base_table, self._match_columns, clean_columns, self._close_missing, self._applied_tombstone_table,
+            self._effective_date)
+
+        connection = hook.get_conn()
+
+        try:
+            cursor = connection.cursor()
+
+            for step, query in queries.items():
+                start_time: float = time.time()
+
+                self.log.info('DimensionOperator::execute running %s query %s', step, query)
+
+                cursor.execute(query)
+
+                if step == 'count':
+                    for change_type, record_count in cursor.fetchall():
+                        self.log.info('DimensionOperator::execute %s %s records', record_count, change_type)
+                else:
+                    self.log.info('DimensionOperator::execute %s affected %s records in %.2f seconds',
+                                  step, cursor.rowcount, time.time() - start_time)
+
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        self.log.info('DimensionOperator::execute finished running the change set merge')
+
+    @staticmethod
+    def get_record_dates(effective_date: Optional[str] = None) -> Tuple[str, str]:
+        """Generates the SCD2 record_start_date of the new record versions and record_end_date of the superseded ones
+
+        Parameters
+        ----------
+        effective_date : Optional[str], optional
+            The date the staged records refer to (YYYY-MM-DD), the merge date (current_date) is used if None, by default None
+
+        Returns
+        -------
+        Tuple[str, str]
+            The record_start_date and record_end_date SQL expressions, the superseded versions ending the day before
+        """
+        start_date: str = 'current_date' if effective_date is None else f"'{effective_date}'::date"
+
+        return start_date, start_date + ' - 1'
+
+    @classmethod
+    def generate_close_missing_query(cls, target_table: str, base_table: str, match_columns: List[str], tombstone_table: Optional[str] = None,
+                                     effective_date: Optional[str] = None) -> str:
+        """Generates the close-out statement of the active records whose business key vanished from staging
+
+        Parameters
+        ----------
+        target_table : str
+            The presentation table name
+        base_table : str
+            The staging table name
+        match_columns : List[str]
+            The business keys
+        tombstone_table : Optional[str], optional
+            The staging table listing the deleted business keys, required whenever staging only holds the changes (delta mode), by default None
+        effective_date : Optional[str], optional
+            The date the staged records refer to (YYYY-MM-DD), the merge date is used if None, by default None
+
+        Returns
+        -------
+        str
+            The generated close-out SQL statement
+        """
+        _, record_end_date = cls.get_record_dates(effective_date)
+
+        if tombstone_table is not None:
+            tombstone_predicate: str = '\n and \n'.join(
+                ['tombstone.' + column + ' = ' + target_table + '.' + column for column in match_columns])
+
+            return cls._close_tombstone_statement.format(target_update=target_table, tombstone_table=tombstone_table,
+                                                         tombstone_predicate=tombstone_predicate, record_end_date=record_end_date)
+
+        match_predicate: str = '\n and \n'.join(
+            ['base.' + column + ' = target.' + column for column in match_columns])
+
+        # a matched staging record always holds its business keys, the first one is enough to detect the absence
+        return cls._close_missing_statement.format(target_update=target_table, target_base=base_table, match_predicate=match_predicate,
+                                                   match_column=match_columns[0], record_end_date=record_end_date)
+
+    @classmethod
+    def generate_change_set_queries(cls, target_table: str, base_table: str, match_columns: List[str], columns: List[str],
+                                    close_missing: bool = False, tombstone_table: Optional[str] = None,
+                                    effective_date: Optional[str] = None) -> Dict[str, str]:
+        """Generates the change set merge engine statements, in their execution order
+
+        Parameters
+        ----------
+        target_table : str
+            The presentation table name
+        base_table : str
+            The staging table name
+        match_columns : List[str]
+            The business keys
+        columns : List[str]
+            The staging columns to insert, as retrieved by _get_insertion_columns
+        close_missing : bool, optional
+            Whether to close the active records absent from staging, by default False
+        tombstone_table : Optional[str], optional
+            The staging table listing the deleted business keys, used instead of the change set's deleted records, by default None
+        effective_date : Optional[str], optional
+            The date the staged records refer to (YYYY-MM-DD), the merge date is used if None, by default None
+
+        Returns
+        -------
+        Dict[str, str]
+            The change_set, count, update, (close_missing) and insert statements
+        """
+        change_set: str = target_table + '_change_set'
+
+        record_start_date, record_end_date = cls.get_record_dates(effective_date)
+
+        match_predicate: str = '\n and \n'.join(
+            ['base.' + column + ' = target.' + column for column in match_columns])
+
+        # the business keys of deleted records only exist in the presentation table
+        base_columns: str = ', '.join(
+            [('coalesce(base.{column}, target.{column}) {column}' if column in match_columns else 'base.{column}').format(column=column)
+             for column in columns])
+
+        insert_columns: str = ','.join(columns + ['record_start_date', 'record_end_date'])
+
+        # in delta mode staging lacks the unchanged records, a full outer join would classify them all as deleted
+        classify_deleted: bool = close_missing and tombstone_table is None
+
+        queries: Dict[str, str] = {
+            'change_set': cls._change_set_statement.format(change_set=change_set, target_update=target_table, target_base=base_table,
+                                                           match_predicate=match_predicate, base_columns=base_columns,
+                                                           join_type='full outer' if classify_deleted else 'left'),
+            'count': cls._change_set_count_statement.format(change_set=change_set),
+            'update': cls._change_set_update_statement.format(change_set=change_set, target_update=target_table, change_type='changed',
+                                                              record_end_date=record_end_date),
+        }
+
+        if classify_deleted:
+            queries['close_missing'] = cls._change_set_update_statement.format(change_set=change_set, target_update=target_table,
+                                                                               change_type='deleted', record_end_date=record_end_date)
+        elif close_missing:
+            queries['close_missing'] = cls.generate_close_missing_query(target_table, base_table, match_columns, tombstone_table,
+                                                                        effective_date)
+
+        queries['insert'] = cls._change_set_insert_statement.format(change_set=change_set, target_update=target_table, insert_columns=insert_columns,
+                                                                    change_columns=', '.join(columns), record_start_date=record_start_date)
+
+        return queries
+
     def _get_insertion_columns(self, hook: PostgresHook, schema_name: str, table_name: str) -> List[str]:
         """Retrieves the list of columns present in the selected table_name within the schema_name schema, in their correct order (table order)
 
@@ -113,7 +523,24 @@ class DimensionOperator(BaseOperator):
         -------
         List[str]
             The list of columns present in the table_name within the schema_name schema
-        """        
+        """
+        # the columns derived from the DDL at DAG parse time spare the (slow) catalog lookup, provided the deployed table was
+        # created from that same DDL (e.g. not under another hash type, or kept by a create if missing)
+        definition: Optional[TableDefinition] = self._base_definition
+
+        if definition is not None and definition.schema_name == schema_name and definition.table_name == table_name:
+            deployed_fingerprint = hook.get_first(self._fingerprint_statement.format(schema=schema_name, table=table_name))
+
+            if deployed_fingerprint is not None and deployed_fingerprint[0] == 'ddl:' + definition.fingerprint:
+                self.log.info('DimensionOperator::_get_insertion_columns using the %s.%s definition columns (DDL fingerprint %s)',
+                              schema_name, table_name, definition.fingerprint)
+
+                return [column for column in definition.columns if column != 'id']
+
+            self.log.info('DimensionOperator::_get_insertion_columns %s.%s was not created from its definition (DDL fingerprint %s, deployed %s), '
+                          'looking up its columns', schema_name, table_name, definition.fingerprint,
+                          deployed_fingerprint[0] if deployed_fingerprint else None)
+
         # Get all column names from the Redshift presentation layer, and exclude ID from the insertion
         base_query = '''
             SELECT 
@@ -123,7 +550,9 @@ class DimensionOperator(BaseOperator):
             WHERE 
                 table_schema = '{schema}'
             AND 
-                table_name   = '{table}';
+                table_name   = '{table}'
+            ORDER BY
+                ordinal_position;
         '''
 
         formatted_query: str = base_query.format(
@@ -136,7 +565,8 @@ class DimensionOperator(BaseOperator):
 
         return columns
 
-    def _generate_upsert_query(self, hook: PostgresHook, target_table: str, base_table: str, match_columns: List[str]) -> str:
+    def _generate_upsert_query(self, hook: PostgresHook, target_table: str, base_table: str, match_columns: List[str],
+                               effective_date: Optional[str] = None) -> str:
         """Generates an AWS Redshift SQL upsert (update and insert) statement using match_columns as the business keys between base_table (staging) and target_table (presentation)
            tracking deltas via SCD2
 
@@ -150,31 +580,62 @@ class DimensionOperator(BaseOperator):
             The presentation table name
         match_columns : List[str]
             The business keys
+        effective_date : Optional[str], optional
+            The date the staged records refer to (YYYY-MM-DD), the merge date is used if None, by default None
 
         Returns
         -------
         str
             The generated upsert SQL statement
         """        
+        # fetch the staging columns to automatically generate the insert statement
+        clean_columns: List[str] = self._get_insertion_columns(
+            hook, 'staging', base_table)
+
+        return self.generate_upsert_query(target_table, base_table, match_columns, clean_columns, effective_date)
+
+    @classmethod
+    def generate_upsert_query(cls, target_table: str, base_table: str, match_columns: List[str], columns: List[str],
+                              effective_date: Optional[str] = None) -> str:
+        """Generates the upsert statement from the provided staging columns
+
+        Parameters
+        ----------
+        target_table : str
+            The presentation table name
+        base_table : str
+            The staging table name
+        match_columns : List[str]
+            The business keys
+        columns : List[str]
+            The staging columns to insert, as retrieved by _get_insertion_columns
+        effective_date : Optional[str], optional
+            The date the staged records refer to (YYYY-MM-DD), the merge date is used if None, by default None
+
+        Returns
+        -------
+        str
+            The generated upsert SQL statement
+        """
         # constructs the match predicate, creating the join predicate and combining multiple conditions
         match_predicate: str = '\n and \n'.join(
             ['base.' + column + ' = target.' + column for column in match_columns])
 
-        # fetch the staging columns to automatically generate the insert statement
-        clean_columns: List[str] = self._get_insertion_columns(
-            hook, 'staging', base_table)
+        clean_columns: List[str] = list(columns)
         base_columns: str = ', '.join(
             ['base.' + column for column in clean_columns])
 
+        record_start_date, record_end_date = cls.get_record_dates(effective_date)
+
         # add the record valid flags
         clean_columns.extend(['record_start_date', 'record_end_date'])
         insert_columns: str = ','.join(clean_columns)
 
         # generate the update and insert (upsert) statements
-        update_section: str = self._update_statement.format(
-            target_update=target_table, target_base=base_table, match_predicate=match_predicate)
-        insert_section: str = self._insert_statement.format(target_update=target_table, target_base=base_table, match_predicate=match_predicate, insert_columns=insert_columns,
-                                                            base_columns=base_columns)
+        update_section: str = cls._update_statement.format(
+            target_update=target_table, target_base=base_table, match_predicate=match_predicate, record_end_date=record_end_date)
+        insert_section: str = cls._insert_statement.format(target_update=target_table, target_base=base_table, match_predicate=match_predicate, insert_columns=insert_columns,
+                                                           base_columns=base_columns, record_start_date=record_start_date)
 
         query = update_section + insert_section
 
@@ -0,0 +1,81 @@
+import time
+
+from typing import List
+
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+
+
+class FactOperator(BaseOperator):
+
+    # removes the date_id slices about to be (re)loaded, making retries and backfills idempotent
+    _delete_statement: str = '''
+        delete from
+            presentation.{target_table}
+        where
+            date_id in ({date_ids});
+    '''
+
+    @apply_defaults
+    def __init__(self, postgres_conn_id: str, target_table: str, insert_query: str, date_id_query: str, batch_size: int = 4,
+                 database_name: str = 'dev', *args, **kwargs):
+
+        if postgres_conn_id is None or target_table is None or insert_query is None or date_id_query is None:
+            raise ValueError('FactOperator::__init__ missing arguments')
+
+        if len(postgres_conn_id) == 0 or len(target_table) == 0 or len(insert_query) == 0 or len(date_id_query) == 0 or batch_size < 1:
+            raise AttributeError(
+                'FactOperator::__init__ invalid arguments')
+
+        super(FactOperator, self).__init__(*args, **kwargs)
+
+        self._postgres_conn_id = postgres_conn_id
+        self._target_table = target_table
+        self._insert_query = insert_query
+        self._date_id_query = date_id_query
+        self._batch_size = batch_size
+        self._database_name = database_name
+
+    def execute(self, context):
+        hook: PostgresHook = PostgresHook(postgres_conn_id=self._postgres_conn_id,
+                                          schema=self._database_name)
+
+        date_ids: List[int] = [record[0] for record in hook.get_records(self._date_id_query)]
+
+        if len(date_ids) == 0:
+            self.log.info('FactOperator::execute no staged date_id slices found for %s', self._target_table)
+
+            return
+
+        self.log.info('FactOperator::execute loading %s date_id slices into %s', len(date_ids), self._target_table)
+
+        connection = hook.get_conn()
+
+        try:
+            cursor = connection.cursor()
+
+            # each batch replaces its slices within its own transaction, bounding the cost of long backfills
+            for batch_start in range(0, len(date_ids), self._batch_size):
+                batch: List[int] = date_ids[batch_start:batch_start + self._batch_size]
+                formatted_date_ids: str = ', '.join(str(int(date_id)) for date_id in batch)
+
+                start_time: float = time.time()
+
+                cursor.execute(self._delete_statement.format(target_table=self._target_table, date_ids=formatted_date_ids))
+                removed_rows: int = cursor.rowcount
+
+                cursor.execute(self._insert_query.format(date_ids=formatted_date_ids))
+                inserted_rows: int = cursor.rowcount
+
+                connection.commit()
+
+                self.log.info('FactOperator::execute replaced date_ids %s in %s, removed %s and inserted %s rows in %.2f seconds',
+                              formatted_date_ids, self._target_table, removed_rows, inserted_rows, time.time() - start_time)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        self.log.info('FactOperator::execute finished loading %s', self._target_table)
@@ -1,10 +1,16 @@
+import json
+import time
+
 from datetime import datetime
+from typing import Dict, List, Optional
 
 from airflow.hooks.S3_hook import S3Hook
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 
+from helpers.sql_queries_staging import CopyConfig
+
 
 class S3ToRedshiftOperator(BaseOperator):
 
@@ -12,7 +18,35 @@ class S3ToRedshiftOperator(BaseOperator):
     COPY {destination_name}
     FROM '{source_name}'
         IAM_ROLE '{role_name}'
-        FORMAT AS PARQUET;
+        FORMAT AS PARQUET{manifest};
+    '''
+
+    # the shadow table receiving the COPY in swap mode, leaving the live table readable until the swap
+    shadow_create_query = '''
+    DROP TABLE IF EXISTS {shadow_name};
+    CREATE TABLE {shadow_name} (LIKE {destination_name});
+    '''
+
+    # replaces the live table by its shadow, ALTER TABLE APPEND is avoided as it cannot run within a transaction block
+    shadow_swap_query = '''
+    DROP TABLE IF EXISTS {retired_name};
+    ALTER TABLE {destination_name} RENAME TO {retired_table};
+    ALTER TABLE {shadow_name} RENAME TO {destination_table};
+    DROP TABLE {retired_name};
+    '''
+
+    # the files and lines loaded by each COPY, only available once committed
+    load_commits_query = '''
+    SELECT
+        query,
+        count(distinct filename),
+        sum(lines_scanned)
+    FROM
+        stl_load_commits
+    WHERE
+        query in ({query_ids})
+    GROUP BY
+        query;
     '''
 
     @apply_defaults
@@ -21,13 +55,23 @@ class S3ToRedshiftOperator(BaseOperator):
                  redshift_credentials_id: str,
                  s3_path: str,
                  s3_bucket_template: str,
-                 destination_name: str,
-                 source_name: str,
+                 destination_name: Optional[str],
+                 source_name: Optional[str],
                  role_name: str,
                  region_name: str,
+                 manifest_name: Optional[str] = None,
+                 copy_configs: Optional[List[CopyConfig]] = None,
+                 use_manifest: bool = False,
+                 swap_tables: bool = False,
+                 aws_conn_id: str = 'aws_default',
                  *args,
                  **kwargs):
 
+        # a batch (copy_configs) replaces the single destination_name and source_name
+        if copy_configs:
+            destination_name = destination_name or 'batch'
+            source_name = source_name or 'batch'
+
         if redshift_conn_id is None or redshift_credentials_id is None or s3_path is None or s3_bucket_template is None or destination_name is None or source_name is None or role_name is None or region_name is None:
             raise ValueError(
                 'S3ToRedshiftOperator::__init__ missing arguments')
@@ -36,6 +80,14 @@ class S3ToRedshiftOperator(BaseOperator):
             raise AttributeError(
                 'S3ToRedshiftOperator::__init__ invalid arguments')
 
+        if use_manifest and not copy_configs and manifest_name is None:
+            raise ValueError(
+                'S3ToRedshiftOperator::__init__ use_manifest requires a manifest_name')
+
+        if use_manifest and copy_configs and any(config.manifest_name is None for config in copy_configs):
+            raise ValueError(
+                'S3ToRedshiftOperator::__init__ use_manifest requires a manifest_name per copy configuration')
+
         super(S3ToRedshiftOperator, self).__init__(*args, **kwargs)
 
         self._redshift_conn_id = redshift_conn_id
@@ -45,6 +97,11 @@ class S3ToRedshiftOperator(BaseOperator):
         self._s3_bucket_template = s3_bucket_template
         self._source_name = source_name
         self._destination_name = destination_name
+        self._manifest_name = manifest_name
+        self._copy_configs = copy_configs
+        self._use_manifest = use_manifest
+        self._swap_tables = swap_tables
+        self._aws_conn_id = aws_conn_id
         self._region_name = region_name
         self._role_name = role_name
 
@@ -55,31 +112,217 @@ class S3ToRedshiftOperator(BaseOperator):
         bucket_name = self._format_s3_template(
             s3_path=self._s3_path, s3_bucket_template=self._s3_bucket_template, execution_date=execution_date, s3_path_subfolder='tmp')
 
-        query: str = self._format_copy_query(bucket_name=bucket_name, destination_name=self._destination_name,
-                                             source_name=self._source_name, role_name=self._role_name, region_name=self._region_name)
+        copy_configs: List[CopyConfig] = self._copy_configs or [CopyConfig(destination_name=self._destination_name,
+                                                                           source_name=self._source_name,
+                                                                           manifest_name=self._manifest_name)]
+
+        # TRUNCATE implicitly commits in Redshift, a batch is cleared via DELETE to run in a single transaction
+        clear_statement: str = 'DELETE FROM {}' if self._copy_configs else 'TRUNCATE {}'
 
         redshift: PostgresHook = PostgresHook(
             postgres_conn_id=self._redshift_conn_id)
 
-        self.log.info(
-            'S3ToRedshiftOperator::execute clearing data from Redshift table')
+        # the manifests are read to skip the COPY of the outputs without files (e.g. the tombstones in full mode)
+        s3: Optional[S3Hook] = S3Hook(aws_conn_id=self._aws_conn_id) if self._use_manifest else None
 
-        redshift.run('TRUNCATE {}'.format(self._destination_name))
+        # every table is loaded over the same connection, sequentially: a batch must commit (or roll back) as a whole, which
+        # separate connections cannot, and each COPY already spreads its files over every slice of the cluster
+        connection = redshift.get_conn()
+        copy_ids: Dict[str, int] = {}
 
-        self.log.info(
-            'S3ToRedshiftOperator::execute copying data from S3 to Redshift')
+        try:
+            cursor = connection.cursor()
+            is_redshift: bool = self._is_redshift(cursor)
+
+            for config in copy_configs:
+                # in swap mode the COPY targets the shadow table, the live table is left untouched
+                load_name: str = self._get_shadow_name(config.destination_name) if self._swap_tables else config.destination_name
+
+                query: str = self._format_copy_query(bucket_name=bucket_name, destination_name=load_name,
+                                                     source_name=config.manifest_name if self._use_manifest else config.source_name,
+                                                     role_name=self._role_name, region_name=self._region_name,
+                                                     use_manifest=self._use_manifest)
+
+                start_time: float = time.time()
+
+                if self._swap_tables:
+                    self.log.info(
+                        'S3ToRedshiftOperator::execute creating shadow table %s', load_name)
+
+                    cursor.execute(self.shadow_create_query.format(
+                        shadow_name=load_name, destination_name=config.destination_name))
+                else:
+                    self.log.info(
+                        'S3ToRedshiftOperator::execute clearing data from Redshift table %s', config.destination_name)
+
+                    cursor.execute(clear_statement.format(config.destination_name))
 
-        redshift.run(query)
+                self.log.info(
+                    'S3ToRedshiftOperator::execute copying data from S3 to Redshift table %s', load_name)
+
+                # Redshift rejects a manifest without entries, the cleared (or shadow) table is left empty instead
+                if s3 is not None and self._is_empty_manifest(s3, config.manifest_name.format(bucket_name=bucket_name)):
+                    self.log.info(
+                        'S3ToRedshiftOperator::execute skipping the COPY into %s, its manifest lists no files', load_name)
+
+                    continue
+
+                cursor.execute(query)
+
+                rows_loaded: int = self._get_loaded_rows(cursor, is_redshift)
+
+                if is_redshift:
+                    cursor.execute('SELECT pg_last_copy_id();')
+                    copy_ids[config.destination_name] = cursor.fetchone()[0]
+
+                self.log.info('S3ToRedshiftOperator::execute loaded %s rows into %s in %.2f seconds',
+                              rows_loaded, load_name, time.time() - start_time)
+
+            connection.commit()
+
+            if self._swap_tables:
+                self._swap_shadow_tables(cursor, [config.destination_name for config in copy_configs])
+
+                connection.commit()
+
+            if is_redshift and copy_ids:
+                self._log_load_commits(cursor, copy_ids)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
 
         self.log.info(
             'S3ToRedshiftOperator::execute finishing copying data from S3 to Redshift')
 
+    def _get_shadow_name(self, destination_name: str) -> str:
+        """Generates the shadow table name of a staging table
+
+        Parameters
+        ----------
+        destination_name : str
+            the schema qualified destination table name (e.g. staging.dim_asset)
+
+        Returns
+        -------
+        str
+            the schema qualified shadow table name (e.g. staging.dim_asset__load)
+        """
+        return destination_name + '__load'
+
+    def _swap_shadow_tables(self, cursor, destination_names: List[str]) -> None:
+        """Replaces each live table by its loaded shadow table, within the cursor's open transaction
+
+        Parameters
+        ----------
+        cursor : psycopg2.extensions.cursor
+            the connection's cursor
+        destination_names : List[str]
+            the schema qualified destination table names
+        """
+        start_time: float = time.time()
+
+        for destination_name in destination_names:
+            # RENAME TO only accepts the unqualified table name
+            destination_table: str = destination_name.split('.')[-1]
+
+            cursor.execute(self.shadow_swap_query.format(
+                destination_name=destination_name,
+                destination_table=destination_table,
+                shadow_name=self._get_shadow_name(destination_name),
+                retired_name=destination_name + '__retired',
+                retired_table=destination_table + '__retired'))
+
+        self.log.info('S3ToRedshiftOperator::execute swapped %s tables in %.2f seconds',
+                      len(destination_names), time.time() - start_time)
+
+    def _is_empty_manifest(self, s3: S3Hook, manifest_url: str) -> bool:
+        """Asserts whether a COPY manifest lists no files, as written by scripts/el_to_parquet.py for an empty output
+
+        Parameters
+        ----------
+        s3 : S3Hook
+            the Apache Airflow S3Hook holding the connection details
+        manifest_url : str
+            the manifest's S3 URL
+
+        Returns
+        -------
+        bool
+            whether the manifest lists no files
+        """
+        manifest: Dict = json.loads(s3.read_key(manifest_url))
+
+        return len(manifest.get('entries', [])) == 0
+
+    def _is_redshift(self, cursor) -> bool:
+        """Asserts whether the connection targets Redshift or a Postgres stand-in
+
+        Parameters
+        ----------
+        cursor : psycopg2.extensions.cursor
+            the connection's cursor
+
+        Returns
+        -------
+        bool
+            whether the connection targets Redshift
+        """
+        cursor.execute('SELECT version();')
+
+        return 'redshift' in cursor.fetchone()[0].lower()
+
+    def _get_loaded_rows(self, cursor, is_redshift: bool) -> int:
+        """Retrieves the number of rows loaded by the last COPY
+
+        Parameters
+        ----------
+        cursor : psycopg2.extensions.cursor
+            the cursor which ran the COPY
+        is_redshift : bool
+            whether the connection targets Redshift
+
+        Returns
+        -------
+        int
+            the number of rows loaded
+        """
+        # Postgres reports the copied rows in the command status
+        if not is_redshift:
+            return cursor.rowcount
+
+        cursor.execute('SELECT pg_last_copy_count();')
+
+        return cursor.fetchone()[0]
+
+    def _log_load_commits(self, cursor, copy_ids: Dict[str, int]) -> None:
+        """Logs the files and lines committed by each COPY, as registered in STL_LOAD_COMMITS
+
+        Parameters
+        ----------
+        cursor : psycopg2.extensions.cursor
+            the connection's cursor
+        copy_ids : Dict[str, int]
+            the COPY query id per destination table
+        """
+        destinations: Dict[int, str] = {
+            query_id: destination for destination, query_id in copy_ids.items()}
+
+        cursor.execute(self.load_commits_query.format(
+            query_ids=', '.join(str(query_id) for query_id in destinations)))
+
+        for query_id, file_count, line_count in cursor.fetchall():
+            self.log.info('S3ToRedshiftOperator::execute committed %s lines from %s files into %s',
+                          line_count, file_count, destinations.get(query_id))
+
     def _format_copy_query(self,
                            bucket_name: str,
                            destination_name: str,
                            source_name: str,
                            role_name: str,
-                           region_name: str) -> str:
+                           region_name: str,
+                           use_manifest: bool = False) -> str:
         """Injects meta data onto the provided copy query
 
         Parameters
@@ -89,11 +332,13 @@ class S3ToRedshiftOperator(BaseOperator):
         destination_name : str
             the AWS Redshift's destination table name
         source_name : str
-            the AWS Redshift's source Parquet file name
+            the AWS Redshift's source Parquet file name, or manifest name if use_manifest is set
         role_name : str
             the AWS Redshift's role name
         region_name : str
             the AWS Redshift's region name
+        use_manifest : bool, optional
+            whether the source_name is a manifest listing the Parquet files, by default False
 
         Returns
         -------
@@ -104,7 +349,8 @@ class S3ToRedshiftOperator(BaseOperator):
             destination_name=destination_name,
             source_name=source_name.format(bucket_name=bucket_name),
             role_name=role_name,
-            region_name=region_name
+            region_name=region_name,
+            manifest='\n        MANIFEST' if use_manifest else ''
         )
 
         return formatted_query
@@ -2,32 +2,251 @@
 import argparse
 
 # miscellaneous imports
+import json
+import os
 import re
+import time
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import reduce
 
 # s3 file handling
 import boto3
 
 # pyspark
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import concat_ws, sha2, regexp_replace, lit, col, when, length, substring
+from pyspark.sql.functions import concat_ws, sha2, regexp_replace, regexp_extract, lit, col, when, substring, coalesce, nanvl, unhex, \
+    lower, trim, struct, to_json
+from pyspark.sql.types import StructType, StructField, StringType, DoubleType, FloatType
+from pyspark.sql.utils import AnalysisException
+
+try:
+    from pyspark.sql.functions import xxhash64
+except ImportError:
+    # xxhash64 is only available from Spark 3.0 onwards (EMR 6.x)
+    xxhash64 = None
+
+
+# the asset attributes tracked by the staging layer, the hash is computed over these
+ASSET_ATTRIBUTES = ['contract_number', 'country', 'county', 'parish', 'title', 'description',
+                    'price', 'property_type', 'bathrooms', 'bedrooms', 'area_net', 'latitude', 'longitude']
+
+# the HTML tags to be removed from textual attributes, anchors excluded
+HTML_TAG_PATTERN = """<(?!\/?a(?=>|\s.*>))\/?.*?>"""
+
+# the declarative column normalisation, compiled into a single projection by normalize_columns
+# (source name, target name, default fill, maximum length, strip HTML tags)
+# note: numeric attributes have missing values replaced with -1, textual attributes with "Unknown"
+COLUMN_SPECS = [
+    ('Broker', 'broker', 'Unknown', None, False),
+    ('ContractNumber', 'contract_number', None, None, False),
+    ('Country', 'country', 'Unknown', None, False),
+    ('County', 'county', 'Unknown', None, False),
+    ('Parish', 'parish', 'Unknown', None, False),
+    ('Title', 'title', 'Unknown', 250, True),
+    ('Description', 'description', 'Unknown', 250, True),
+    ('PriceCurrencyFormated', 'price', -1, None, False),
+    ('PropertyType', 'property_type', 'Unknown', None, False),
+    ('Bathrooms', 'bathrooms', -1, None, False),
+    ('Bedrooms', 'bedrooms', -1, None, False),
+    ('AreaNet', 'area_net', -1, None, False),
+    ('Latitude', 'latitude', -1, None, False),
+    ('Longitude', 'longitude', -1, None, False),
+]
+
+# the supported row hash algorithms, the staging and presentation hash column types must match (see helpers.sql_queries_staging)
+# sha256: 64 character hex string; binary: 32 byte SHA-256 digest; xxhash64: 64-bit integer, Spark 3.0+ only
+HASH_ALGORITHMS = ['sha256', 'binary', 'xxhash64']
+
+# the maximum number of keys accepted by a single S3 delete_objects request
+S3_DELETE_BATCH_SIZE = 1000
+
+# the estimated ratio between the in-memory and the Parquet size, used to size the output files
+PARQUET_COMPRESSION_RATIO = 4
+
+# the maximum number of files per dataset when the number of files is estimated
+MAX_OUTPUT_FILES = 2000
+
+# the schema of the deleted assets
+TOMBSTONE_SCHEMA = StructType([StructField('contract_number', StringType(), True),
+                               StructField('deletion_date', StringType(), True)])
+
+# the extraction mode actually applied (full or delta), the delta mode falls back to full without a previous period
+EXTRACTION_MODE_SCHEMA = StructType([StructField('mode', StringType(), True),
+                                     StructField('execution_date', StringType(), True)])
+
+# the column holding the raw content of the records which do not match the source's schema
+CORRUPT_RECORD_COLUMN = '_corrupt_record'
+
+# the versioned per-broker source schemas, each field maps a source (scraped) attribute to its canonical name and type
+# the canonical attributes define a common base for all sources, any attribute not declared is pruned at read time
+# defaults: the canonical attributes filled in when the source does not output them (e.g. the Go crawler's Broker)
+# note: add a new version whenever a broker's output changes, older versions are kept to allow reprocessing past periods
+# note: the crawlers output every attribute as a JSON string, the numeric attributes are parsed by parse_numeric
+SOURCE_SCHEMAS = {
+    # Go crawler output (crawler/go), keeps the Century21 API naming
+    'century21': {
+        'defaults': {'Broker': 'Century21', 'Country': 'Portugal'},
+        'versions': {
+            1: [
+                ('Broker', 'Broker', StringType()),
+                ('ContractNumber', 'ContractNumber', StringType()),
+                ('Country', 'Country', StringType()),
+                ('County', 'County', StringType()),
+                ('Parish', 'Parish', StringType()),
+                ('Title', 'Title', StringType()),
+                ('Description', 'Description', StringType()),
+                ('PriceCurrencyFormated', 'PriceCurrencyFormated', DoubleType()),
+                ('PropertyType', 'PropertyType', StringType()),
+                ('Bathrooms', 'Bathrooms', DoubleType()),
+                ('Bedrooms', 'Bedrooms', DoubleType()),
+                ('AreaNet', 'AreaNet', DoubleType()),
+                ('Latitude', 'Latitude', DoubleType()),
+                ('Longitude', 'Longitude', DoubleType()),
+            ],
+        },
+    },
+    # Scrapy crawler output (crawler/python), follows the ListingItem naming
+    'era': {
+        'defaults': {'Broker': 'ERA Imobiliária', 'Country': 'Portugal'},
+        'versions': {
+            1: [
+                ('broker', 'Broker', StringType()),
+                ('id', 'ContractNumber', StringType()),
+                ('country', 'Country', StringType()),
+                ('county', 'County', StringType()),
+                ('parish', 'Parish', StringType()),
+                ('name', 'Title', StringType()),
+                ('description', 'Description', StringType()),
+                ('asking_price', 'PriceCurrencyFormated', DoubleType()),
+                ('property_type', 'PropertyType', StringType()),
+                ('bathrooms', 'Bathrooms', DoubleType()),
+                ('bedrooms', 'Bedrooms', DoubleType()),
+                ('net_area', 'AreaNet', DoubleType()),
+                ('latitude', 'Latitude', DoubleType()),
+                ('longitude', 'Longitude', DoubleType()),
+            ],
+        },
+    },
+}
+
+# the numeric attributes' text format, attributes absent default to 'decimal'
+# currency: pt-PT formatted amounts (e.g. "1.250.000,50 €"), dots group the thousands and the comma marks the decimals
+# decimal: the leading number, either separator marking the decimals (e.g. "38.7223", "2")
+# area: the leading number, a dot or space followed by exactly three digits grouping the thousands (e.g. "1.250 m²", "80,5", "120 m²")
+NUMERIC_FORMATS = {
+    'PriceCurrencyFormated': 'currency',
+    'AreaNet': 'area',
+}
+
+# the textual values standing for a missing numeric attribute (compared trimmed and lower cased), not quarantined
+# e.g. the price of the listings whose price is only disclosed on request
+MISSING_NUMERIC_VALUES = ['', 'unknown', 'sob consulta', 'preço sob consulta', 'consultar', 'n/d', 'n/a', '-']
+
+# the supported storage schemes, s3 relies on EMRFS while s3a supports custom endpoints and the S3A_PROFILES
+STORAGE_SCHEMES = ['s3', 's3a', 'file']
+
+# the S3A committer binding, Spark's Parquet writes only reach the fs.s3a.committer.name committer through the
+# spark-hadoop-cloud module's commit protocol, which must be on the classpath
+S3A_COMMITTER_SETTINGS = {
+    'spark.sql.sources.commitProtocolClass': 'org.apache.spark.internal.io.cloud.PathOutputCommitProtocol',
+    'spark.sql.parquet.output.committer.class': 'org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter',
+}
+
+# the S3A performance profiles, applied on top of the Hadoop defaults and overridable via --s3a_option
+# the spark.* settings are Spark SQL settings, the others Hadoop settings
+# note: the S3A committers require Hadoop 3.1+ (EMR 6.x) and the spark-hadoop-cloud module
+S3A_PROFILES = {
+    'default': {},
+    # large outputs, uploads blocks from memory while writing with a larger connection pool
+    'throughput': {
+        'fs.s3a.fast.upload': 'true',
+        'fs.s3a.fast.upload.buffer': 'bytebuffer',
+        'fs.s3a.multipart.size': '128M',
+        'fs.s3a.connection.maximum': '200',
+        'fs.s3a.threads.max': '64',
+        'fs.s3a.committer.name': 'directory',
+        **S3A_COMMITTER_SETTINGS,
+    },
+    # memory constrained executors, buffers the uploaded blocks on disk
+    'low_memory': {
+        'fs.s3a.fast.upload': 'true',
+        'fs.s3a.fast.upload.buffer': 'disk',
+        'fs.s3a.multipart.size': '64M',
+        'fs.s3a.connection.maximum': '50',
+        'fs.s3a.threads.max': '16',
+        'fs.s3a.committer.name': 'directory',
+        **S3A_COMMITTER_SETTINGS,
+    },
+}
+
+# the source manifest, lists each source's file prefix within the period's path, its format and broker schema
+# partitions: the number of partitions the source is redistributed into once read, None keeps the reader's partitioning
+# note: can be replaced at runtime via --source_manifest, a JSON file holding the same structure
+SOURCE_MANIFEST = [
+    # the Go crawler writes a single indented JSON array per file (json.MarshalIndent, crawler/go/util)
+    {'broker': 'century21', 'prefix': 'pt_century21', 'format': 'json_array', 'partitions': None},
+    {'broker': 'era', 'prefix': 'pt_era', 'format': 'json', 'partitions': None},
+]
+
+# the reader configuration per source format: (Spark format, file pattern, reader options)
+SOURCE_FORMATS = {
+    # one JSON record per line
+    'json': ('json', '*.json', {}),
+    # one JSON record per line, gzip files are not splittable and read by a single task each
+    'json_gzip': ('json', '*.json.gz', {}),
+    # a JSON array per file (e.g. the Go crawler's output)
+    'json_array': ('json', '*.json', {'multiLine': 'true'}),
+    # Parquet files written by the crawlers
+    'parquet': ('parquet', '*.parquet', {}),
+}
+
+
+def emit_metric(metric, value, **dimensions):
+    """Prints a job metric as a JSON line, to be collected from the driver's log
 
+    Args:
+        metric (str): the metric name
+        value (float): the metric value
+        dimensions (dict): the metric dimensions, e.g. the source
+    """
+
+    print('METRIC ' + json.dumps(dict(metric=metric, value=value, **dimensions), sort_keys=True))
 
-def create_spark_session(aws_key, aws_secret):
-    """Creates a PySpark Session with the specified AWS credentials
+
+def create_spark_session(aws_key, aws_secret, storage_scheme='s3', s3_endpoint=None, s3a_profile='default', s3a_options=None):
+    """Creates a PySpark Session with the specified AWS credentials and storage configuration
 
     Args:
         aws_key (str): the AWS access key
         aws_secret (str): the AWS access secret
+        storage_scheme (str, optional): the storage scheme, one of STORAGE_SCHEMES. Defaults to 's3'
+        s3_endpoint (str, optional): a custom S3 endpoint (e.g. a MinIO server), S3A only. Defaults to AWS S3
+        s3a_profile (str, optional): the S3A performance profile, one of S3A_PROFILES. Defaults to 'default'
+        s3a_options (dict, optional): additional S3A (Hadoop, or spark.* Spark SQL) settings, overriding the profile's
+
+    Raises:
+        ValueError: unknown storage scheme or S3A profile
 
     Returns:
         pyspark.sql.SparkSession: the created PySpark Session
     """
 
+    if storage_scheme not in STORAGE_SCHEMES:
+        raise ValueError('create_spark_session:: Unknown storage scheme {}'.format(storage_scheme))
+
+    if s3a_profile not in S3A_PROFILES:
+        raise ValueError('create_spark_session:: Unknown S3A profile {}'.format(s3a_profile))
+
     spark = SparkSession.builder\
         .enableHiveSupport().getOrCreate()
 
+    # the local file system requires no configuration
+    if storage_scheme == 'file':
+        return spark
+
     hadoop_config = spark._jsc.hadoopConfiguration()
     hadoop_config.set("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0")
     hadoop_config.set("fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem")
@@ -35,88 +254,112 @@ def create_spark_session(aws_key, aws_secret):
     hadoop_config.set("fs.s3n.awsSecretAccessKey", aws_secret)
     hadoop_config.set("fs.s3a.endpoint", "s3.amazonaws.com")
 
+    if storage_scheme == 's3a':
+        hadoop_config.set("fs.s3a.access.key", aws_key)
+        hadoop_config.set("fs.s3a.secret.key", aws_secret)
+
+        if s3_endpoint:
+            # S3 compatible servers are typically addressed by path rather than by virtual host
+            hadoop_config.set("fs.s3a.endpoint", s3_endpoint)
+            hadoop_config.set("fs.s3a.path.style.access", "true")
+            hadoop_config.set("fs.s3a.connection.ssl.enabled", str(s3_endpoint.startswith('https')).lower())
+
+        s3a_settings = dict(S3A_PROFILES[s3a_profile])
+        s3a_settings.update(s3a_options or {})
+
+        for key, value in s3a_settings.items():
+            # the commit protocol is read from the Spark SQL configuration, not the Hadoop one
+            if key.startswith('spark.'):
+                spark.conf.set(key, value)
+            else:
+                hadoop_config.set(key, value)
+
     return spark
 
 
-def clean_data(data):
-    """Cleans the provided PySpark RDD by:
-           * replacing empty content
-           * removing HTML tags 
-           * standardizing column names
+def snake_case_name(column):
+    """Converts a column name to snake case using Uppercase as the delimiter
 
     Args:
-        data (pyspark.rdd.RDD): the PySpark RDD containing the data
+        column (str): the column name
 
     Returns:
-        pyspark.rdd.RDD: the cleaned PySpark RDD
+        str: the snake case column name
     """
-    # numeric attributes should have missing values replaced with -1
-    numeric_attributes = ['AreaNet', 'Bathrooms', 'Bedrooms',
-                          'PriceCurrencyFormated', 'Latitude', 'Longitude']
-    # textual attributes should have missing values replaced with "Unknown"
-    textual_attributes = ['Broker', 'Country', 'County',
-                          'Description', 'Parish', 'PropertyType', 'Title']
+    column_tokens = re.sub(r"([A-Z])", r" \1", column).split()
+    column_tokens = [token.lower() for token in column_tokens]
 
-    # replace missing numeric attributes with default values
-    data = data.fillna(-1, subset=numeric_attributes)
+    return '_'.join(column_tokens)
 
-    # replace missing textual attributes with default values
-    data = data.fillna("Unknown", subset=textual_attributes)
 
-    # remove html tags from the Description and Title attributes
-    data = data.withColumn('Description', regexp_replace("Description", """<(?!\/?a(?=>|\s.*>))\/?.*?>""", "")). \
-        withColumn('Title', regexp_replace(
-            "Title", """<(?!\/?a(?=>|\s.*>))\/?.*?>""", ""))
+def normalize_columns(data, column_specs=COLUMN_SPECS):
+    """Cleans, truncates and renames the columns of a PySpark RDD in a single projection, equivalent to
+       the previous clean_data, limit_length and to_snake_case chain without one projection per column.
+       Columns without a spec are kept and renamed to snake case.
 
-    # rename the price column to match the database's
-    data = data.withColumnRenamed("PriceCurrencyFormated", "Price")
+    Args:
+        data (pyspark.rdd.RDD): the target PySpark RDD
+        column_specs (list, optional): the (source name, target name, default fill, maximum length, strip HTML) specs
 
-    return data
+    Returns:
+        pyspark.rdd.RDD: the normalized PySpark RDD
+    """
+    specs = {spec[0]: spec for spec in column_specs}
+    projection = []
 
+    for field in data.schema.fields:
+        _, target_name, default, max_length, strip_html = specs.get(
+            field.name, (field.name, snake_case_name(field.name), None, None, False))
 
-def limit_length(data, column_name, length_threshold):
-    """Truncates a column to a maximum length, effectivelly removing any content above the specified threshold.
+        expression = col(field.name)
 
-    Args:
-        data (pyspark.rdd.RDD): the target Pyspark RDD
-        column_name (str): the column to limit
-        length_threshold (int): the maximum column length, above which, data is deleted
+        if default is not None:
+            expression = coalesce(expression, lit(default))
 
-    Returns:
-        pyspark.rdd.RDD: the modified RDD
-    """
-    column_obj = col(column_name)
+            # fillna also replaces NaN in floating point columns
+            if isinstance(field.dataType, (DoubleType, FloatType)):
+                expression = nanvl(expression, lit(default))
 
-    data = data.withColumn(column_name,
-                           when(length(column_obj) > length_threshold, substring(
-                               column_obj, 1, length_threshold)).otherwise(column_obj)
-                           )
+        if strip_html:
+            expression = regexp_replace(expression, HTML_TAG_PATTERN, "")
 
-    return data
+        if max_length is not None:
+            expression = substring(expression, 1, max_length)
 
+        projection.append(expression.alias(target_name))
 
-def to_snake_case(data):
-    """Converts all column names in a given Spark RDD to snake case
+    return data.select(projection)
+
+
+def delete_s3_batch(s3, bucket, keys):
+    """Deletes a batch of up to S3_DELETE_BATCH_SIZE keys with a single request
 
     Args:
-        data (pyspark.rdd.RDD): the target Pyspark RDD
+        s3 (botocore.client.S3): the boto3 S3 client
+        bucket (str): the AWS S3 bucket
+        keys (list): the keys to delete
 
     Returns:
-        pyspark.rdd.RDD: the modified Pyspark RDD
+        int: the number of deleted keys
     """
-    # rename all columns to Snake Case using Uppercase as the delimiter
-    for column in data.columns:
-        column_tokens = re.sub(r"([A-Z])", r" \1", column).split()
-        column_tokens = [token.lower() for token in column_tokens]
-        new_column_name = '_'.join(column_tokens)
+    response = s3.delete_objects(
+        Bucket=bucket,
+        Delete={
+            'Objects': [{'Key': key} for key in keys],
+            # only the failed deletions are returned
+            'Quiet': True
+        }
+    )
 
-        # faster than using toDF(*columns)
-        data = data.withColumnRenamed(column, new_column_name)
+    errors = response.get('Errors', [])
 
-    return data
+    for error in errors:
+        print('delete_s3_batch:: Could not delete {}, {}'.format(error.get('Key'), error.get('Message')))
 
+    return len(keys) - len(errors)
 
-def remove_tmp_files(aws_key, aws_secret, bucket, prefix):
+
+def remove_tmp_files(aws_key, aws_secret, bucket, prefix, dry_run=False, max_workers=8, endpoint_url=None):
     """Removes metadata and temporary files from an S3 bucket
 
     Args:
@@ -124,35 +367,212 @@ def remove_tmp_files(aws_key, aws_secret, bucket, prefix):
         aws_secret (str): the AWS secret key
         bucket (str): the AWS S3 bucket
         prefix (str): the AWS S3 bucket's prefix
+        dry_run (bool, optional): lists the matching files without deleting them. Defaults to False
+        max_workers (int, optional): the maximum number of concurrent deletion requests. Defaults to 8
+        endpoint_url (str, optional): a custom S3 endpoint (e.g. a local S3 stand-in). Defaults to AWS S3
+
+    Returns:
+        int: the number of deleted (or, if dry_run, matching) files
     """    
     
     s3 = boto3.client('s3', aws_access_key_id=aws_key,
-                      aws_secret_access_key=aws_secret)
-    deletion_pattern = ['_SUCESS', '_committed', '_started']
+                      aws_secret_access_key=aws_secret, endpoint_url=endpoint_url)
+    deletion_pattern = ['_SUCCESS', '_committed', '_started']
 
-    response = s3.list_objects(
-        Bucket=bucket,
-        Prefix=prefix
-    )
+    # list_objects returns at most 1000 keys per request, paginate through every page
+    paginator = s3.get_paginator('list_objects_v2')
+    matching_keys = []
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for file in page.get('Contents', []):
+            file_name = file['Key']
+
+            # delete any file matching the provided pattern
+            if any(domain in file_name for domain in deletion_pattern):
+                matching_keys.append(file_name)
+
+    if dry_run:
+        for file_name in matching_keys:
+            print('remove_tmp_files:: Would delete {}'.format(file_name))
+
+        return len(matching_keys)
+
+    batches = [matching_keys[index:index + S3_DELETE_BATCH_SIZE]
+               for index in range(0, len(matching_keys), S3_DELETE_BATCH_SIZE)]
+
+    # boto3 clients are thread safe, the batches are shared by a bounded pool
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        deleted_count = sum(executor.map(lambda batch: delete_s3_batch(s3, bucket, batch), batches))
+
+    return deleted_count
+
+
+def remove_local_tmp_files(root, prefix, dry_run=False):
+    """Removes metadata and temporary files from a local file system folder
+
+    Args:
+        root (str): the local root folder, e.g. /tmp/manifold
+        prefix (str): the folder within the root
+        dry_run (bool, optional): lists the matching files without deleting them. Defaults to False
+
+    Returns:
+        int: the number of deleted (or, if dry_run, matching) files
+    """
+    deletion_pattern = ['_SUCCESS', '_committed', '_started']
+    deleted_count = 0
+
+    for folder, _, files in os.walk(os.path.join(root, prefix)):
+        for file_name in files:
+            # Spark also writes a checksum file (.<name>.crc) per metadata file
+            if any(domain in file_name for domain in deletion_pattern):
+                if dry_run:
+                    print('remove_local_tmp_files:: Would delete {}'.format(os.path.join(folder, file_name)))
+                else:
+                    os.remove(os.path.join(folder, file_name))
+
+                deleted_count += 1
+
+    return deleted_count
+
+
+def log_stage_metrics(spark_context, job_group):
+    """Logs the jobs, stages and tasks run by a job group, stages reused from cached or shuffled data are reported as skipped
+
+    Args:
+        spark_context (pyspark.SparkContext): the PySpark Context running the job group
+        job_group (str): the job group identifier
+    """
+    status_tracker = spark_context.statusTracker()
+
+    job_ids = status_tracker.getJobIdsForGroup(job_group)
+    stage_ids = set()
+
+    for job_id in job_ids:
+        job_info = status_tracker.getJobInfo(job_id)
+
+        if job_info:
+            stage_ids.update(job_info.stageIds)
+
+    stage_count = 0
+    skipped_count = 0
+    task_count = 0
+    failed_task_count = 0
+
+    for stage_id in sorted(stage_ids):
+        stage_info = status_tracker.getStageInfo(stage_id)
+
+        # skipped stages are never submitted, hence run no tasks
+        if stage_info is None or stage_info.numCompletedTasks == 0:
+            skipped_count += 1
+            continue
+
+        stage_count += 1
+        task_count += stage_info.numCompletedTasks
+        failed_task_count += stage_info.numFailedTasks
+
+        print('Stage {} ({}): {} tasks'.format(stage_id, stage_info.name, stage_info.numCompletedTasks))
+
+    print('Stage metrics for {}: {} jobs, {} stages run, {} stages skipped, {} tasks, {} failed tasks.'.format(
+        job_group, len(job_ids), stage_count, skipped_count, task_count, failed_task_count))
+
+
+def estimate_file_count(data, target_file_mb):
+    """Estimates the number of Parquet files needed to approach the target file size, based on the optimizer's size statistics.
+       Once a persisted PySpark RDD is materialized, its statistics hold the measured in-memory size.
+       note: without CBO the statistics of a join are the product of its inputs', join outputs should be sized after their inputs
+
+    Args:
+        data (pyspark.rdd.RDD): the PySpark RDD to be saved, or the PySpark RDD bounding its size
+        target_file_mb (int): the target file size in megabytes
+
+    Returns:
+        int: the estimated number of files, between 1 and MAX_OUTPUT_FILES
+    """
+    # the statistics reflect the uncompressed in-memory size, the Parquet output is considerably smaller
+    estimated_bytes = int(data._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    estimated_bytes = estimated_bytes / PARQUET_COMPRESSION_RATIO
+
+    file_count = int(estimated_bytes // (target_file_mb * 1024 * 1024)) + 1
+
+    return max(1, min(file_count, MAX_OUTPUT_FILES))
+
+
+def get_output_files(data, destination):
+    """Retrieves the Parquet files written to the destination
+
+    Args:
+        data (pyspark.rdd.RDD): the saved PySpark RDD, used to access the Hadoop file system
+        destination (str): the destination path
+
+    Returns:
+        list: the (file path, number of bytes) tuples of each Parquet file
+    """
+    spark_context = data.sql_ctx._sc
+    path = spark_context._jvm.org.apache.hadoop.fs.Path(destination)
+    file_system = path.getFileSystem(spark_context._jsc.hadoopConfiguration())
+
+    output_files = []
+
+    # recursive listing, partitioned outputs are stored in subfolders
+    files = file_system.listFiles(path, True)
+
+    while files.hasNext():
+        file_status = files.next()
+
+        if file_status.getPath().getName().endswith('.parquet'):
+            output_files.append((file_status.getPath().toString(), file_status.getLen()))
 
-    # loop through each file
-    for file in response['Contents']:
-        file_name = file['Key']
+    return output_files
 
-        # delete any file matching the provided pattern
-        if any(domain in file_name for domain in deletion_pattern):
-            s3.delete_object(Bucket=bucket, Key=file_name)
 
+def write_copy_manifest(data, output_files, manifest_loc):
+    """Writes a Redshift COPY manifest listing the provided Parquet files, sparing Redshift the prefix listing
 
-def to_parquet(data, destination):
+    Args:
+        data (pyspark.rdd.RDD): the saved PySpark RDD, used to access the Hadoop file system
+        output_files (list): the (file path, number of bytes) tuples, as retrieved by get_output_files
+        manifest_loc (str): the manifest destination path
+    """
+    # Redshift only accepts the s3 scheme, Parquet manifests require the content length of every file
+    # note: an output without files still gets its (empty) manifest, the S3ToRedshiftOperator then skips its COPY
+    manifest = {
+        'entries': [
+            {
+                'url': re.sub(r'^s3[an]://', 's3://', file_path),
+                'mandatory': True,
+                'meta': {'content_length': byte_count}
+            } for file_path, byte_count in output_files
+        ]
+    }
+
+    spark_context = data.sql_ctx._sc
+    path = spark_context._jvm.org.apache.hadoop.fs.Path(manifest_loc)
+    file_system = path.getFileSystem(spark_context._jsc.hadoopConfiguration())
+
+    stream = file_system.create(path, True)
+
+    try:
+        stream.write(bytearray(json.dumps(manifest, indent=2).encode('utf-8')))
+    finally:
+        stream.close()
+
+
+def to_parquet(data, destination, file_count=None, target_file_mb=None, compression='snappy', partition_columns=None):
     """Saves the provided PySpark RDD into the provided destination in a Parquet format
 
     Args:
-        data (pyspark.rdd.RDD): [description]
-        destination (str): [description]
+        data (pyspark.rdd.RDD): the PySpark RDD to be saved
+        destination (str): the destination path
+        file_count (int, optional): the number of files to write (e.g. the number of Redshift slices), takes precedence over target_file_mb
+        target_file_mb (int, optional): the target file size in megabytes, the number of files is estimated from it
+        compression (str, optional): the Parquet compression codec. Defaults to 'snappy'
+        partition_columns (list, optional): the columns to partition the output by
 
     Raises:
         ValueError: invalid input arguments
+
+    Returns:
+        list: the (file path, number of bytes) tuples of each written file
     """    
     
     if data is None:
@@ -161,10 +581,99 @@ def to_parquet(data, destination):
     if destination is None or len(destination) == 0:
         raise ValueError('to_parquet:: Could not retrieve destination path')
 
-    data.write.parquet(destination, mode='overwrite')
+    if file_count is None and target_file_mb:
+        file_count = estimate_file_count(data, target_file_mb)
+
+    if partition_columns:
+        # Redshift's COPY does not read the partition values from the path, the partition columns are duplicated
+        # to keep the original columns in the files
+        partition_names = ['partition_' + column for column in partition_columns]
+
+        for column, partition_name in zip(partition_columns, partition_names):
+            data = data.withColumn(partition_name, col(column))
+
+        # group each partition value in the same task, avoiding a file per task and partition value
+        if file_count:
+            data = data.repartition(file_count, *partition_names)
+        else:
+            data = data.repartition(*partition_names)
+    elif file_count:
+        # avoid a shuffle when reducing the number of files, the outputs mostly stem from shuffles (distinct, joins)
+        # note: the actual partition count is only known by executing the plan (e.g. adaptive execution), hence the configuration
+        if file_count < int(data.sql_ctx.getConf('spark.sql.shuffle.partitions', '200')):
+            data = data.coalesce(file_count)
+        else:
+            data = data.repartition(file_count)
+
+    data.write.parquet(destination, mode='overwrite',
+                       partitionBy=partition_names if partition_columns else None, compression=compression)
+
+    return get_output_files(data, destination)
+
+
+def with_row_hash(data, algorithm='sha256'):
+    """Adds a hash column computed over every column of the provided PySpark RDD
+
+    Args:
+        data (pyspark.rdd.RDD): the target PySpark RDD
+        algorithm (str, optional): the hash algorithm, one of HASH_ALGORITHMS. Defaults to 'sha256'
+
+    Raises:
+        ValueError: unknown or unsupported algorithm
+
+    Returns:
+        pyspark.rdd.RDD: the PySpark RDD with the additional hash column
+    """
+    columns = data.columns
+
+    if algorithm == 'sha256':
+        row_hash = sha2(concat_ws("||", *columns), 256)
+    elif algorithm == 'binary':
+        # the raw digest takes half the space of its hex representation
+        row_hash = unhex(sha2(concat_ws("||", *columns), 256))
+    elif algorithm == 'xxhash64':
+        if xxhash64 is None:
+            raise ValueError('with_row_hash:: xxhash64 requires Spark 3.0 or above')
 
+        # hashes the columns directly, without building the concatenated string
+        row_hash = xxhash64(*columns)
+    else:
+        raise ValueError('with_row_hash:: Unknown hash algorithm {}'.format(algorithm))
+
+    return data.withColumn("hash", row_hash)
+
+
+def compute_asset_delta(asset_staging, previous_hashes, execution_date):
+    """Compares the current assets against the previous period's hashes, using contract_number as the business key
+
+    Args:
+        asset_staging (pyspark.rdd.RDD): the current period's assets, including the hash
+        previous_hashes (pyspark.rdd.RDD): the previous period's contract_number and hash
+        execution_date (str): the execution date, used as the deletion date of the tombstones
 
-def create_dimensional_partitions(data, parquet_loc, execution_date):
+    Returns:
+        tuple: the new and changed assets, and the tombstones (contract_number, deletion_date) of the deleted assets
+    """
+    previous_hashes = previous_hashes.select(
+        'contract_number', col('hash').alias('previous_hash')).distinct()
+
+    # a single full outer join identifies new, changed and deleted assets
+    asset_comparison = asset_staging.join(
+        previous_hashes, on='contract_number', how='full_outer')
+
+    # new (no previous hash) or changed (different hash) assets
+    asset_delta = asset_comparison.filter(col('hash').isNotNull() & (col('previous_hash').isNull() | (col('hash') != col('previous_hash'))))\
+        .select(asset_staging.columns)
+
+    # assets present in the previous period only
+    asset_tombstone = asset_comparison.filter(col('hash').isNull())\
+        .select('contract_number', lit(execution_date).cast('string').alias('deletion_date')).distinct()
+
+    return asset_delta, asset_tombstone
+
+
+def create_dimensional_partitions(data, parquet_loc, execution_date, previous_hashes=None, output_options=None, stock_partition_columns=None,
+                                  hash_algorithm='sha256', write_manifests=True):
     """Creates the dimensional objects (Dimensions, Facts) from a PySpark RDD and outputs them to the Parquet format
        to be processed by Redshift.
 
@@ -172,25 +681,47 @@ def create_dimensional_partitions(data, parquet_loc, execution_date):
         data (pyspark.rdd.RDD): the base PySpark RDD
         parquet_loc (str): the output path where the Parquet files are to be saved
         execution_date (str): the execution date
+        previous_hashes (pyspark.rdd.RDD, optional): the previous period's asset hashes, if provided only the asset delta is saved
+        output_options (dict, optional): the to_parquet file sizing and compression options (file_count, target_file_mb, compression)
+        stock_partition_columns (list, optional): the columns to partition the asset stock by (e.g. country, county)
+        hash_algorithm (str, optional): the dimension hash algorithm, one of HASH_ALGORITHMS. Defaults to 'sha256'
+        write_manifests (bool, optional): writes a Redshift COPY manifest per dataset to <parquet_loc>manifests/. Defaults to True
     """
+    output_options = output_options or {}
 
     broker_staging = data.select(['broker']).distinct()
 
-    # calculate hash using SHA2
-    broker_staging = broker_staging.withColumn(
-        "hash", sha2(concat_ws("||", *broker_staging.columns), 256))
+    # calculate the hash using the selected algorithm
+    broker_staging = with_row_hash(broker_staging, hash_algorithm)
 
     # geography dim
     geography_staging = data.select(['country', 'county', 'parish']).distinct()
-    geography_staging = geography_staging.withColumn("hash", sha2(
-        concat_ws("||", *geography_staging.columns), 256))
+    geography_staging = with_row_hash(geography_staging, hash_algorithm)
     
-    asset_staging = data.select(['contract_number', 'country', 'county', 'parish', 'title', 'description',
-                            'price', 'property_type', 'bathrooms', 'bedrooms', 'area_net', 'latitude', 'longitude']).distinct()
+    asset_staging = data.select(ASSET_ATTRIBUTES).distinct()
+
+    # calculate the hash using the selected algorithm
+    asset_staging = with_row_hash(asset_staging, hash_algorithm)
 
-    # calculate hash using SHA2
-    asset_staging = asset_staging.withColumn(
-        "hash", sha2(concat_ws("||", *asset_staging.columns), 256))
+    # the assets feed the staging, hashes and delta outputs, avoid computing the distinct once per output
+    asset_staging.persist(data.storageLevel if data.is_cached else StorageLevel.MEMORY_AND_DISK)
+
+    # the complete set of asset hashes, used by the following period's delta
+    asset_hashes = asset_staging.select(['contract_number', 'hash'])
+
+    # tombstones are only computed in delta mode
+    asset_tombstone = data.sql_ctx.createDataFrame([], schema=TOMBSTONE_SCHEMA)
+
+    # keep a reference to the persisted assets, the delta replaces asset_staging
+    persisted_assets = asset_staging
+
+    if previous_hashes is not None:
+        asset_staging, asset_tombstone = compute_asset_delta(
+            asset_staging, previous_hashes, execution_date)
+
+    # records the mode actually applied, the dimension close-out only trusts the tombstones of a delta
+    extraction_mode = data.sql_ctx.createDataFrame(
+        [('delta' if previous_hashes is not None else 'full', str(execution_date))], schema=EXTRACTION_MODE_SCHEMA)
 
     # weekly stock base
     asset_stock = data.select(['broker', 'contract_number', 'country', 'county', 'parish', 'price']).withColumn(
@@ -199,36 +730,380 @@ def create_dimensional_partitions(data, parquet_loc, execution_date):
     # save the data onto parquet to be consumed by Redshift
     broker_staging_loc = parquet_loc + "broker_staging.parquet"
     asset_staging_loc = parquet_loc + "asset_staging.parquet"
+    asset_hashes_loc = parquet_loc + "asset_hashes.parquet"
+    asset_tombstone_loc = parquet_loc + "asset_tombstone.parquet"
     geography_staging_loc = parquet_loc + "geography.parquet"
     stock_staging_loc = parquet_loc + "asset_stock.parquet"
+    extraction_mode_loc = parquet_loc + "extraction_mode.parquet"
+
+    outputs = [
+        ('broker_staging', broker_staging, broker_staging_loc, None),
+        ('asset_staging', asset_staging, asset_staging_loc, None),
+        ('asset_hashes', asset_hashes, asset_hashes_loc, None),
+        ('asset_tombstone', asset_tombstone, asset_tombstone_loc, None),
+        ('geography_staging', geography_staging, geography_staging_loc, None),
+        ('asset_stock', asset_stock, stock_staging_loc, stock_partition_columns),
+        ('extraction_mode', extraction_mode, extraction_mode_loc, None),
+    ]
+
+    spark_context = data.sql_ctx._sc
+
+    # the delta outputs stem from a join, whose estimated size is the product of its inputs' (without CBO): they are sized
+    # after the bounding inputs instead, the delta after the (measured) persisted assets and the tombstones after the previous hashes
+    size_bounds = {}
+
+    if previous_hashes is not None and output_options.get('file_count') is None and output_options.get('target_file_mb'):
+        spark_context.setJobGroup('write_asset_staging', 'Materialize the persisted assets')
+        persisted_assets.count()
+
+        size_bounds = {'asset_staging': persisted_assets, 'asset_tombstone': previous_hashes}
+
+    for output_name, output_data, output_loc, partition_columns in outputs:
+        # group each output's jobs to report its stage metrics
+        job_group = 'write_' + output_name
+        spark_context.setJobGroup(job_group, 'Save ' + output_loc)
+
+        output_file_options = dict(output_options)
+
+        if output_name in size_bounds:
+            output_file_options['file_count'] = estimate_file_count(size_bounds[output_name], output_options['target_file_mb'])
+        elif output_name == 'extraction_mode':
+            output_file_options['file_count'] = 1
+
+        output_files = to_parquet(
+            output_data, output_loc, partition_columns=partition_columns, **output_file_options)
+
+        print('Saved {} with {} files and {} bytes.'.format(
+            output_loc, len(output_files), sum(byte_count for _, byte_count in output_files)))
+
+        # kept outside the dataset's prefix, otherwise a prefix based COPY would load the manifest as well
+        if write_manifests:
+            write_copy_manifest(data, output_files, parquet_loc + 'manifests/' + output_loc[len(parquet_loc):] + '.manifest')
+
+        log_stage_metrics(spark_context, job_group)
+
+    persisted_assets.unpersist()
+
+
+def load_previous_hashes(spark, previous_parquet_loc):
+    """Loads the previous period's asset hashes, falling back to the asset staging files for periods without hash snapshots
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session to be used in the loading process
+        previous_parquet_loc (str): the previous period's parquet path
+
+    Returns:
+        pyspark.rdd.RDD: the previous period's contract_number and hash, or None if the previous period was not processed
+    """
+
+    for file_name in ["asset_hashes.parquet", "asset_staging.parquet"]:
+        try:
+            return spark.read.parquet(previous_parquet_loc + file_name).select(['contract_number', 'hash'])
+        except AnalysisException:
+            continue
+
+    return None
+
+
+def get_source_fields(broker, version=None):
+    """Retrieves the field definitions (source name, canonical name, type) of a broker's source schema
+
+    Args:
+        broker (str): the broker's name as registered in SOURCE_SCHEMAS
+        version (int, optional): the schema version, defaults to the latest registered version
+
+    Raises:
+        ValueError: the broker or version is not registered
+
+    Returns:
+        list: the list of (source name, canonical name, data type) tuples
+    """
 
-    to_parquet(broker_staging, broker_staging_loc)
-    to_parquet(asset_staging, asset_staging_loc)
-    to_parquet(geography_staging, geography_staging_loc)
-    to_parquet(asset_stock, stock_staging_loc)
+    if broker not in SOURCE_SCHEMAS:
+        raise ValueError('get_source_fields:: Unknown broker {}'.format(broker))
 
-def load_json_source(spark, source_path):
-    """Loads the JSON source data in the source_path to a Pyspark RDD
+    versions = SOURCE_SCHEMAS[broker]['versions']
+
+    if version is None:
+        version = max(versions)
+
+    if version not in versions:
+        raise ValueError('get_source_fields:: Unknown schema version {} for broker {}'.format(version, broker))
+
+    return versions[version]
+
+
+def get_source_defaults(broker):
+    """Retrieves the canonical attributes filled in for a broker whose source does not output them
+
+    Args:
+        broker (str): the broker's name as registered in SOURCE_SCHEMAS
+
+    Raises:
+        ValueError: the broker is not registered
+
+    Returns:
+        dict: the default value per canonical attribute name
+    """
+
+    if broker not in SOURCE_SCHEMAS:
+        raise ValueError('get_source_defaults:: Unknown broker {}'.format(broker))
+
+    return SOURCE_SCHEMAS[broker].get('defaults', {})
+
+
+def parse_numeric(column, numeric_format='decimal'):
+    """Parses a textual numeric attribute, as output by the crawlers, into a double
+
+    Args:
+        column (pyspark.sql.Column): the textual column
+        numeric_format (str, optional): the text format, 'currency', 'decimal' or 'area' (see NUMERIC_FORMATS). Defaults to 'decimal'
+
+    Raises:
+        ValueError: unknown numeric format
+
+    Returns:
+        pyspark.sql.Column: the parsed double, null if the text is missing or could not be parsed
+    """
+
+    if numeric_format == 'currency':
+        # drop the currency symbol and thousands separators, the decimal comma becomes a point
+        digits = regexp_replace(regexp_replace(column, r'[^0-9,]', ''), ',', '.')
+    elif numeric_format == 'decimal':
+        digits = regexp_replace(regexp_extract(column, r'^\s*([+-]?\d+(?:[.,]\d+)?)', 1), ',', '.')
+    elif numeric_format == 'area':
+        # drop the separators followed by exactly three digits, the remaining separator marks the decimals
+        digits = regexp_extract(column, r'^\s*([+-]?\d+(?:[. ]\d{3}(?!\d))*(?:[.,]\d+)?)', 1)
+        digits = regexp_replace(regexp_replace(digits, r'[. ](?=\d{3}(?!\d))', ''), ',', '.')
+    else:
+        raise ValueError('parse_numeric:: Unknown numeric format {}'.format(numeric_format))
+
+    # casting an invalid string yields null
+    return when(digits != '', digits.cast(DoubleType()))
+
+
+def load_source(spark, source_path, source_fields, source_format='json', quarantine_path=None, partitions=None, defaults=None):
+    """Loads the source data in the source_path to a Pyspark RDD using an explicit schema, avoiding the inference pass.
+       JSON attributes are read as text and the numeric ones parsed, records which are not valid JSON or hold a numeric
+       value which could not be parsed are removed and, if a quarantine_path is provided, saved as raw text.
 
     Args:
         spark (pyspark.sql.SparkSession): the PySpark Session to be used in the loading process
-        source_path (str): the path containing the source JSON files
+        source_path (str): the path containing the source files
+        source_fields (list): the (source name, canonical name, data type) tuples, as retrieved by get_source_fields
+        source_format (str, optional): the source format, one of SOURCE_FORMATS. Defaults to 'json'
+        quarantine_path (str, optional): the path where the invalid records are to be saved
+        partitions (int, optional): the number of partitions to redistribute the loaded data into
+        defaults (dict, optional): the default value per canonical attribute, as retrieved by get_source_defaults
+
+    Raises:
+        ValueError: unknown source format
+
+    Returns:
+        tuple: the PySpark RDD containing the loaded data, with the canonical attribute names, and the cached raw PySpark RDD
+               to be released once consumed
+    """
+
+    if source_format not in SOURCE_FORMATS:
+        raise ValueError('load_source:: Unknown source format {}'.format(source_format))
+
+    reader_format, _, reader_options = SOURCE_FORMATS[source_format]
+    defaults = defaults or {}
+
+    def with_default(expression, canonical_name):
+        if canonical_name in defaults:
+            return coalesce(expression, lit(defaults[canonical_name]))
+
+        return expression
+
+    if reader_format == 'parquet':
+        # only the declared attributes are read, the remaining are pruned by the reader
+        schema_fields = [StructField(source_name, data_type, True) for source_name, _, data_type in source_fields]
+        projection = [with_default(col(source_name), canonical_name).alias(canonical_name)
+                      for source_name, canonical_name, _ in source_fields]
+
+        raw_data = spark.read.format(reader_format)\
+            .schema(StructType(schema_fields))\
+            .load(source_path)
+
+        # cached for consistency with the JSON sources, the source is scanned once
+        raw_data.cache()
+
+        source_data = raw_data.select(projection)
+    else:
+        # every attribute is read as text, the numeric attributes are parsed into their declared type by the projection
+        schema_fields = [StructField(source_name, StringType(), True) for source_name, _, _ in source_fields]
+        projection = []
+        parse_failures = []
+
+        for source_name, canonical_name, data_type in source_fields:
+            expression = col(source_name)
+
+            if isinstance(data_type, (DoubleType, FloatType)):
+                expression = parse_numeric(expression, NUMERIC_FORMATS.get(canonical_name, 'decimal'))
+
+                # a value is present but could not be parsed
+                parse_failures.append(col(source_name).isNotNull()
+                                      & ~lower(trim(col(source_name))).isin(MISSING_NUMERIC_VALUES)
+                                      & expression.isNull())
+
+            projection.append(with_default(expression, canonical_name).alias(canonical_name))
+
+        parse_failed = reduce(lambda left, right: left | right, parse_failures, lit(False))
+
+        raw_data = spark.read.format(reader_format)\
+            .schema(StructType(schema_fields + [StructField(CORRUPT_RECORD_COLUMN, StringType(), True)]))\
+            .options(mode='PERMISSIVE', columnNameOfCorruptRecord=CORRUPT_RECORD_COLUMN, **reader_options)\
+            .load(source_path)
+
+        # Spark disallows querying the corrupt record column from the raw files, the data is cached to split it
+        raw_data.cache()
+
+        if quarantine_path:
+            # invalid JSON is kept as is, unparsable records are serialized back from their (textual) attributes
+            raw_data.filter(col(CORRUPT_RECORD_COLUMN).isNotNull() | parse_failed)\
+                .select(coalesce(col(CORRUPT_RECORD_COLUMN),
+                                 to_json(struct([col(source_name) for source_name, _, _ in source_fields]))))\
+                .write.text(quarantine_path, mode='overwrite')
+
+        # keep the valid records, renaming the source attributes to the canonical ones
+        source_data = raw_data.filter(col(CORRUPT_RECORD_COLUMN).isNull() & ~parse_failed)\
+            .select(projection)
+
+    # balance the source's tasks independently from the remaining sources
+    if partitions:
+        source_data = source_data.repartition(partitions)
+
+    return source_data, raw_data
+
+
+def load_source_manifest(spark, manifest_path):
+    """Loads a source manifest (see SOURCE_MANIFEST) from a JSON file
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session, used to read from any supported file system
+        manifest_path (str): the JSON manifest path
+
+    Raises:
+        ValueError: invalid manifest
+
+    Returns:
+        list: the source manifest
+    """
+
+    manifest = json.loads(spark.sparkContext.wholeTextFiles(manifest_path).values().first())
+
+    for source in manifest:
+        if 'broker' not in source or 'prefix' not in source:
+            raise ValueError('load_source_manifest:: Every source requires a broker and a prefix')
+
+        source.setdefault('format', 'json')
+        source.setdefault('partitions', None)
+
+    return manifest
+
+
+def load_sources(spark, data_loc, quarantine_loc, schema_versions, source_manifest=None):
+    """Loads every source listed in the source manifest present in data_loc, each through its own reader,
+       and combines them in a single PySpark RDD. The row count and read time of each source are emitted as metrics.
+
+    Args:
+        spark (pyspark.sql.SparkSession): the PySpark Session to be used in the loading process
+        data_loc (str): the path containing the source files
+        quarantine_loc (str): the path where each source's records not matching the schema are to be saved
+        schema_versions (dict): the schema version to use per broker, the latest version is used if absent
+        source_manifest (list, optional): the sources to load. Defaults to SOURCE_MANIFEST
+
+    Raises:
+        ValueError: a source in the manifest has no data, or no valid records
+
+    Returns:
+        tuple: the PySpark RDD containing the combined data, and the list of cached raw PySpark RDDs to be released once consumed
+    """
+
+    source_data = []
+    raw_data = []
+
+    for source in source_manifest or SOURCE_MANIFEST:
+        broker = source['broker']
+        source_name = source['prefix']
+        source_format = source['format']
+        source_fields = get_source_fields(broker, schema_versions.get(broker))
+        _, file_pattern, _ = SOURCE_FORMATS.get(source_format, (None, '', None))
+
+        start_time = time.time()
+
+        try:
+            data, raw = load_source(spark,
+                                    source_path=data_loc + source_name + file_pattern,
+                                    source_fields=source_fields,
+                                    source_format=source_format,
+                                    quarantine_path=quarantine_loc + source_name + '/',
+                                    partitions=source.get('partitions'),
+                                    defaults=get_source_defaults(broker))
+
+            # materialize the source to measure it in isolation, the following steps reuse the cached data
+            row_count = data.count()
+        except AnalysisException as exception:
+            # a missing source would be read as every one of its broker's assets having been removed (close_missing, delta tombstones)
+            raise ValueError('load_sources:: No source data found for source {}'.format(source_name)) from exception
+
+        if row_count == 0:
+            raise ValueError('load_sources:: No valid records found for source {}'.format(source_name))
+
+        emit_metric('source_rows', row_count, source=source_name, broker=broker)
+        emit_metric('source_read_seconds', round(time.time() - start_time, 3), source=source_name, broker=broker)
+
+        source_data.append(data)
+        raw_data.append(raw)
+
+    if len(source_data) == 0:
+        raise ValueError('load_sources:: Could not retrieve source data')
+
+    return reduce(lambda left, right: left.unionByName(right), source_data), raw_data
+
+
+def parse_key_value(value):
+    """Parses a key=value command-line argument
+
+    Args:
+        value (str): the argument, e.g. fs.s3a.multipart.size=256M
+
+    Raises:
+        argparse.ArgumentTypeError: the argument is not in the key=value format
 
     Returns:
-        pyspark.rdd.RDD: the PySpark RDD containing the loaded data
+        tuple: the key and value
     """
+    key, separator, setting = value.partition('=')
+
+    if not separator or not key:
+        raise argparse.ArgumentTypeError('expected key=value')
+
+    return key, setting
+
+
+def format_s3_path(s3_path_template, execution_date):
+    """Injects the execution date's time metadata in the S3 path template
 
-    json_data = spark.read.format(
-        'json').options(inferSchema='true').load(source_path)
+    Args:
+        s3_path_template (str): the S3 path template, e.g. /{year}/{month}/{week}/
+        execution_date (datetime.date): the execution date
 
-    # the allowed attribute subset, define a common base for all sources
-    allowed_attributes = ['Broker', 'ContractNumber', 'Country', 'County', 'Parish', 'Title', 'Description',
-                          'PriceCurrencyFormated', 'PropertyType', 'Bathrooms', 'Bedrooms', 'AreaNet', 'Latitude', 'Longitude']
+    Returns:
+        str: the formatted S3 path
+    """
 
-    # select only the common subset of attributes
-    json_data = json_data.select(allowed_attributes)
+    year = execution_date.year
+    month = execution_date.month
+    week = execution_date.isocalendar()[1]
+    day = execution_date.day
 
-    return json_data
+    return s3_path_template.format(year=year,
+                                   month=month,
+                                   week=week,
+                                   day=day
+                                   )
 
 
 def main():
@@ -246,19 +1121,53 @@ def main():
                         help='The execution date in ISO format'
                         )
 
-    # AWS configuration
+    # AWS configuration, not required by the file scheme
     parser.add_argument('-awsk',
                         '--aws_key',
                         type=str,
-                        required=True
+                        required=False,
+                        default=None
                         )
 
     parser.add_argument('-awss',
                         '--aws_secret',
                         type=str,
-                        required=True
+                        required=False,
+                        default=None
                         )
 
+    # storage configuration, the bucket is a local folder when using the file scheme
+    parser.add_argument('-ss',
+                        '--storage_scheme',
+                        type=str,
+                        required=False,
+                        choices=STORAGE_SCHEMES,
+                        default='s3',
+                        help='The source and destination storage scheme, file allows running against a local folder')
+
+    parser.add_argument('-s3e',
+                        '--s3_endpoint',
+                        type=str,
+                        required=False,
+                        default=None,
+                        help='A custom S3 endpoint (e.g. http://localhost:9000 for MinIO), requires the s3a scheme')
+
+    parser.add_argument('-s3ap',
+                        '--s3a_profile',
+                        type=str,
+                        required=False,
+                        choices=list(S3A_PROFILES),
+                        default='default',
+                        help='The S3A performance profile')
+
+    # e.g. --s3a_option fs.s3a.multipart.size=256M
+    parser.add_argument('-s3ao',
+                        '--s3a_option',
+                        type=parse_key_value,
+                        action='append',
+                        default=[],
+                        help='An S3A setting overriding the profile, in the key=value format')
+
     # S3 bucket location without the protocol, e.g. 's3://my_bucket' should be 'my_bucket
     parser.add_argument('-s3b',
                         '--s3_bucket',
@@ -282,59 +1191,204 @@ def main():
                         default='tmp',
                         help='The subfolder within the s3_path_template to be used for the temporary (parquet) files for Redshift')
 
+    parser.add_argument('-s3q',
+                        '--s3_quarantine_subfolder',
+                        type=str,
+                        required=False,
+                        default='quarantine',
+                        help='The subfolder within the s3_path_template where the records not matching the source schemas are saved')
+
+    # pin a broker's schema version, e.g. --schema_version century21=1, defaults to the latest version
+    parser.add_argument('-sv',
+                        '--schema_version',
+                        type=lambda value: (value.split('=')[0], int(value.split('=')[1])),
+                        action='append',
+                        default=[],
+                        help='The source schema version to use for a broker, in the broker=version format')
+
+    # full reprocesses the whole period, delta only outputs the assets changed since the previous period
+    parser.add_argument('-m',
+                        '--mode',
+                        type=str,
+                        required=False,
+                        choices=['full', 'delta'],
+                        default='full',
+                        help='The asset extraction mode, delta requires the previous period to have been processed')
+
+    parser.add_argument('-pd',
+                        '--previous_period_days',
+                        type=int,
+                        required=False,
+                        default=7,
+                        help='The number of days between the execution date and the previous period, used by the delta mode')
+
+    # output file sizing, Redshift's COPY loads one file per slice in parallel
+    parser.add_argument('-of',
+                        '--output_files',
+                        type=int,
+                        required=False,
+                        default=None,
+                        help='The number of parquet files per dataset, e.g. the number of Redshift slices')
+
+    parser.add_argument('-ofs',
+                        '--output_file_mb',
+                        type=int,
+                        required=False,
+                        default=None,
+                        help='The target parquet file size in MB (e.g. 64 to 256), ignored if output_files is set')
+
+    parser.add_argument('-oc',
+                        '--output_compression',
+                        type=str,
+                        required=False,
+                        choices=['snappy', 'gzip', 'uncompressed'],
+                        default='snappy',
+                        help='The parquet compression codec')
+
+    parser.add_argument('-sp',
+                        '--stock_partition_columns',
+                        type=str,
+                        nargs='*',
+                        choices=['country', 'county'],
+                        default=[],
+                        help='The columns to partition the asset stock parquet by')
+
+    parser.add_argument('-sl',
+                        '--storage_level',
+                        type=str,
+                        required=False,
+                        choices=['MEMORY_ONLY', 'MEMORY_ONLY_2', 'MEMORY_AND_DISK', 'MEMORY_AND_DISK_2', 'DISK_ONLY', 'OFF_HEAP'],
+                        default='MEMORY_AND_DISK',
+                        help='The storage level used to persist the cleaned data shared by every output')
+
+    parser.add_argument('-cdr',
+                        '--cleanup_dry_run',
+                        action='store_true',
+                        help='List the temporary S3 files matching the cleanup pattern without deleting them')
+
+    parser.add_argument('-cw',
+                        '--cleanup_workers',
+                        type=int,
+                        required=False,
+                        default=8,
+                        help='The maximum number of concurrent S3 deletion requests')
+
+    # the staging and presentation hash column types must match the algorithm, see helpers.sql_queries_staging
+    parser.add_argument('-ha',
+                        '--hash_algorithm',
+                        type=str,
+                        required=False,
+                        choices=HASH_ALGORITHMS,
+                        default='sha256',
+                        help='The dimension hash algorithm')
+
+    parser.add_argument('-sm',
+                        '--source_manifest',
+                        type=str,
+                        required=False,
+                        default=None,
+                        help='The JSON source manifest path, listing each source\'s prefix, format and partitions. Defaults to SOURCE_MANIFEST')
+
     args = parser.parse_args()
 
+    if args.s3_endpoint and args.storage_scheme != 's3a':
+        parser.error('--s3_endpoint requires the s3a storage scheme')
+
+    if args.storage_scheme != 'file' and (args.aws_key is None or args.aws_secret is None):
+        parser.error('--aws_key and --aws_secret are required by the {} storage scheme'.format(args.storage_scheme))
+
+    if args.cleanup_workers < 1:
+        parser.error('--cleanup_workers must be at least 1')
+
     # parse the configuration data
     date_formatted = args.execution_date
     aws_key = args.aws_key
     aws_secret = args.aws_secret
     s3_bucket = args.s3_bucket
+    storage_scheme = args.storage_scheme
     s3_path_template = args.s3_path_template
     # the subfolder within s3_path_template where the temporary parquet files are to be stored to be used by Redshift
     s3_path_subfolder = args.s3_path_subfolder
+    s3_quarantine_subfolder = args.s3_quarantine_subfolder
+    schema_versions = dict(args.schema_version)
+
+    mode = args.mode
+    output_options = {
+        'file_count': args.output_files,
+        'target_file_mb': args.output_file_mb,
+        'compression': args.output_compression,
+    }
+    stock_partition_columns = args.stock_partition_columns
+    storage_level = getattr(StorageLevel, args.storage_level)
+    previous_period_days = args.previous_period_days
 
     # generate the time metadata to be injected to the s3 template path
-    year = date_formatted.year
-    month = date_formatted.month
-    week = date_formatted.isocalendar()[1]
-    day = date_formatted.day
-
-    s3_path = s3_path_template.format(year=year,
-                                      month=month,
-                                      week=week,
-                                      day=day
-                                      )
+    s3_path = format_s3_path(s3_path_template, date_formatted)
 
     # the input data's (JSON) location
     data_loc = s3_bucket + s3_path
 
-    # the s3 bucket location s3://bucket_name/template_path/*.json
-    json_loc = 's3://' + data_loc + '*.json'
+    # the storage root, e.g. s3://bucket_name, s3a://bucket_name or file:///local_folder
+    storage_root = storage_scheme + '://'
+
+    # the s3 bucket location s3://bucket_name/template_path/, each source's files are matched by its prefix and format
+    json_loc = storage_root + data_loc
+
+    # the destination path of the records not matching the source schemas
+    quarantine_loc = storage_root + data_loc + s3_quarantine_subfolder + "/"
 
     # the parquet destination path
-    parquet_loc = 's3://' + data_loc + s3_path_subfolder + "/"
+    parquet_loc = storage_root + data_loc + s3_path_subfolder + "/"
+
+    # the previous period's parquet path, holding the hashes the delta mode compares against
+    previous_s3_path = format_s3_path(
+        s3_path_template, date_formatted - timedelta(days=previous_period_days))
+    previous_parquet_loc = storage_root + s3_bucket + previous_s3_path + s3_path_subfolder + "/"
 
     # create a spark session configured with the AWS credentials
     spark = create_spark_session(
-        aws_key=aws_key, aws_secret=aws_secret)
+        aws_key=aws_key, aws_secret=aws_secret, storage_scheme=storage_scheme, s3_endpoint=args.s3_endpoint,
+        s3a_profile=args.s3a_profile, s3a_options=dict(args.s3a_option))
 
-    # fetch the base JSON data for the applicable time period via json_loc
-    base_data = load_json_source(spark, json_loc)
+    source_manifest = SOURCE_MANIFEST
 
-    # cache the base_data given it will be reused further on
-    base_data.cache()
+    if args.source_manifest:
+        source_manifest = load_source_manifest(spark, args.source_manifest)
 
-    # perform data cleanup, normalization and limit
-    base_data = clean_data(base_data)
-    base_data = limit_length(base_data, 'Description', 250)
-    base_data = limit_length(base_data, 'Title', 250)
+    # the sources should be scanned once, by this job group only
+    spark.sparkContext.setJobGroup('load_sources', 'Load and normalize the sources')
 
-    # convert all column names to snake case
-    base_data = to_snake_case(base_data)
+    # fetch the base data for the applicable time period via json_loc
+    base_data, raw_data = load_sources(spark, json_loc, quarantine_loc, schema_versions, source_manifest)
+
+    # perform data cleanup, normalization, limit and snake case conversion in a single projection
+    base_data = normalize_columns(base_data)
+
+    # persist the cleaned data given it will be reused by every output, avoiding a cleanup replay per output
+    base_data.persist(storage_level)
+
+    # materialize the cleaned data
+    row_count = base_data.count()
+
+    print('Loaded {} rows.'.format(row_count))
+    log_stage_metrics(spark.sparkContext, 'load_sources')
+
+    # the cached raw sources are no longer required once the cleaned data is materialized
+    for data in raw_data:
+        data.unpersist()
+
+    previous_hashes = None
+
+    if mode == 'delta':
+        previous_hashes = load_previous_hashes(spark, previous_parquet_loc)
+
+        if previous_hashes is None:
+            print('Previous period not found at {}, falling back to full mode.'.format(previous_parquet_loc))
 
     # create the partitions and save the parquet files to be consumed by Redshift
     create_dimensional_partitions(
-        data=base_data, parquet_loc=parquet_loc, execution_date=date_formatted)
+        data=base_data, parquet_loc=parquet_loc, execution_date=date_formatted, previous_hashes=previous_hashes,
+        output_options=output_options, stock_partition_columns=stock_partition_columns, hash_algorithm=args.hash_algorithm)
 
     # remove temporary residual metadata files in S3
 
@@ -342,7 +1396,14 @@ def main():
     prefix_trailed = s3_path[1:]
     bucket = s3_bucket
 
-    remove_tmp_files(aws_key, aws_secret, bucket,  prefix_trailed)
+    if storage_scheme == 'file':
+        deleted_count = remove_local_tmp_files(bucket, prefix_trailed, dry_run=args.cleanup_dry_run)
+    else:
+        deleted_count = remove_tmp_files(aws_key, aws_secret, bucket, prefix_trailed,
+                                         dry_run=args.cleanup_dry_run, max_workers=args.cleanup_workers,
+                                         endpoint_url=args.s3_endpoint)
+
+    print('Removed {} temporary files{}.'.format(deleted_count, ' (dry run)' if args.cleanup_dry_run else ''))
     
     print('Extraction and Loading to parquet complete.')
 
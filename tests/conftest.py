@@ -0,0 +1,35 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# el_to_parquet is deployed as a standalone script, not as a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+# the crawler modules are loaded by Scrapy from the crawler project folder, not as a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crawler', 'python'))
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture(scope='session')
+def spark():
+    """A local mode PySpark Session, the tests requiring it are skipped without PySpark or a Java runtime"""
+    pytest.importorskip('pyspark')
+
+    if shutil.which('java') is None and not os.environ.get('JAVA_HOME'):
+        pytest.skip('a Java runtime is required by PySpark')
+
+    from pyspark.sql import SparkSession
+
+    session = SparkSession.builder\
+        .master('local[2]')\
+        .appName('manifold_tests')\
+        .config('spark.sql.shuffle.partitions', 2)\
+        .config('spark.ui.enabled', 'false')\
+        .getOrCreate()
+
+    yield session
+
+    session.stop()
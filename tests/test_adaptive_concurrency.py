@@ -0,0 +1,87 @@
+import math
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy import Request, signals
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from assets import settings as project_settings
+from assets.extensions import AdaptiveConcurrency
+from assets.middlewares import ReplayCacheStorage, ReplayDownloaderMiddleware
+
+DOMAIN = 'www.century21.pt'
+RECORDED_LATENCY = 0.5
+
+
+def get_replay(tmp_path, statuses):
+    """Records a crawl of len(statuses) responses, each downloaded in RECORDED_LATENCY, then builds its replay"""
+    settings = {name: getattr(project_settings, name) for name in dir(project_settings) if name.startswith('ADAPTIVE_CONCURRENCY_')}
+    settings.update({'ADAPTIVE_CONCURRENCY_ENABLED': True, 'ADAPTIVE_CONCURRENCY_START_CONCURRENCY': 1,
+                     'ADAPTIVE_CONCURRENCY_WINDOW': 10, 'AUTOTHROTTLE_ENABLED': False})
+
+    crawler = get_crawler(settings_dict=settings)
+    spider = crawler._create_spider('pt_century21')
+
+    storage = ReplayCacheStorage(Settings({'HTTPCACHE_DIR': str(tmp_path), 'HTTPCACHE_EXPIRATION_SECS': 0}))
+    storage.open_spider(spider)
+
+    recorder = ReplayDownloaderMiddleware('record', storage, crawler.stats)
+
+    for index, status in enumerate(statuses):
+        request = Request('https://{}/comprar/{}'.format(DOMAIN, index), meta={'download_latency': RECORDED_LATENCY})
+        recorder.process_response(request, HtmlResponse(request.url, status=status, body=b'<html></html>'), spider)
+
+    return crawler, spider, ReplayDownloaderMiddleware('replay', storage, crawler.stats)
+
+
+def replay(crawler, spider, middleware, responses):
+    # connects to the crawler's response_received signal, fired by the engine for every downloaded response
+    # note: the signal holds a weak reference to the extension, which must outlive the replay
+    extension = AdaptiveConcurrency.from_crawler(crawler)
+
+    for index in range(responses):
+        request = Request('https://{}/comprar/{}'.format(DOMAIN, index))
+        response = middleware.process_request(request, spider)
+
+        crawler.signals.send_catch_log(signals.response_received, response=response, request=request, spider=spider)
+
+    del extension
+
+    return crawler.stats.get_stats()
+
+
+def test_replay_restores_the_recorded_latency_and_status(tmp_path):
+    crawler, spider, middleware = get_replay(tmp_path, [200, 429])
+
+    first_request, second_request = Request('https://{}/comprar/0'.format(DOMAIN)), Request('https://{}/comprar/1'.format(DOMAIN))
+
+    assert middleware.process_request(first_request, spider).status == 200
+    assert middleware.process_request(second_request, spider).status == 429
+    assert first_request.meta['download_latency'] == RECORDED_LATENCY
+
+
+def test_replay_converges_to_the_target_throughput(tmp_path):
+    crawler, spider, middleware = get_replay(tmp_path, [200] * 40)
+
+    stats = replay(crawler, spider, middleware, 40)
+    target_concurrency = math.ceil(project_settings.ADAPTIVE_CONCURRENCY_TARGET_THROUGHPUT * RECORDED_LATENCY)
+
+    # one increase from the start concurrency (Little's law), then holding
+    assert stats['adaptive_concurrency/{}/concurrency'.format(DOMAIN)] == target_concurrency
+    assert stats['adaptive_concurrency/{}/decisions/increase'.format(DOMAIN)] == 1
+    assert stats['adaptive_concurrency/{}/decisions/hold'.format(DOMAIN)] == 3
+
+
+def test_replayed_throttling_backs_off(tmp_path):
+    crawler, spider, middleware = get_replay(tmp_path, [200] * 10 + [429] * 10)
+
+    stats = replay(crawler, spider, middleware, 20)
+
+    assert stats['adaptive_concurrency/{}/last_decision'.format(DOMAIN)] == 'backoff'
+    assert stats['adaptive_concurrency/{}/concurrency'.format(DOMAIN)] == math.ceil(
+        project_settings.ADAPTIVE_CONCURRENCY_TARGET_THROUGHPUT * RECORDED_LATENCY) // 2
+    assert stats['adaptive_concurrency/{}/delay'.format(DOMAIN)] > 0
@@ -0,0 +1,16 @@
+import argparse
+
+import pytest
+
+el_to_parquet = pytest.importorskip('el_to_parquet')
+
+
+def test_key_value_arguments_are_split_on_the_first_equal_sign():
+    assert el_to_parquet.parse_key_value('fs.s3a.multipart.size=256M') == ('fs.s3a.multipart.size', '256M')
+    assert el_to_parquet.parse_key_value('fs.s3a.custom.header=a=b') == ('fs.s3a.custom.header', 'a=b')
+
+
+@pytest.mark.parametrize('value', ['fs.s3a.multipart.size', '=256M'])
+def test_invalid_key_value_arguments_are_rejected(value):
+    with pytest.raises(argparse.ArgumentTypeError, match='expected key=value'):
+        el_to_parquet.parse_key_value(value)
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from conftest import FIXTURES_PATH
+
+el_to_parquet = pytest.importorskip('el_to_parquet')
+
+SOURCES_PATH = 'file://' + os.path.join(FIXTURES_PATH, 'sources') + '/'
+
+
+def test_delta_outputs_are_sized_after_their_inputs(spark, tmp_path):
+    data, _ = el_to_parquet.load_sources(spark, SOURCES_PATH, 'file://' + str(tmp_path) + '/quarantine/', {})
+    data = el_to_parquet.normalize_columns(data).cache()
+
+    previous_hashes = spark.createDataFrame([('11230-0042', 'outdated'), ('11230-9999', 'deleted')], ['contract_number', 'hash'])
+    parquet_loc = 'file://' + str(tmp_path) + '/parquet/'
+
+    el_to_parquet.create_dimensional_partitions(data, parquet_loc, '2021-03-08', previous_hashes=previous_hashes,
+                                                output_options={'target_file_mb': 128})
+
+    # the join's estimated size would otherwise be the product of its inputs', clamped to MAX_OUTPUT_FILES
+    for output_name in ['asset_staging.parquet', 'asset_tombstone.parquet']:
+        output_path = tmp_path / 'parquet' / output_name
+
+        assert len([name for name in os.listdir(output_path) if name.endswith('.parquet')]) == 1
+
+
+@pytest.mark.parametrize('previous_hashes, mode', [(None, 'full'), ([('11230-0042', 'outdated')], 'delta')])
+def test_extraction_mode_records_the_applied_mode(spark, tmp_path, previous_hashes, mode):
+    data, _ = el_to_parquet.load_sources(spark, SOURCES_PATH, 'file://' + str(tmp_path) + '/quarantine/', {})
+    data = el_to_parquet.normalize_columns(data)
+
+    if previous_hashes is not None:
+        previous_hashes = spark.createDataFrame(previous_hashes, ['contract_number', 'hash'])
+
+    parquet_loc = 'file://' + str(tmp_path) + '/parquet/'
+
+    # a delta without a previous period falls back to full, its tombstones must not drive the dimension close-out
+    el_to_parquet.create_dimensional_partitions(data, parquet_loc, '2021-03-08', previous_hashes=previous_hashes)
+
+    assert [tuple(row) for row in spark.read.parquet(parquet_loc + 'extraction_mode.parquet').collect()] == [(mode, '2021-03-08')]
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from conftest import FIXTURES_PATH
+
+el_to_parquet = pytest.importorskip('el_to_parquet')
+
+# the crawlers' real output: the Go crawler's indented JSON array and the Scrapy JSON lines, every value a string
+SOURCES_PATH = 'file://' + os.path.join(FIXTURES_PATH, 'sources') + '/'
+
+
+def load(spark, tmp_path):
+    quarantine_path = 'file://' + str(tmp_path) + '/quarantine/'
+
+    data, _ = el_to_parquet.load_sources(spark, SOURCES_PATH, quarantine_path, {})
+    rows = {row['ContractNumber']: row for row in data.collect()}
+
+    quarantined = {}
+
+    for source in el_to_parquet.SOURCE_MANIFEST:
+        quarantined[source['prefix']] = spark.read.text(quarantine_path + source['prefix'] + '/').count()
+
+    return rows, quarantined
+
+
+def test_numeric_strings_are_parsed(spark, tmp_path):
+    rows, _ = load(spark, tmp_path)
+
+    assert rows['11230-0042']['PriceCurrencyFormated'] == 250000.0
+    assert rows['11230-0042']['AreaNet'] == 80.5
+    assert rows['11230-0042']['Latitude'] == 38.7223
+    assert rows['11230-0042']['Bedrooms'] == 2.0
+    assert rows['ERA-0001']['PriceCurrencyFormated'] == 1250000.5
+    assert rows['ERA-0001']['AreaNet'] == 120.0
+    assert rows['ERA-0002']['PriceCurrencyFormated'] == 180000.0
+    # a dot followed by exactly three digits groups the thousands of an area
+    assert rows['ERA-0004']['AreaNet'] == 1250.0
+
+
+def test_missing_values_are_kept_as_null(spark, tmp_path):
+    rows, _ = load(spark, tmp_path)
+
+    assert rows['11230-0043']['PriceCurrencyFormated'] is None
+    assert rows['11230-0043']['AreaNet'] is None
+    # a price disclosed on request is missing rather than invalid
+    assert rows['ERA-0004']['PriceCurrencyFormated'] is None
+
+
+def test_missing_attributes_use_the_broker_defaults(spark, tmp_path):
+    rows, _ = load(spark, tmp_path)
+
+    assert rows['11230-0042']['Broker'] == 'Century21'
+    assert rows['11230-0042']['Country'] == 'Portugal'
+    assert rows['ERA-0001']['Broker'] == 'ERA Imobiliária'
+
+
+def test_only_invalid_records_are_quarantined(spark, tmp_path):
+    rows, quarantined = load(spark, tmp_path)
+
+    # an unparsable latitude and a truncated JSON record
+    assert set(rows) == {'11230-0042', '11230-0043', 'ERA-0001', 'ERA-0002', 'ERA-0004'}
+    assert quarantined == {'pt_century21': 1, 'pt_era': 1}
+
+
+def test_missing_source_fails_the_job(spark, tmp_path):
+    quarantine_path = 'file://' + str(tmp_path) + '/quarantine/'
+    source_manifest = el_to_parquet.SOURCE_MANIFEST + [{'broker': 'era', 'prefix': 'pt_remax', 'format': 'json', 'partitions': None}]
+
+    with pytest.raises(ValueError, match='pt_remax'):
+        el_to_parquet.load_sources(spark, SOURCES_PATH, quarantine_path, {}, source_manifest)
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('bs4')
+
+from scrapy.utils.test import get_crawler
+from twisted.python.failure import Failure
+
+from assets.spiders.pt_century21 import PTCentury21Spider
+
+
+def get_spider(settings=None, **kwargs):
+    crawler = get_crawler(PTCentury21Spider, settings_dict=settings)
+
+    return crawler, crawler._create_spider(**kwargs)
+
+
+def fail(spider, request):
+    failure = Failure(ConnectionRefusedError('unreachable'))
+    failure.request = request
+
+    return list(spider._search_page_failed(failure))
+
+
+def test_page_size_is_capped_by_the_setting():
+    _, spider = get_spider({'CENTURY21_MAX_ITEMS_PER_PAGE': 50}, items_per_page='200')
+
+    request, = spider.start_requests()
+
+    assert 'numberOfElements=50&' in request.url
+
+
+def test_failed_first_page_is_retried_then_recorded():
+    crawler, spider = get_spider({'CENTURY21_FIRST_PAGE_RETRIES': 1}, district='Lisboa')
+
+    request, = spider.start_requests()
+    retried, = fail(spider, request)
+
+    assert retried.url == request.url and retried.dont_filter
+
+    # the retries are exhausted, the shard is recorded as failed rather than silently skipped
+    assert fail(spider, retried) == []
+    assert crawler.stats.get_value('century21/failed_shards') == 1
+    assert crawler.stats.get_value('century21/failed_shards/Lisboa') == request.url
@@ -0,0 +1,59 @@
+import pytest
+
+el_to_parquet = pytest.importorskip('el_to_parquet')
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+BUCKET = 'manifold-test'
+PREFIX = '2021/3/10/8/'
+
+# above a list_objects_v2 page and a delete_objects batch (1000 keys)
+TMP_FILES = 2500
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+
+    with moto.mock_aws():
+        client = boto3.client('s3', aws_access_key_id='test', aws_secret_access_key='test')
+        client.create_bucket(Bucket=BUCKET)
+
+        for index in range(TMP_FILES):
+            client.put_object(Bucket=BUCKET, Key='{}asset_staging.parquet/_temporary/{}/_SUCCESS'.format(PREFIX, index), Body=b'')
+
+        client.put_object(Bucket=BUCKET, Key=PREFIX + 'asset_staging.parquet/part-00000.snappy.parquet', Body=b'parquet')
+        client.put_object(Bucket=BUCKET, Key='2021/3/3/8/asset_staging.parquet/_SUCCESS', Body=b'')
+
+        yield client
+
+
+def list_keys(client):
+    paginator = client.get_paginator('list_objects_v2')
+
+    return [file['Key'] for page in paginator.paginate(Bucket=BUCKET) for file in page.get('Contents', [])]
+
+
+def test_removes_every_matching_file_across_pages_and_batches(s3, monkeypatch):
+    delete_requests = []
+    delete_s3_batch = el_to_parquet.delete_s3_batch
+
+    def record_batch(client, bucket, keys):
+        delete_requests.append(len(keys))
+
+        return delete_s3_batch(client, bucket, keys)
+
+    monkeypatch.setattr(el_to_parquet, 'delete_s3_batch', record_batch)
+
+    deleted_count = el_to_parquet.remove_tmp_files('test', 'test', BUCKET, PREFIX, max_workers=2)
+
+    assert deleted_count == TMP_FILES
+    assert sorted(delete_requests) == [500, 1000, 1000]
+    # only the period's temporary files are removed
+    assert set(list_keys(s3)) == {'2021/3/3/8/asset_staging.parquet/_SUCCESS',
+                                  PREFIX + 'asset_staging.parquet/part-00000.snappy.parquet'}
+
+
+def test_dry_run_keeps_the_files(s3):
+    assert el_to_parquet.remove_tmp_files('test', 'test', BUCKET, PREFIX, dry_run=True) == TMP_FILES
+    assert len(list_keys(s3)) == TMP_FILES + 2